@@ -1,17 +1,148 @@
-from django.contrib import admin
-from django.utils.translation import gettext, ugettext_lazy as _
+import calendar
+import datetime
+import hashlib
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, models, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext, ugettext_lazy as _, ungettext
+from . import cache as privateurl_cache, routers, settings as pu_settings
 from .models import PrivateUrl
 
 
+def invalidate_cache(queryset):
+    """
+    Removes objects of queryset from lookup cache after commit (call before bulk update or delete in transaction).
+    """
+    if not pu_settings.DJU_PRIVATEURL_CACHE_ACTIONS:
+        return
+    tokens = {}
+    for action, token in queryset.order_by().values_list('action', 'token').iterator():
+        if privateurl_cache.is_enabled(action):
+            tokens.setdefault(action, []).append(token)
+    for action, action_tokens in tokens.iteritems():
+        privateurl_cache.invalidate(action, action_tokens, using=queryset.db)
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Count of objects is cached for DJU_PRIVATEURL_ADMIN_COUNT_TIMEOUT seconds.
+    Count of whole table is estimated by statistics of postgresql if it is larger than DJU_PRIVATEURL_ADMIN_ESTIMATE_MIN.
+    Annotations (is_active of changelist) are not counted, datetime parameters of filters (current time of
+    status filter) are rounded to timeout in cache key.
+    """
+    @cached_property
+    def count(self):
+        qs = self.get_count_queryset(self.object_list)
+        key = self.make_cache_key(qs)
+        cache = privateurl_cache.get_cache()
+        count = cache.get(key)
+        if count is None:
+            count = self.estimate_count(qs) if not qs.query.where else None
+            if count is None:
+                count = qs.count()
+            cache.set(key, count, pu_settings.DJU_PRIVATEURL_ADMIN_COUNT_TIMEOUT)
+        return count
+
+    @staticmethod
+    def get_count_queryset(qs):
+        qs = qs.all()
+        qs.query.annotations.clear()  # annotations of clone
+        qs.query.set_annotation_mask(None)
+        qs.query.select_related = False
+        qs.query.clear_ordering(force_empty=True)
+        return qs
+
+    @staticmethod
+    def make_cache_key(qs):
+        timeout = max(pu_settings.DJU_PRIVATEURL_ADMIN_COUNT_TIMEOUT or 1, 1)
+        sql, params = qs.query.sql_with_params()
+        params = tuple(calendar.timegm(p.utctimetuple()) // timeout if isinstance(p, datetime.datetime) else p
+                       for p in params)
+        return 'dju_privateurl:admin-count:{}'.format(hashlib.md5(repr((qs.db, sql, params))).hexdigest())
+
+    @staticmethod
+    def estimate_count(qs):
+        connection = connections[qs.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [qs.model._meta.db_table])
+            row = cursor.fetchone()
+        if row is None or row[0] < pu_settings.DJU_PRIVATEURL_ADMIN_ESTIMATE_MIN:
+            return None
+        return int(row[0])
+
+
+class ActionListFilter(admin.SimpleListFilter):
+    """
+    Filter by action, list of actions of all databases (see routers.get_databases) is cached
+    for DJU_PRIVATEURL_ADMIN_ACTIONS_TIMEOUT seconds.
+    """
+    title = _('action')
+    parameter_name = 'action'
+    cache_key = 'dju_privateurl:admin-actions'
+
+    def lookups(self, request, model_admin):
+        cache = privateurl_cache.get_cache()
+        actions = cache.get(self.cache_key)
+        if actions is None:
+            actions = set()
+            for db in routers.get_databases(PrivateUrl):
+                actions.update(PrivateUrl.objects.using(db).order_by().values_list('action', flat=True).distinct())
+            actions = sorted(actions)
+            cache.set(self.cache_key, actions, pu_settings.DJU_PRIVATEURL_ADMIN_ACTIONS_TIMEOUT)
+        return [(action, action) for action in actions]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(action=self.value())
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    title = _('status')
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('active', _('active')),
+            ('expired', _('expired')),
+            ('exhausted', _('exhausted')),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() in PrivateUrl.objects.STATUSES:
+            return queryset.filter(PrivateUrl.objects.status_q(self.value()))
+
+
 class PrivateUrlAdmin(admin.ModelAdmin):
+    """
+    Changelist filtered by action shows objects of database of action (DJU_PRIVATEURL_ACTION_DATABASES),
+    without filter by action only objects of default database are shown.
+    """
     list_display = ('action_with_token', 'user', 'created', 'expire', 'used', 'available')
-    list_filter = ('action',)
+    list_filter = (ActionListFilter, StatusListFilter)
     list_select_related = ('user',)
     raw_id_fields = ('user',)
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+    actions = ('expire_selected', 'purge_selected')
 
     def __init__(self, *args, **kwargs):
         super(PrivateUrlAdmin, self).__init__(*args, **kwargs)
 
+    def get_queryset(self, request):
+        qs = super(PrivateUrlAdmin, self).get_queryset(request)
+        action = request.GET.get(ActionListFilter.parameter_name)
+        if action:
+            qs = qs.using(routers.db_for_read(PrivateUrl, action))
+        return qs.annotate(is_active=models.Case(
+            models.When(PrivateUrl.objects.status_q('active'), then=models.Value(True)),
+            default=models.Value(False),
+            output_field=models.BooleanField(),
+        ))
+
     def action_with_token(self, obj):
         return '{}/{}'.format(obj.action, obj.token)
     action_with_token.short_description = _('action/token')
@@ -21,9 +152,28 @@ class PrivateUrlAdmin(admin.ModelAdmin):
     used.short_description = _('used')
 
     def available(self, obj):
-        return obj.is_available()
-    used.short_description = _('available')
+        return obj.is_active
+    available.short_description = _('available')
+    available.admin_order_field = 'is_active'
     available.boolean = True
 
+    def expire_selected(self, request, queryset):
+        with transaction.atomic(using=queryset.db):
+            invalidate_cache(queryset)
+            count = queryset.order_by().update(expire=timezone.now())
+        self.message_user(request, ungettext(
+            '%d private url is expired.', '%d private urls are expired.', count
+        ) % count, messages.SUCCESS)
+    expire_selected.short_description = _('Expire selected private urls')
+
+    def purge_selected(self, request, queryset):
+        invalidate_cache(queryset)
+        pks = list(queryset.order_by().values_list('pk', flat=True))
+        count = PrivateUrl.objects.using(queryset.db).filter(pk__in=pks).delete()[1].get(PrivateUrl._meta.label, 0)
+        self.message_user(request, ungettext(
+            '%d private url is deleted.', '%d private urls are deleted.', count
+        ) % count, messages.SUCCESS)
+    purge_selected.short_description = _('Delete selected private urls')
+
 
 admin.site.register(PrivateUrl, PrivateUrlAdmin)
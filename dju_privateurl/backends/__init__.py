@@ -0,0 +1,18 @@
+from django.utils.module_loading import import_string
+from .. import settings as pu_settings
+
+
+_backends = {}  # path: (options, backend)
+
+
+def get_backend():
+    """
+    Returns instance of backend from DJU_PRIVATEURL_BACKEND (created once per path and options,
+    new instance is created when DJU_PRIVATEURL_BACKEND_OPTIONS are changed).
+    """
+    path = pu_settings.DJU_PRIVATEURL_BACKEND
+    options = pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS
+    item = _backends.get(path)
+    if item is None or item[0] != options:
+        item = _backends[path] = (dict(options), import_string(path)(**options))
+    return item[1]
@@ -0,0 +1,48 @@
+class BaseBackend(object):
+    """
+    Storage of PrivateUrl objects beneath PrivateUrl.create, PrivateUrlManager.get_or_none,
+    PrivateUrl.redeem and PrivateUrl.used_counter_inc.
+    """
+    use_cache = False  # whether lookups may be cached by dju_privateurl.cache
+
+    def insert(self, obj, replace=False):
+        """
+        Saves new obj. Returns False if token is already used for action.
+        replace=True: obj replaces objects of obj.user for obj.action, concurrent replaces leave only one of them.
+        """
+        raise NotImplementedError
+
+    def free_tokens(self, model, action, tokens):
+        """
+        Returns tokens which are not used for action (candidates for insert).
+        """
+        return list(tokens)
+
+    def count(self, model, action):
+        """
+        Returns number of objects of action or None if backend can't count them.
+        """
+        return None
+
+    def get(self, model, action, token, fast=False):
+        """
+        Returns object or None.
+        fast=True allows to load only model.FAST_LOOKUP_FIELDS (other fields are loaded on access).
+        """
+        raise NotImplementedError
+
+    def redeem(self, obj, dt):
+        """
+        Atomically checks availability of obj and increments its used_counter.
+        Updates used_counter, first_used and last_used of obj and returns True if obj is used.
+        """
+        raise NotImplementedError
+
+    def save_usage(self, obj, dt):
+        """
+        Saves usage of obj (used_counter, first_used, last_used are already updated in obj).
+        """
+        raise NotImplementedError
+
+    def delete(self, obj):
+        raise NotImplementedError
@@ -0,0 +1,299 @@
+# coding=utf-8
+"""
+Key-value backend. Each object is a hash with native TTL for expire,
+used_limit is checked and used_counter is incremented atomically by the store.
+"""
+import datetime
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .base import BaseBackend
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _to_timestamp(dt):
+    """
+    Returns datetime as string with integer number of microseconds since epoch ('' for None).
+    """
+    if dt is None:
+        return ''
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    delta = dt - EPOCH
+    return str((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def _from_timestamp(value):
+    if value in (None, ''):
+        return None
+    dt = EPOCH + datetime.timedelta(microseconds=int(value))
+    return dt if settings.USE_TZ else timezone.make_naive(dt)
+
+
+class LocMemStore(object):
+    """
+    Process-local store with the same semantics as RedisStore (for tests and development).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}  # key: (mapping, expire_at)
+        self._indexes = {}  # index key: (members, expire_at)
+
+    def _get(self, key, data=None):
+        data = self._data if data is None else data
+        item = data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del data[key]
+            return None
+        return item and item[0]
+
+    def add(self, key, mapping, expire_at, index_key=None, member=None, replace=False, key_prefix=''):
+        """
+        Adds object if key doesn't exist. If index_key is given, member is added to index,
+        index expires with the latest of its objects.
+        replace=True: objects of index (keys are key_prefix + member) are deleted before (in one operation).
+        """
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            if index_key is not None:
+                members = self._get(index_key, self._indexes)
+                if replace and members is not None:
+                    for m in members:
+                        self._data.pop(key_prefix + m, None)
+                    members = None
+                if members is None:
+                    self._indexes[index_key] = (set([member]), expire_at)
+                else:
+                    index_expire_at = self._indexes[index_key][1]
+                    if expire_at is None or index_expire_at is None:
+                        index_expire_at = None
+                    else:
+                        index_expire_at = max(index_expire_at, expire_at)
+                    members.add(member)
+                    self._indexes[index_key] = (members, index_expire_at)
+            self._data[key] = (dict(mapping), expire_at)
+            return True
+
+    def get(self, key):
+        with self._lock:
+            mapping = self._get(key)
+            return None if mapping is None else dict(mapping)
+
+    def redeem(self, key, now, check_limit=True):
+        with self._lock:
+            mapping = self._get(key)
+            if mapping is None:
+                return None
+            used_limit, used_counter = int(mapping['used_limit']), int(mapping['used_counter'])
+            if check_limit and used_limit and used_counter >= used_limit:
+                return None
+            mapping['used_counter'] = str(used_counter + 1)
+            mapping['last_used'] = now
+            if not mapping.get('first_used'):
+                mapping['first_used'] = now
+            return mapping['used_counter'], mapping['first_used']
+
+    def delete(self, key, index_key=None, member=None):
+        with self._lock:
+            self._data.pop(key, None)
+            members = None if index_key is None else self._get(index_key, self._indexes)
+            if members is not None:
+                members.discard(member)
+                if not members:
+                    del self._indexes[index_key]
+
+    def index_members(self, index_key):
+        with self._lock:
+            return set(self._get(index_key, self._indexes) or ())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._indexes.clear()
+
+
+class RedisStore(object):
+    """
+    Store in redis (requires redis package). Add with replace, availability check and increment
+    are done by Lua scripts (atomically).
+    """
+    # KEYS: object, index (optional), objects of members of index (replace); ARGV: expire_at (ms) or '',
+    # ttl of index (ms) or '', replace ('1' or '0'), prefix of keys of members, member, mapping (field, value, ...).
+    # Returns -1 if objects of members are not the same as in index (index is changed after it was read).
+    ADD_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+        if KEYS[2] and ARGV[3] == '1' then
+            local members = redis.call('SMEMBERS', KEYS[2])
+            if #members ~= #KEYS - 2 then return -1 end
+            local passed = {}
+            for i = 3, #KEYS do passed[KEYS[i]] = true end
+            for _, member in ipairs(members) do
+                if not passed[ARGV[4] .. member] then return -1 end
+            end
+            for i = 3, #KEYS do redis.call('DEL', KEYS[i]) end
+            redis.call('DEL', KEYS[2])
+        end
+        redis.call('HMSET', KEYS[1], unpack(ARGV, 6))
+        if ARGV[1] ~= '' then redis.call('PEXPIREAT', KEYS[1], ARGV[1]) end
+        if KEYS[2] then
+            local ttl = redis.call('PTTL', KEYS[2])  -- -2: no index, -1: index without expire
+            redis.call('SADD', KEYS[2], ARGV[5])
+            if ARGV[2] == '' then
+                redis.call('PERSIST', KEYS[2])
+            elseif ttl == -2 or (ttl >= 0 and ttl < tonumber(ARGV[2])) then
+                redis.call('PEXPIRE', KEYS[2], ARGV[2])
+            end
+        end
+        return 1
+    """
+    REDEEM_SCRIPT = """
+        local r = redis.call('HMGET', KEYS[1], 'used_limit', 'used_counter', 'first_used')
+        if not r[1] then return false end
+        if ARGV[2] == '1' and tonumber(r[1]) > 0 and tonumber(r[2]) >= tonumber(r[1]) then return false end
+        local counter = redis.call('HINCRBY', KEYS[1], 'used_counter', 1)
+        redis.call('HSET', KEYS[1], 'last_used', ARGV[1])
+        if not r[3] or r[3] == '' then
+            redis.call('HSET', KEYS[1], 'first_used', ARGV[1])
+            r[3] = ARGV[1]
+        end
+        return {counter, r[3]}
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', client=None):
+        if client is None:
+            import redis
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+        self._add = client.register_script(self.ADD_SCRIPT)
+        self._redeem = client.register_script(self.REDEEM_SCRIPT)
+
+    def add(self, key, mapping, expire_at, index_key=None, member=None, replace=False, key_prefix=''):
+        """
+        All keys of script are passed in KEYS: objects of index are read before and checked by script,
+        script is repeated if index is changed meanwhile.
+        """
+        if expire_at is None:
+            args = ['', '']
+        else:
+            args = [int(expire_at * 1000), max(1, int((expire_at - time.time()) * 1000))]
+        args.extend(('1' if replace else '0', key_prefix, '' if member is None else member))
+        for k, v in mapping.iteritems():
+            args.extend((k, v))
+        while True:
+            keys = [key] if index_key is None else [key, index_key]
+            if replace and index_key is not None:
+                keys.extend(key_prefix + m for m in self.client.smembers(index_key))
+            result = self._add(keys=keys, args=args)
+            if result != -1:
+                return bool(result)
+
+    def get(self, key):
+        return self.client.hgetall(key) or None
+
+    def redeem(self, key, now, check_limit=True):
+        return self._redeem(keys=[key], args=[now, '1' if check_limit else '0'])
+
+    def delete(self, key, index_key=None, member=None):
+        if index_key is None:
+            self.client.delete(key)
+            return
+        pipe = self.client.pipeline()  # MULTI/EXEC
+        pipe.delete(key)
+        pipe.srem(index_key, member)
+        pipe.execute()
+
+    def index_members(self, index_key):
+        return self.client.smembers(index_key)
+
+
+class KeyValueBackend(BaseBackend):
+    """
+    Options (DJU_PRIVATEURL_BACKEND_OPTIONS):
+    store - path to store class (RedisStore or LocMemStore), store_options - kwargs of store,
+    key_prefix - prefix of keys.
+    Objects are not saved in database, their pk is None. Expired objects are removed by TTL of store.
+    Tokens of user for action are kept in index (set) for replace, index expires with the latest of its objects
+    and tokens are removed from it on delete.
+    """
+    def __init__(self, store='dju_privateurl.backends.kv.RedisStore', store_options=None, key_prefix='dju_privateurl'):
+        self.store = import_string(store)(**(store_options or {}))
+        self.key_prefix = key_prefix
+
+    def make_key(self, action, token):
+        return '{}:{}:{}'.format(self.key_prefix, action, token)
+
+    def make_index_key(self, action, user_id):
+        return '{}:user:{}:{}'.format(self.key_prefix, action, user_id)
+
+    def insert(self, obj, replace=False):
+        """
+        Adds obj, replace (deletion of links of user for action) is done by store in the same atomic operation.
+        """
+        if obj.created is None:
+            obj.created = timezone.now()
+        field = obj._meta.get_field('data')
+        mapping = {
+            'user_id': '' if obj.user_id is None else str(obj.user_id),
+            'expire': _to_timestamp(obj.expire),
+            'data': field.get_encoded(obj),
+            'created': _to_timestamp(obj.created),
+            'used_limit': str(obj.used_limit),
+            'used_counter': str(obj.used_counter),
+            'first_used': _to_timestamp(obj.first_used),
+            'last_used': _to_timestamp(obj.last_used),
+            'auto_delete': '1' if obj.auto_delete else '',
+        }
+        expire_at = int(mapping['expire']) / 1e6 if obj.expire else None
+        if obj.user_id is None:
+            return self.store.add(self.make_key(obj.action, obj.token), mapping, expire_at)
+        return self.store.add(
+            self.make_key(obj.action, obj.token), mapping, expire_at,
+            index_key=self.make_index_key(obj.action, obj.user_id), member=obj.token,
+            replace=replace, key_prefix=self.make_key(obj.action, ''),
+        )
+
+    def get(self, model, action, token, fast=False):
+        mapping = self.store.get(self.make_key(action, token))
+        if mapping is None:
+            return None
+        return model(
+            action=action,
+            token=token,
+            user_id=int(mapping['user_id']) if mapping.get('user_id') else None,
+            expire=_from_timestamp(mapping.get('expire')),
+            data=model._meta.get_field('data').from_db_value(mapping.get('data'), None, None, None),
+            created=_from_timestamp(mapping.get('created')),
+            used_limit=int(mapping['used_limit']),
+            used_counter=int(mapping['used_counter']),
+            first_used=_from_timestamp(mapping.get('first_used')),
+            last_used=_from_timestamp(mapping.get('last_used')),
+            auto_delete=bool(mapping.get('auto_delete')),
+        )
+
+    def _incr(self, obj, dt, check_limit):
+        r = self.store.redeem(self.make_key(obj.action, obj.token), _to_timestamp(dt), check_limit=check_limit)
+        if r is None:
+            return False
+        obj.used_counter, obj.first_used = int(r[0]), _from_timestamp(r[1])
+        obj.last_used = dt
+        return True
+
+    def redeem(self, obj, dt):
+        if obj.expire and obj.expire <= dt:
+            return False
+        return self._incr(obj, dt, check_limit=True)
+
+    def save_usage(self, obj, dt):
+        self._incr(obj, dt, check_limit=False)
+
+    def delete(self, obj):
+        if obj.user_id is None:
+            self.store.delete(self.make_key(obj.action, obj.token))
+        else:
+            self.store.delete(self.make_key(obj.action, obj.token),
+                              index_key=self.make_index_key(obj.action, obj.user_id), member=obj.token)
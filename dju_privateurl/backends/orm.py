@@ -0,0 +1,203 @@
+from django.db import models, connections, router, IntegrityError, transaction
+from django.db.models import signals, sql
+from django.db.models.functions import Coalesce
+from dju_common.db import get_object_or_None
+from .base import BaseBackend
+from .. import cache as privateurl_cache, routers, usage as privateurl_usage
+from ..metrics import get_metrics
+
+
+class ORMBackend(BaseBackend):
+    """
+    Stores objects in database table of PrivateUrl model (default backend).
+    """
+    use_cache = True
+
+    def insert(self, obj, replace=False):
+        """
+        Inserts obj with INSERT ... ON CONFLICT DO NOTHING on postgresql 9.5+ (no savepoint and no exception on
+        collision of token), on other databases with save() in savepoint.
+        """
+        db = routers.db_for_write(type(obj), obj.action)
+        if replace and obj.user_id is not None:
+            user_db = router.db_for_write(obj._meta.get_field('user').related_model)
+            try:
+                with transaction.atomic(using=user_db), transaction.atomic(using=db):
+                    self._replace(obj, db, user_db)
+            except IntegrityError:
+                return False
+            return True
+        if self.supports_on_conflict(connections[db]):
+            return self._insert_on_conflict(obj, db)
+        try:
+            with transaction.atomic(using=db):
+                obj.save(force_insert=True, using=db)
+        except IntegrityError:
+            return False
+        return True
+
+    @staticmethod
+    def supports_on_conflict(connection):
+        return connection.vendor == 'postgresql' and connection.pg_version >= 90500
+
+    @staticmethod
+    def on_conflict_sql(obj, db):
+        """
+        Returns (sql, params) of INSERT of obj with ON CONFLICT DO NOTHING RETURNING pk.
+        """
+        meta = obj._meta
+        fields = [f for f in meta.local_concrete_fields if f is not meta.auto_field]
+        query = sql.InsertQuery(type(obj))
+        query.insert_values(fields, [obj])
+        (sql_, params), = query.get_compiler(using=db).as_sql()
+        qn = connections[db].ops.quote_name
+        return '{} ON CONFLICT DO NOTHING RETURNING {}.{}'.format(
+            sql_, qn(meta.db_table), qn(meta.pk.column)
+        ), params
+
+    @classmethod
+    def _insert_on_conflict(cls, obj, db):
+        model = type(obj)
+        signals.pre_save.send(sender=model, instance=obj, raw=False, using=db, update_fields=None)
+        sql_, params = cls.on_conflict_sql(obj, db)
+        with connections[db].cursor() as cursor:
+            cursor.execute(sql_, params)
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        obj.pk = row[0]
+        obj._state.adding = False
+        obj._state.db = db
+        signals.post_save.send(sender=model, instance=obj, created=True, update_fields=None, raw=False, using=db)
+        return True
+
+    def free_tokens(self, model, action, tokens):
+        busy = set(model._default_manager.using(routers.db_for_read(model, action))
+                   .filter(action=action, token__in=tokens).order_by().values_list('token', flat=True))
+        return [token for token in tokens if token not in busy]
+
+    def count(self, model, action):
+        return model._default_manager.using(routers.db_for_read(model, action)).filter(action=action).count()
+
+    @staticmethod
+    def _replace(obj, db, user_db):
+        """
+        Replaces objects of user for action by obj in one transaction. Row of user is locked
+        (select_for_update, in database of users), so concurrent replaces for the same user are serialized.
+        Old objects are deleted and obj is inserted with new pk, so instances of old tokens can't change it.
+        """
+        model = type(obj)
+        user_model = model._meta.get_field('user').related_model
+        list(user_model._default_manager.using(user_db).select_for_update().filter(pk=obj.user_id)
+             .values_list('pk'))
+        model._default_manager.using(db).filter(action=obj.action, user_id=obj.user_id).delete()
+        obj.save(force_insert=True, using=db)
+
+    @staticmethod
+    def _own_row(obj, db):
+        """
+        Returns queryset of row of obj, filtered by token and action too (row is not changed by stale instance).
+        """
+        return type(obj)._default_manager.using(db).filter(pk=obj.pk, action=obj.action, token=obj.token)
+
+    def get(self, model, action, token, fast=False):
+        """
+        Reads obj from replica of database (if configured), from database if it is not found or not available
+        in replica (e.g. it is not replicated yet). Object read from replica is bound to database for writes.
+        """
+        db = routers.db_for_read(model, action)
+        replica = routers.replica_for(db)
+        if replica is not None:
+            obj = self._get(model, db, replica, action, token, fast)
+            if obj is not None and obj.is_available():
+                obj._state.db = db
+                return obj
+            metrics = get_metrics()
+            if metrics is not None:
+                metrics.incr('replica_fallback', action)
+        return self._get(model, db, db, action, token, fast)
+
+    @staticmethod
+    def _get(model, db, using, action, token, fast):
+        qs = model._default_manager.using(using)
+        if fast:
+            qs = qs.only(*model.FAST_LOOKUP_FIELDS)
+        elif db == router.db_for_read(model._meta.get_field('user').related_model):
+            qs = qs.select_related('user')  # users of routed database are loaded from their own database on access
+        return get_object_or_None(qs, action=action, token=token)
+
+    def redeem(self, obj, dt):
+        """
+        Checks availability and increments used_counter with one conditional UPDATE.
+        New values of counters are returned by RETURNING on postgresql,
+        on other databases they are read again in the same transaction.
+        """
+        if not obj.pk or (not obj.used_limit and privateurl_usage.is_enabled(obj.action)):
+            if not obj.is_available(dt=dt):
+                return False
+            obj.used_counter_inc(dt=dt)
+            return True
+        db = obj._state.db or router.db_for_write(type(obj), instance=obj)
+        connection = connections[db]
+        if connection.vendor == 'postgresql':
+            row = self._redeem_returning(obj, connection, dt)
+        else:
+            qs = self._own_row(obj, db)
+            with transaction.atomic(using=db):
+                updated = qs.filter(
+                    models.Q(used_limit=0) | models.Q(used_counter__lt=models.F('used_limit')),
+                    models.Q(expire__isnull=True) | models.Q(expire__gt=dt),
+                ).update(
+                    used_counter=models.F('used_counter') + 1,
+                    last_used=dt,
+                    first_used=Coalesce('first_used', models.Value(dt, output_field=models.DateTimeField())),
+                )
+                row = qs.values_list('used_counter', 'first_used').first() if updated else None
+        if obj.used_limit and privateurl_cache.is_enabled(obj.action):
+            privateurl_cache.invalidate(obj.action, obj.token, using=db)
+        if row is None:
+            return False
+        obj.used_counter, obj.first_used = row
+        obj.last_used = dt
+        return True
+
+    @staticmethod
+    def _redeem_returning(obj, connection, dt):
+        opts = obj._meta
+        qn = connection.ops.quote_name
+        now = opts.get_field('last_used').get_db_prep_value(dt, connection)
+        sql = (
+            'UPDATE {table} SET {counter} = {counter} + 1, {last} = %s, {first} = COALESCE({first}, %s) '
+            'WHERE {pk} = %s AND {action} = %s AND {token} = %s '
+            'AND ({limit} = 0 OR {counter} < {limit}) AND ({expire} IS NULL OR {expire} > %s) '
+            'RETURNING {counter}, {first}'
+        ).format(table=qn(opts.db_table), counter=qn('used_counter'), last=qn('last_used'), first=qn('first_used'),
+                 pk=qn(opts.pk.column), action=qn('action'), token=qn('token'), limit=qn('used_limit'),
+                 expire=qn('expire'))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [now, now, obj.pk, obj.action, obj.token, now])
+            return cursor.fetchone()
+
+    def save_usage(self, obj, dt):
+        """
+        Increments used_counter with atomic UPDATE (F('used_counter') + 1), concurrent increments are not lost.
+        """
+        if not obj.pk:
+            return
+        if not obj.used_limit and privateurl_usage.is_enabled(obj.action):
+            privateurl_usage.usage_buffer.add(obj, dt)
+        else:
+            db = obj._state.db or router.db_for_write(type(obj), instance=obj)
+            self._own_row(obj, db).update(
+                used_counter=models.F('used_counter') + 1,
+                last_used=dt,
+                first_used=Coalesce('first_used', models.Value(dt, output_field=models.DateTimeField())),
+            )
+            if obj.used_limit and privateurl_cache.is_enabled(obj.action):
+                privateurl_cache.invalidate(obj.action, obj.token, using=db)
+
+    def delete(self, obj):
+        if obj.pk:
+            db = obj._state.db or router.db_for_write(type(obj), instance=obj)
+            self._own_row(obj, db).delete()
+            obj.pk = None
@@ -0,0 +1,302 @@
+# coding=utf-8
+"""
+Optional Bloom filter of tokens per action (DJU_PRIVATEURL_BLOOM_ACTIONS).
+privateurl_view doesn't look up tokens which are definitely unknown (see may_contain).
+
+Filter is built from table by "manage.py build_privateurl_bloom" and stored in cache
+or in memory-mapped file in DJU_PRIVATEURL_BLOOM_DIR (shared by processes of one host).
+Tokens of the table (ORM backend) created after build are written to journal in cache by post_save of PrivateUrl
+(create, admin, save() with new token, loaddata) and by bulk_create_tokens and import_privateurls:
+counter of additions (cache.incr) and list of tokens for each addition.
+Process reads journal only when token is not found in its filter, so known tokens cost no cache request.
+
+Filter never gives false negative: when filter or part of journal is missing in cache (not built yet, evicted),
+tokens of action are looked up in database until next build.
+Build merges journal since previous build, so tokens of transactions which were not committed
+during scan of table are kept (if transactions are shorter than interval between builds).
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+from . import routers, settings as pu_settings
+
+
+KEY_PREFIX = 'dju_privateurl:bloom'
+MIN_CAPACITY = 1000
+MAX_JOURNAL_GAP = 1 << 20  # unread additions, larger gap means that counter was lost and restarted
+JOURNAL_CHUNK_SIZE = 1000
+
+_states = {}
+_lock = threading.Lock()
+
+
+class BloomFilter(object):
+    HEADER = struct.Struct('<4sQB')  # magic, size in bits, number of hashes
+    MAGIC = 'DJUB'
+
+    def __init__(self, size, hashes, bits=None, offset=0):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8) if bits is None else bits
+        self.offset = offset  # position of bits in buffer (mmap with header)
+        self.is_bytearray = isinstance(self.bits, bytearray)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        """
+        Returns empty filter for capacity tokens with false positive rate fp_rate.
+        """
+        capacity = max(capacity, 1)
+        size = max(64, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        return cls(size, max(1, int(round(size / float(capacity) * math.log(2)))))
+
+    def positions(self, token):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(force_bytes(token)).digest())
+        h2 |= 1
+        return [(h1 + i * h2) % self.size for i in xrange(self.hashes)]
+
+    def add(self, token):
+        bits = self.bits
+        for p in self.positions(token):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, token):
+        bits, offset = self.bits, self.offset
+        for p in self.positions(token):
+            byte = bits[offset + (p >> 3)]
+            if not (byte if self.is_bytearray else ord(byte)) & 1 << (p & 7):
+                return False
+        return True
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.MAGIC, self.size, self.hashes) + str(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, size, hashes = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError('It is not a bloom filter.')
+        return cls(size, hashes, bytearray(data[cls.HEADER.size:]))
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Returns filter with bits in read-only memory map of file (pages are shared between processes).
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, hashes = cls.HEADER.unpack_from(buf)
+        if magic != cls.MAGIC:
+            raise ValueError('It is not a bloom filter.')
+        return cls(size, hashes, buf, offset=cls.HEADER.size)
+
+
+class _State(object):
+    def __init__(self, generation=None, bloom=None, seq=0):
+        self.generation = generation
+        self.bloom = bloom
+        self.seq = seq  # last addition of journal which is in extra
+        self.extra = set()
+        self.broken = False  # part of journal is lost, filter is not used until next build
+
+    @property
+    def usable(self):
+        return self.bloom is not None and not self.broken
+
+    def __contains__(self, token):
+        return token in self.extra or token in self.bloom
+
+
+def is_enabled(action):
+    actions = pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS
+    return actions == '*' or action in actions
+
+
+def get_cache():
+    return caches[pu_settings.DJU_PRIVATEURL_BLOOM_CACHE_ALIAS]
+
+
+def make_key(action, name):
+    return '{}:{}:{}'.format(KEY_PREFIX, action, name)
+
+
+def _initial_seq():
+    # counter restarted after eviction continues far after previous values, so old journal keys are not reused
+    return int(time.time()) * MAX_JOURNAL_GAP
+
+
+def add(action, tokens):
+    """
+    Writes new tokens of action to journal.
+    """
+    if not is_enabled(action):
+        return
+    cache = get_cache()
+    key = make_key(action, 'seq')
+    try:
+        seq = cache.incr(key)
+    except ValueError:  # counter doesn't exist
+        cache.add(key, _initial_seq(), None)
+        seq = cache.incr(key)
+    cache.set(make_key(action, 'journal:{}'.format(seq)), list(tokens),
+              pu_settings.DJU_PRIVATEURL_BLOOM_JOURNAL_TIMEOUT)
+
+
+def _read_journal(cache, action, start, end, strict=True):
+    """
+    Returns set of tokens of additions start + 1 .. end or None if some of them are missing (and strict).
+    """
+    tokens = set()
+    for i in xrange(start + 1, end + 1, JOURNAL_CHUNK_SIZE):
+        keys = [make_key(action, 'journal:{}'.format(seq)) for seq in xrange(i, min(i + JOURNAL_CHUNK_SIZE, end + 1))]
+        values = cache.get_many(keys)
+        if strict and len(values) != len(keys):
+            return None
+        for value in values.itervalues():
+            tokens.update(value)
+    return tokens
+
+
+def _load(action, meta):
+    generation, seq, built, capacity, path = meta
+    try:
+        if path is not None:
+            return BloomFilter.from_file(path)
+        data = get_cache().get(make_key(action, 'filter:{}'.format(generation)))
+        return None if data is None else BloomFilter.from_bytes(data)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+
+def _refresh(action):
+    """
+    Reads meta, filter and journal from cache without lock (misses of many threads don't wait for one request
+    to cache), lock is held only to replace state of action or to add tokens of journal to it.
+    """
+    cache = get_cache()
+    meta_key, seq_key = make_key(action, 'meta'), make_key(action, 'seq')
+    values = cache.get_many([meta_key, seq_key])
+    meta = values.get(meta_key)
+    state = _states.get(action)
+    if meta is None:
+        state = _State()
+        with _lock:
+            _states[action] = state
+        return state
+    if state is None or state.generation != meta[0] or state.bloom is None:
+        state = _State(meta[0], _load(action, meta), meta[1])
+        with _lock:
+            _states[action] = state
+    if not state.usable:
+        return state
+    start, seq = state.seq, values.get(seq_key)
+    if seq is None or seq - start > MAX_JOURNAL_GAP:
+        state.broken = True
+    elif seq > start:
+        tokens = _read_journal(cache, action, start, seq)
+        if tokens is None:
+            state.broken = True
+        else:
+            with _lock:
+                if seq > state.seq:  # other thread could read longer part of journal
+                    state.extra.update(tokens)
+                    state.seq = seq
+    return state
+
+
+def may_contain(action, token):
+    """
+    Returns False only if token of action definitely doesn't exist.
+    """
+    if not is_enabled(action):
+        return True
+    state = _states.get(action)
+    if state is not None and state.usable and token in state:
+        return True
+    state = _refresh(action)
+    return not state.usable or token in state
+
+
+def get_info(action):
+    """
+    Returns dict with generation, built (timestamp), capacity and additions (since build) or None if not built.
+    """
+    cache = get_cache()
+    meta_key, seq_key = make_key(action, 'meta'), make_key(action, 'seq')
+    values = cache.get_many([meta_key, seq_key])
+    meta = values.get(meta_key)
+    if meta is None:
+        return None
+    generation, seq, built, capacity, path = meta
+    return {
+        'generation': generation,
+        'built': built,
+        'capacity': capacity,
+        'additions': None if values.get(seq_key) is None else values[seq_key] - seq,
+        'path': path,
+    }
+
+
+def is_stale(action):
+    """
+    Returns True if filter of action is not built, older than DJU_PRIVATEURL_BLOOM_REBUILD_INTERVAL
+    or has more than DJU_PRIVATEURL_BLOOM_REBUILD_ADDITIONS additions in journal.
+    """
+    info = get_info(action)
+    return (
+        info is None or info['additions'] is None or info['additions'] < 0 or
+        time.time() - info['built'] > pu_settings.DJU_PRIVATEURL_BLOOM_REBUILD_INTERVAL or
+        info['additions'] > pu_settings.DJU_PRIVATEURL_BLOOM_REBUILD_ADDITIONS
+    )
+
+
+def build(model, action, fp_rate=None):
+    """
+    Builds filter of all tokens of action from table and publishes it. Returns number of tokens.
+    """
+    cache = get_cache()
+    meta_key, seq_key = make_key(action, 'meta'), make_key(action, 'seq')
+    cache.add(seq_key, _initial_seq(), None)
+    start = cache.get(seq_key)
+    meta = cache.get(meta_key)
+    journal_start = meta[1] if meta is not None and meta[1] <= start else start
+    qs = model.objects.using(routers.db_for_read(model, action)).filter(action=action).order_by()
+    count = qs.count()
+    bloom = BloomFilter.for_capacity(max(count, MIN_CAPACITY), fp_rate or pu_settings.DJU_PRIVATEURL_BLOOM_FP_RATE)
+    for token in qs.values_list('token', flat=True).iterator():
+        bloom.add(token)
+    end = cache.get(seq_key) or start
+    if end - journal_start <= MAX_JOURNAL_GAP:
+        for token in _read_journal(cache, action, journal_start, end, strict=False):
+            bloom.add(token)
+    generation = uuid.uuid4().hex[:12]
+    path = None
+    if pu_settings.DJU_PRIVATEURL_BLOOM_DIR:
+        path = os.path.join(pu_settings.DJU_PRIVATEURL_BLOOM_DIR, '{}.{}.bloom'.format(action, generation))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(bloom.to_bytes())
+        os.rename(path + '.tmp', path)
+    else:
+        cache.set(make_key(action, 'filter:{}'.format(generation)), bloom.to_bytes(), None)
+    cache.set(meta_key, (generation, end, time.time(), max(count, MIN_CAPACITY), path), None)
+    if meta is not None:
+        if meta[4] is None:
+            cache.delete(make_key(action, 'filter:{}'.format(meta[0])))
+        elif os.path.exists(meta[4]):
+            os.remove(meta[4])  # processes which have mapped old file keep it until they load new one
+    return count
+
+
+def reset():
+    """
+    Forgets filters loaded by this process.
+    """
+    with _lock:
+        _states.clear()
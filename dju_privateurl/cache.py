@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+Read-through cache for PrivateUrlManager.get_or_none.
+Objects are cached by (action, token, fast), unknown tokens are cached as misses.
+Objects of fast lookups (deferred fields) are cached separately from full objects.
+"""
+import threading
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from . import settings as pu_settings
+
+
+KEY_PREFIX = 'dju_privateurl'
+NOT_FOUND = 'dju_privateurl:not-found'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def is_enabled(action):
+    actions = pu_settings.DJU_PRIVATEURL_CACHE_ACTIONS
+    return actions == '*' or action in actions
+
+
+def get_cache():
+    return caches[pu_settings.DJU_PRIVATEURL_CACHE_ALIAS]
+
+
+def make_key(action, token, fast=False):
+    key = '{}:{}:{}'.format(KEY_PREFIX, action, token)
+    return key + ':fast' if fast else key
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_object(action, token, fast=False):
+    """
+    Returns tuple (found, obj). obj is None for cached unknown token.
+    """
+    value = get_cache().get(make_key(action, token, fast))
+    if value is None:
+        _count('misses')
+        return False, None
+    _count('hits')
+    if value == NOT_FOUND:
+        return True, None
+    return True, value
+
+
+def get_timeout(obj, dt=None):
+    """
+    Returns cache timeout for obj (None for unknown token) or 0 if obj should not be cached.
+    """
+    if obj is None:
+        return pu_settings.DJU_PRIVATEURL_CACHE_NEGATIVE_TIMEOUT
+    timeout = pu_settings.DJU_PRIVATEURL_CACHE_TIMEOUT
+    if obj.expire:
+        timeout = min(timeout, int((obj.expire - (dt or timezone.now())).total_seconds()))
+    return max(timeout, 0)
+
+
+def set_object(action, token, obj, fast=False):
+    timeout = get_timeout(obj)
+    if timeout:
+        get_cache().set(make_key(action, token, fast), NOT_FOUND if obj is None else obj, timeout=timeout)
+
+
+def invalidate(action, tokens, using=DEFAULT_DB_ALIAS):
+    """
+    Removes tokens from cache after commit of transaction in database using (immediately outside of transaction),
+    so concurrent lookup can't cache the row which is not committed yet.
+    """
+    if isinstance(tokens, basestring):
+        tokens = (tokens,)
+    keys = [make_key(action, token, fast) for token in tokens for fast in (False, True)]
+    transaction.on_commit(lambda: get_cache().delete_many(keys), using=using)
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for k in _stats:
+            _stats[k] = 0
@@ -0,0 +1,180 @@
+# coding=utf-8
+"""
+PayloadField stores PrivateUrl.data in text column as JSON (default) or in compact format
+(DJU_PRIVATEURL_DATA_FORMAT = 'compact'). Value loaded from database is decoded on first access of attribute,
+objects which are only redeemed never decode it.
+
+Compact format: '~0' + JSON or '~1' + base64 of zlib compressed JSON (if it is shorter).
+Decimal, datetime, date and time are stored as objects with one tag key ({"$D": "10.50"}) and restored
+with the same types, keys of other objects which start with '$' get one more '$'.
+Values of both formats can be in one table, format is detected by prefix (JSON never starts with '~').
+"""
+import base64
+import binascii
+import datetime
+import decimal
+import zlib
+import simplejson
+from django.db.models.query_utils import DeferredAttribute
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from dju_common.fields import JSONField
+from . import settings as pu_settings
+
+
+COMPACT_PREFIX = '~'
+COMPRESS_MIN_SIZE = 256
+TAG_PREFIX = '$'
+
+
+class EncodedPayload(unicode):
+    """
+    Encoded value of PayloadField which is not decoded yet.
+    """
+
+
+def _pack(value):
+    if isinstance(value, dict):
+        return dict(
+            (TAG_PREFIX + k if isinstance(k, basestring) and k.startswith(TAG_PREFIX) else k, _pack(v))
+            for k, v in value.iteritems()
+        )
+    if isinstance(value, (list, tuple)):
+        return [_pack(v) for v in value]
+    if isinstance(value, decimal.Decimal):
+        return {'$D': str(value)}
+    if isinstance(value, datetime.datetime):
+        return {'$T': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$d': value.isoformat()}
+    if isinstance(value, datetime.time):
+        if value.utcoffset() is not None:
+            raise ValueError("Payload can't represent timezone-aware times.")
+        return {'$t': value.isoformat()}
+    return value
+
+
+UNPACK_TAGS = {
+    '$D': decimal.Decimal,
+    '$T': parse_datetime,
+    '$d': parse_date,
+    '$t': parse_time,
+}
+
+
+def _unpack_object(obj):
+    if len(obj) == 1:
+        key, value = next(obj.iteritems())
+        if key in UNPACK_TAGS:
+            try:
+                result = UNPACK_TAGS[key](value)
+            except (decimal.InvalidOperation, TypeError):
+                result = None
+            if result is None:
+                raise ValueError('Invalid value of {}: {!r}.'.format(key, value))
+            return result
+    if any(k.startswith(TAG_PREFIX) for k in obj):
+        return dict((k[1:] if k.startswith(TAG_PREFIX) else k, v) for k, v in obj.iteritems())
+    return obj
+
+
+def encode_compact(value, cls=None):
+    text = simplejson.dumps(_pack(value), separators=(',', ':'), cls=cls)
+    if len(text) >= COMPRESS_MIN_SIZE:
+        compressed = base64.b64encode(zlib.compress(text.encode('utf-8')))
+        if len(compressed) < len(text):
+            return u'{}1{}'.format(COMPACT_PREFIX, compressed)
+    return u'{}0{}'.format(COMPACT_PREFIX, text)
+
+
+def decode_compact(value):
+    """
+    Raises ValueError for invalid value.
+    """
+    text = value[2:]
+    if value[1:2] == '1':
+        try:
+            text = zlib.decompress(base64.b64decode(text)).decode('utf-8')
+        except (TypeError, binascii.Error, zlib.error), e:
+            raise ValueError('Invalid compressed payload: {}'.format(e))
+    elif value[1:2] != '0':
+        raise ValueError('Unknown flags of compact payload.')
+    return simplejson.loads(text, object_hook=_unpack_object)
+
+
+class PayloadDescriptor(DeferredAttribute):
+    """
+    Decodes EncodedPayload on first access (deferred field is loaded from database as in DeferredAttribute).
+    """
+    def __init__(self, field):
+        super(PayloadDescriptor, self).__init__(field.attname, field.model)
+        self.field = field
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super(PayloadDescriptor, self).__get__(instance, cls)
+        if isinstance(value, EncodedPayload):
+            value = instance.__dict__[self.field_name] = self.field.decode(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field_name] = value
+
+
+class PayloadField(JSONField):
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(PayloadField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, PayloadDescriptor(self))
+
+    def encode(self, value):
+        """
+        Returns EncodedPayload of value in format DJU_PRIVATEURL_DATA_FORMAT.
+        """
+        if isinstance(value, EncodedPayload):
+            return value
+        if pu_settings.DJU_PRIVATEURL_DATA_FORMAT == 'compact':
+            return EncodedPayload(encode_compact(value, cls=self.dump_kwargs['cls']))
+        return EncodedPayload(super(PayloadField, self).get_prep_value(value))
+
+    def decode(self, value):
+        if value.startswith(COMPACT_PREFIX):
+            return decode_compact(value)
+        return super(PayloadField, self).to_python(value)
+
+    def validate_encoded(self, value):
+        """
+        Returns EncodedPayload of encoded value from outside (e.g. import file) if it is valid JSON
+        or compact payload, value is kept as is (without encoding of decoded value).
+        """
+        try:
+            if value.startswith(COMPACT_PREFIX):
+                decode_compact(value)
+            else:
+                simplejson.loads(value)
+        except ValueError:
+            raise ValueError('Encoded payload is not valid: {!r}.'.format(value[:100]))
+        return EncodedPayload(value)
+
+    def get_encoded(self, instance):
+        """
+        Returns encoded value of field of instance without decoding it.
+        """
+        return self.encode(instance.__dict__.get(self.attname))
+
+    def pre_save(self, model_instance, add):
+        return model_instance.__dict__.get(self.attname)
+
+    def from_db_value(self, value, expression, connection, context):
+        if value in (None, ''):
+            return None
+        return EncodedPayload(value)
+
+    def to_python(self, value):
+        if isinstance(value, basestring) and value:
+            return self.decode(value)
+        return super(PayloadField, self).to_python(value)
+
+    def get_prep_value(self, value):
+        if value is None and self.null:
+            return None
+        return self.encode(value)
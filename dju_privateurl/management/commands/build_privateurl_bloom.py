@@ -0,0 +1,44 @@
+import time
+from django.core.management import BaseCommand, CommandError
+from dju_privateurl import bloom, routers, settings as pu_settings
+from dju_privateurl.backends import get_backend
+from dju_privateurl.backends.orm import ORMBackend
+from dju_privateurl.models import PrivateUrl
+
+
+class Command(BaseCommand):
+    help = 'Build bloom filters of tokens of actions from DJU_PRIVATEURL_BLOOM_ACTIONS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', dest='actions', action='append', default=None,
+                            help='Build filter only of this action (can be repeated).')
+        parser.add_argument('--if-stale', action='store_true', dest='if_stale', default=False,
+                            help='Build only filters which are not built, too old or have too many additions '
+                                 '(run it periodically, e.g. every minute by cron).')
+        parser.add_argument('--fp-rate', dest='fp_rate', type=float, default=None,
+                            help='False positive rate (default is DJU_PRIVATEURL_BLOOM_FP_RATE).')
+
+    def get_actions(self):
+        actions = pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS
+        if actions != '*':
+            return list(actions)
+        result = set()
+        for db in routers.get_databases(PrivateUrl):
+            result.update(PrivateUrl.objects.using(db).order_by().values_list('action', flat=True).distinct())
+        return sorted(result)
+
+    def handle(self, *args, **options):
+        if not isinstance(get_backend(), ORMBackend):
+            raise CommandError('Bloom filters are built from table of ORMBackend.')
+        actions = options['actions'] or self.get_actions()
+        for action in actions:
+            if not bloom.is_enabled(action):
+                raise CommandError('Action {} is not in DJU_PRIVATEURL_BLOOM_ACTIONS.'.format(action))
+        for action in actions:
+            if options['if_stale'] and not bloom.is_stale(action):
+                if options['verbosity'] > 1:
+                    self.stdout.write('{}: fresh'.format(action))
+                continue
+            t = time.time()
+            count = bloom.build(PrivateUrl, action, fp_rate=options['fp_rate'])
+            self.stdout.write('{}: {} tokens in {:.2f}s'.format(action, count, time.time() - t))
@@ -0,0 +1,88 @@
+import datetime
+import os
+import time
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from dju_privateurl import transfer
+
+
+def parse_dt(value):
+    """
+    Returns aware datetime of ISO 8601 date or datetime or None.
+    """
+    if not value:
+        return None
+    dt = parse_datetime(value)
+    if dt is None:
+        d = parse_date(value)
+        if d is None:
+            raise CommandError('Invalid date or datetime: {}.'.format(value))
+        dt = datetime.datetime.combine(d, datetime.time())
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+class Command(BaseCommand):
+    help = 'Export private urls to JSON Lines or CSV file by chunks (data is exported in stored form).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File path ('-' for stdout), *.gz is compressed.")
+        parser.add_argument('--format', dest='format', default=None, choices=transfer.FORMATS,
+                            help='Format of file (default is csv for *.csv and *.csv.gz, jsonl for others).')
+        parser.add_argument('--gzip', action='store_true', dest='gzip', default=None,
+                            help='Compress file by gzip.')
+        parser.add_argument('--action', dest='actions', action='append', default=None,
+                            help='Export only private urls of this action (can be repeated).')
+        parser.add_argument('--created-from', dest='created_from', default=None,
+                            help='Export only private urls created at this date or time or later (ISO 8601).')
+        parser.add_argument('--created-to', dest='created_to', default=None,
+                            help='Export only private urls created before this date or time (ISO 8601).')
+        parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=1000,
+                            help='Number of rows read by one query.')
+        parser.add_argument('--checkpoint', dest='checkpoint', default=None,
+                            help='File of progress, export is continued from it and it is removed at the end.')
+
+    def handle(self, *args, **options):
+        path, checkpoint_path = options['path'], options['checkpoint']
+        if checkpoint_path and path == '-':
+            raise CommandError("Export to stdout can't be continued, use file path with --checkpoint.")
+        if checkpoint_path and transfer.is_compressed(path, options['gzip']):
+            raise CommandError("Compressed export can't be continued, don't use --checkpoint with gzip.")
+        file_format = transfer.get_format(path, options['format'])
+        checkpoint = transfer.load_checkpoint(checkpoint_path)
+        t = time.time()
+        rows = 0
+        f = transfer.open_file(path, 'r+b' if checkpoint else 'wb', options['gzip'])
+        try:
+            if checkpoint:
+                f.truncate(checkpoint['offset'])  # rows written after the last checkpoint
+                f.seek(0, os.SEEK_END)
+            if file_format == 'csv' and not checkpoint:
+                transfer.write_records(f, file_format, [], header=True)
+            for state, records in transfer.export_chunks(
+                actions=options['actions'],
+                created_from=parse_dt(options['created_from']),
+                created_to=parse_dt(options['created_to']),
+                chunk_size=options['chunk_size'],
+                checkpoint=checkpoint,
+            ):
+                transfer.write_records(f, file_format, records)
+                rows = state['rows']
+                if checkpoint_path:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    state['offset'] = f.tell()
+                    transfer.save_checkpoint(checkpoint_path, state)
+                if options['verbosity'] > 1:
+                    self.stderr.write('{} rows'.format(rows))
+        finally:
+            transfer.close_file(f)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        if path != '-':
+            seconds = time.time() - t
+            self.stdout.write('Exported {} rows in {:.2f}s ({:.0f} rows/sec)'.format(
+                rows, seconds, rows / seconds if seconds else 0
+            ))
@@ -0,0 +1,62 @@
+import os
+import time
+from django.core.management import BaseCommand, CommandError
+from dju_privateurl import transfer
+
+
+class Command(BaseCommand):
+    help = 'Import private urls from JSON Lines or CSV file (see export_privateurls) by batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File path ('-' for stdin), *.gz is decompressed.")
+        parser.add_argument('--format', dest='format', default=None, choices=transfer.FORMATS,
+                            help='Format of file (default is csv for *.csv and *.csv.gz, jsonl for others).')
+        parser.add_argument('--gzip', action='store_true', dest='gzip', default=None,
+                            help='Decompress file by gzip.')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=1000,
+                            help='Number of rows saved in one transaction.')
+        parser.add_argument('--skip-existing', action='store_true', dest='skip_existing', default=False,
+                            help="Don't import private urls with existing action and token.")
+        parser.add_argument('--without-users', action='store_true', dest='without_users', default=False,
+                            help="Don't keep users (e.g. users have other ids in target database).")
+        parser.add_argument('--checkpoint', dest='checkpoint', default=None,
+                            help='File of progress, import is continued from it and it is removed at the end.')
+
+    def handle(self, *args, **options):
+        path, checkpoint_path = options['path'], options['checkpoint']
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive.')
+        file_format = transfer.get_format(path, options['format'])
+        state = transfer.load_checkpoint(checkpoint_path) or {'records': 0, 'rows': 0}
+        t = time.time()
+        f = transfer.open_file(path, 'rb', options['gzip'])
+        try:
+            batch, n = [], 0
+            for n, record in enumerate(transfer.read_records(f, file_format), 1):
+                if n <= state['records']:
+                    continue  # imported before
+                try:
+                    batch.append(transfer.from_record(record, without_users=options['without_users']))
+                except ValueError, e:
+                    raise CommandError('Record {}: {}'.format(n, e))
+                if len(batch) >= options['batch_size']:
+                    self.save(batch, n, state, options)
+                    batch = []
+            if batch:
+                self.save(batch, n, state, options)
+        finally:
+            transfer.close_file(f)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        seconds = time.time() - t
+        self.stdout.write('Imported {} rows in {:.2f}s ({:.0f} rows/sec)'.format(
+            state['rows'], seconds, state['rows'] / seconds if seconds else 0
+        ))
+
+    def save(self, batch, n, state, options):
+        state['rows'] += transfer.import_batch(batch, skip_existing=options['skip_existing'])
+        state['records'] = n
+        if options['checkpoint']:
+            transfer.save_checkpoint(options['checkpoint'], state)
+        if options['verbosity'] > 1:
+            self.stderr.write('{} rows'.format(state['rows']))
@@ -0,0 +1,38 @@
+import simplejson
+from django.core.management import BaseCommand
+from dju_privateurl.models import PrivateUrl
+
+
+class Command(BaseCommand):
+    help = 'Show number of active, expired, exhausted and redeemed private urls per action.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', dest='action', default=None,
+                            help='Show statistics only of this action.')
+        parser.add_argument('--bucket', dest='bucket', default=None, choices=sorted(PrivateUrl.objects.STATS_BUCKETS),
+                            help='Group statistics by period of time.')
+        parser.add_argument('--bucket-field', dest='bucket_field', default='created', choices=('created', 'last_used'),
+                            help='Field which is grouped by period of time.')
+        parser.add_argument('--cache-timeout', dest='cache_timeout', type=int, default=None,
+                            help='Use snapshot of statistics cached for this number of seconds.')
+        parser.add_argument('--json', action='store_true', dest='json', default=False,
+                            help='Print statistics as JSON.')
+
+    def handle(self, *args, **options):
+        stats = PrivateUrl.objects.stats(
+            action=options['action'],
+            bucket=options['bucket'],
+            bucket_field=options['bucket_field'],
+            cache_timeout=options['cache_timeout'],
+        )
+        if options['json']:
+            self.stdout.write(simplejson.dumps(stats, default=lambda v: v.isoformat()))
+            return
+        columns = ('total', 'active', 'expired', 'exhausted', 'redeemed', 'used')
+        self.stdout.write('{:<32}{:<22}'.format('action', 'bucket' if options['bucket'] else '') +
+                          ''.join('{:>11}'.format(c) for c in columns) + '{:>8}'.format('rate'))
+        for item in stats:
+            bucket = item.get('bucket')
+            self.stdout.write('{:<32}{:<22}'.format(item['action'], bucket.isoformat() if bucket else '') +
+                              ''.join('{:>11}'.format(item[c]) for c in columns) +
+                              '{:>8.1%}'.format(item['redemption_rate']))
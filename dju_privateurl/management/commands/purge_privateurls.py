@@ -0,0 +1,38 @@
+import datetime
+import time
+from django.core.management import BaseCommand
+from dju_privateurl.models import PrivateUrl
+
+
+class Command(BaseCommand):
+    help = 'Delete expired and exhausted private urls in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', dest='action', default=None,
+                            help='Purge only private urls of this action.')
+        parser.add_argument('--grace-hours', dest='grace_hours', type=float, default=0,
+                            help='Keep expired and exhausted private urls for this number of hours.')
+        parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=1000,
+                            help='Number of rows deleted in one query.')
+        parser.add_argument('--sleep', dest='sleep', type=float, default=0,
+                            help='Pause between chunks in seconds.')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help='Only count rows which would be deleted.')
+
+    def handle(self, *args, **options):
+        t = time.time()
+        total = 0
+        for count in PrivateUrl.objects.purge_chunks(
+            action=options['action'],
+            grace=datetime.timedelta(hours=options['grace_hours']),
+            chunk_size=options['chunk_size'],
+            sleep=options['sleep'],
+            dry_run=options['dry_run'],
+        ):
+            total += count
+            if options['verbosity'] > 1:
+                self.stdout.write('{} rows'.format(total))
+        seconds = time.time() - t
+        self.stdout.write('{} {} rows in {:.2f}s ({:.0f} rows/sec)'.format(
+            'Found' if options['dry_run'] else 'Deleted', total, seconds, total / seconds if seconds else 0
+        ))
@@ -0,0 +1,160 @@
+# coding=utf-8
+"""
+Optional instrumentation of privateurl_view and issuance.
+Enabled by DJU_PRIVATEURL_METRICS (path to BaseMetrics subclass, kwargs in DJU_PRIVATEURL_METRICS_OPTIONS).
+When it is None, get_metrics() returns None and instrumented code does only this check.
+
+Timings (seconds) by phase: lookup, redeem, receivers, delete, total.
+Counts by outcome: ok, fail and reason of fail (not_found, expired, exhausted),
+create_retry and bulk_create_retry (token collisions in PrivateUrl.create and bulk_create_tokens),
+throttled (requests rejected by dju_privateurl.throttling),
+replica_fallback (lookups repeated in primary database, see DJU_PRIVATEURL_READ_DATABASES).
+"""
+import collections
+import threading
+import time
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from . import settings as pu_settings
+
+
+class BaseMetrics(object):
+    """
+    Adapter interface for exporters: subclasses implement record_timing and record_count.
+    """
+    def record_timing(self, name, action, seconds):
+        raise NotImplementedError
+
+    def record_count(self, name, action, value=1):
+        raise NotImplementedError
+
+    def timing(self, name, action, start):
+        """
+        Records time elapsed since start, returns current time (start of next phase).
+        """
+        now = time.time()
+        self.record_timing(name, action, now - start)
+        return now
+
+    def incr(self, name, action, value=1):
+        self.record_count(name, action, value)
+
+
+class InMemoryMetrics(BaseMetrics):
+    """
+    Aggregates metrics in process memory, last max_samples timings are kept for percentiles.
+    """
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counts = collections.Counter()
+
+    def record_timing(self, name, action, seconds):
+        key = (name, action)
+        with self._lock:
+            samples = self._timings.get(key)
+            if samples is None:
+                samples = self._timings[key] = collections.deque(maxlen=self.max_samples)
+            samples.append(seconds)
+
+    def record_count(self, name, action, value=1):
+        with self._lock:
+            self._counts[(name, action)] += value
+
+    @classmethod
+    def percentile(cls, sorted_values, p):
+        """
+        Returns p-th percentile (nearest rank) of sorted list.
+        """
+        if not sorted_values:
+            return None
+        return sorted_values[max(int(round(p / 100. * len(sorted_values))) - 1, 0)]
+
+    def get_stats(self):
+        """
+        Returns {'timings': {(name, action): {'count', 'mean', 'max', 'p50', 'p90', 'p99'}},
+                 'counts': {(name, action): int}}
+        """
+        with self._lock:
+            timings = dict((key, sorted(samples)) for key, samples in self._timings.iteritems())
+            counts = dict(self._counts)
+        stats = {}
+        for key, values in timings.iteritems():
+            item = stats[key] = {'count': len(values), 'mean': sum(values) / len(values), 'max': values[-1]}
+            for p in self.PERCENTILES:
+                item['p{}'.format(p)] = self.percentile(values, p)
+        return {'timings': stats, 'counts': counts}
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counts.clear()
+
+
+class StatsdMetrics(BaseMetrics):
+    """
+    Sends metrics to StatsD as {prefix}.{action}.{name} (requires statsd package or client with timing and incr).
+    """
+    def __init__(self, host='localhost', port=8125, prefix='dju_privateurl', client=None):
+        if client is None:
+            import statsd
+            client = statsd.StatsClient(host, port)
+        self.client = client
+        self.prefix = prefix
+
+    def record_timing(self, name, action, seconds):
+        self.client.timing('{}.{}.{}'.format(self.prefix, action, name), seconds * 1000)
+
+    def record_count(self, name, action, value=1):
+        self.client.incr('{}.{}.{}'.format(self.prefix, action, name), value)
+
+
+class PrometheusMetrics(BaseMetrics):
+    """
+    Exports histogram {prefix}_seconds and counter {prefix}_total with labels name and action
+    (requires prometheus_client package).
+    """
+    def __init__(self, prefix='dju_privateurl', registry=None):
+        import prometheus_client
+        kwargs = {} if registry is None else {'registry': registry}
+        self.histogram = prometheus_client.Histogram('{}_seconds'.format(prefix), 'Latency of private url phases.',
+                                                     ['name', 'action'], **kwargs)
+        self.counter = prometheus_client.Counter('{}_total'.format(prefix), 'Private url outcomes.',
+                                                 ['name', 'action'], **kwargs)
+
+    def record_timing(self, name, action, seconds):
+        self.histogram.labels(name, action).observe(seconds)
+
+    def record_count(self, name, action, value=1):
+        self.counter.labels(name, action).inc(value)
+
+
+_metrics = {}
+
+
+def get_metrics():
+    """
+    Returns instance of DJU_PRIVATEURL_METRICS (created once per path) or None if metrics are disabled.
+    """
+    path = pu_settings.DJU_PRIVATEURL_METRICS
+    if path is None:
+        return None
+    try:
+        return _metrics[path]
+    except KeyError:
+        metrics = _metrics[path] = import_string(path)(**pu_settings.DJU_PRIVATEURL_METRICS_OPTIONS)
+        return metrics
+
+
+def get_fail_reason(obj, dt=None):
+    """
+    Returns reason why obj (result of get_or_none) was not redeemed.
+    """
+    if obj is None:
+        return 'not_found'
+    if obj.expire and obj.expire <= (dt or timezone.now()):
+        return 'expired'
+    return 'exhausted'
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-17 15:17
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+EXPIRE_INDEX_NAME = 'dju_privateurl_expire_notnull'
+
+
+def create_expire_index(apps, schema_editor):
+    qn = schema_editor.quote_name
+    sql = 'CREATE INDEX {} ON {} ({})'.format(qn(EXPIRE_INDEX_NAME), qn('dju_privateurl'), qn('expire'))
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        sql += ' WHERE {} IS NOT NULL'.format(qn('expire'))  # partial index
+    schema_editor.execute(sql)
+
+
+def drop_expire_index(apps, schema_editor):
+    qn = schema_editor.quote_name
+    sql = 'DROP INDEX {}'.format(qn(EXPIRE_INDEX_NAME))
+    if schema_editor.connection.vendor == 'mysql':
+        sql += ' ON {}'.format(qn('dju_privateurl'))
+    schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dju_privateurl', '0002_auto_20160501_0153'),
+    ]
+
+    operations = [
+        # composite indexes are created before single-column ones are dropped (mysql requires index for fk)
+        migrations.AlterIndexTogether(
+            name='privateurl',
+            index_together=set([('user', 'action'), ('action', 'created')]),
+        ),
+        migrations.AlterField(
+            model_name='privateurl',
+            name='action',
+            field=models.SlugField(db_index=False, max_length=32, verbose_name='action'),
+        ),
+        migrations.AlterField(
+            model_name='privateurl',
+            name='auto_delete',
+            field=models.BooleanField(default=False, help_text='Delete object if it can no longer be used.', verbose_name='auto delete'),
+        ),
+        migrations.AlterField(
+            model_name='privateurl',
+            name='expire',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='expire'),
+        ),
+        migrations.AlterField(
+            model_name='privateurl',
+            name='token',
+            field=models.SlugField(db_index=False, max_length=65, verbose_name='token'),
+        ),
+        migrations.AlterField(
+            model_name='privateurl',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user'),
+        ),
+        migrations.RunPython(create_expire_index, drop_expire_index),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-17 15:36
+from __future__ import unicode_literals
+
+from importlib import import_module
+from django.db import migrations
+import dju_common.fields.json
+import dju_privateurl.fields
+
+
+composite_indexes = import_module('dju_privateurl.migrations.0003_composite_indexes')
+
+
+def recreate_expire_index(apps, schema_editor):
+    # sqlite rebuilds table on AlterField, index created by raw sql in 0003 is lost
+    # (index is recreated after AlterField in both directions, see operations)
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(
+            schema_editor.quote_name(composite_indexes.EXPIRE_INDEX_NAME)
+        ))
+        composite_indexes.create_expire_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dju_privateurl', '0003_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, recreate_expire_index),  # reverse: after AlterField
+        migrations.AlterField(
+            model_name='privateurl',
+            name='data',
+            field=dju_privateurl.fields.PayloadField(blank=True, default=None, dump_kwargs={b'cls': dju_common.fields.json.JSONEncoder, b'separators': (b',', b':'), b'use_decimal': True}, load_kwargs={b'use_decimal': True}, verbose_name='data'),
+        ),
+        migrations.RunPython(recreate_expire_index, migrations.RunPython.noop),
+    ]
@@ -1,50 +1,230 @@
 # coding=utf-8
+import calendar
 import copy
-import random
 import datetime
-from types import NoneType
-from math import ceil
+import time
+import simplejson
 from django.conf import settings
+from django.core import signing
 from django.core.urlresolvers import reverse
 from django.db import models, IntegrityError, transaction
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncYear
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
-from django.utils.crypto import get_random_string
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext_lazy as _
-from dju_common.db import get_object_or_None
-from dju_common.fields import JSONField
+from . import bloom, cache as privateurl_cache, routers, settings as pu_settings
+from .backends import get_backend
+from .fields import PayloadField
+from .metrics import get_metrics
+from .tokens import TokenSpaceExhausted, get_token_generator
 
 
 class PrivateUrlManager(models.Manager):
-    def get_or_none(self, action, token):
-        return get_object_or_None(self.select_related('user'), action=action, token=token)
+    def get_or_none(self, action, token, fast=False):
+        """
+        Повертає об'єкт по action і token або None
+        :param fast: завантажити тільки поля FAST_LOOKUP_FIELDS без join таблиці користувачів
+                     (user і data завантажуються окремим запитом при зверненні), bool
+        """
+        if self.model.SIGNED_TOKEN_SEPARATOR in token:
+            return self.get_signed_or_none(action, token)
+        backend = get_backend()
+        if not backend.use_cache or not privateurl_cache.is_enabled(action):
+            return backend.get(self.model, action, token, fast=fast)
+        found, obj = privateurl_cache.get_object(action, token, fast)
+        if not found:
+            obj = backend.get(self.model, action, token, fast=fast)
+            privateurl_cache.set_object(action, token, obj, fast)
+        return obj
+
+    def get_signed_or_none(self, action, token):
+        """
+        Перевіряє підписаний токен без звернення до бази, повертає не збережений об'єкт або None
+        """
+        try:
+            value = self.model.get_signer(action).unsign(token)
+            user_id, expire, data = simplejson.loads(signing.b64_decode(force_bytes(value)),
+                                                     **self.model._meta.get_field('data').load_kwargs)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        return self.model.from_signed_payload(action, token, user_id, expire, data)
+
+    STATUSES = ('active', 'expired', 'exhausted')
+    STATS_BUCKETS = {'year': TruncYear, 'month': TruncMonth, 'day': TruncDay, 'hour': TruncHour}
+
+    @staticmethod
+    def status_q(status, dt=None):
+        """
+        Повертає Q об'єктів зі статусом 'active', 'expired' (термін дії минув)
+        або 'exhausted' (ліміт використання вичерпано, термін дії не минув)
+        """
+        now = dt or timezone.now()
+        expired = models.Q(expire__lte=now)
+        exhausted = models.Q(used_limit__gt=0, used_counter__gte=models.F('used_limit'))
+        if status == 'expired':
+            return expired
+        if status == 'exhausted':
+            return exhausted & ~expired
+        if status == 'active':
+            return ~expired & ~exhausted
+        raise AttributeError('Attr status must be one of {}.'.format(', '.join(PrivateUrlManager.STATUSES)))
+
+    def stats(self, action=None, bucket=None, bucket_field='created', dt=None, cache_timeout=None):
+        """
+        Повертає статистику по action одним агрегуючим запитом (в кожній базі даних):
+        список dict з ключами action, bucket (якщо задано), total, active, expired, exhausted,
+        redeemed (використані хоча б раз), used (сума used_counter), redemption_rate (redeemed / total)
+        :param action: назва події (slug) or None for all
+        :param bucket: групування по часу: 'year', 'month', 'day', 'hour' or None
+        :param bucket_field: поле для групування по часу: 'created' or 'last_used'
+            (при групуванні по last_used не використані об'єкти не враховуються)
+        :param dt: поточний час, datetime or None
+        :param cache_timeout: зберігати результат в кеші вказану кількість секунд, int or None
+        """
+        if bucket is not None and bucket not in self.STATS_BUCKETS:
+            raise AttributeError('Attr bucket must be one of {}.'.format(', '.join(sorted(self.STATS_BUCKETS))))
+        if bucket_field not in ('created', 'last_used'):
+            raise AttributeError('Attr bucket_field must be created or last_used.')
+        if cache_timeout:
+            key = 'dju_privateurl:stats:{}:{}:{}'.format(action, bucket, bucket_field)
+            result = privateurl_cache.get_cache().get(key)
+            if result is None:
+                result = self.stats(action=action, bucket=bucket, bucket_field=bucket_field, dt=dt)
+                privateurl_cache.get_cache().set(key, result, cache_timeout)
+            return result
+        now = dt or timezone.now()
+        fields = ['action']
+        aggregates = {'total': models.Count('pk'), 'used': models.Sum('used_counter')}
+        for status in self.STATUSES:
+            aggregates[status] = models.Sum(models.Case(
+                models.When(self.status_q(status, dt=now), then=models.Value(1)),
+                default=models.Value(0), output_field=models.IntegerField(),
+            ))
+        aggregates['redeemed'] = models.Sum(models.Case(
+            models.When(used_counter__gt=0, then=models.Value(1)),
+            default=models.Value(0), output_field=models.IntegerField(),
+        ))
+        result = {}
+        for db in routers.get_databases(self.model, action):
+            qs = self.using(db)
+            if action is not None:
+                qs = qs.filter(action=action)
+            if bucket is not None:
+                qs = qs.filter(**{bucket_field + '__isnull': False}).annotate(bucket=self.STATS_BUCKETS[bucket](bucket_field))
+                fields = ['action', 'bucket']
+            for row in qs.order_by().values(*fields).annotate(**aggregates):
+                key = tuple(row[f] for f in fields)
+                item = result.get(key)
+                if item is None:
+                    result[key] = row
+                else:
+                    for name in aggregates:
+                        item[name] += row[name]
+        result = [result[key] for key in sorted(result, key=lambda k: tuple((v is None, v) for v in k))]
+        for item in result:
+            item['used'] = item['used'] or 0
+            item['redemption_rate'] = float(item['redeemed']) / item['total']
+        return result
+
+    def purgeable(self, grace=None, dt=None):
+        """
+        Повертає queryset об'єктів, термін дії яких минув або ліміт використання вичерпано
+        :param grace: скільки зберігати недійсні об'єкти, timedelta or None
+        :param dt: поточний час, datetime or None
+        """
+        border = (dt or timezone.now()) - (grace or datetime.timedelta())
+        return self.filter(
+            models.Q(expire__lte=border) |  # як в is_available: expire <= now - недійсний
+            models.Q(models.Q(last_used__lt=border) | models.Q(last_used__isnull=True, created__lt=border),
+                     used_limit__gt=0, used_counter__gte=models.F('used_limit'))
+        )
+
+    def purge_chunks(self, action=None, grace=None, chunk_size=1000, sleep=0, dry_run=False, dt=None):
+        """
+        Видаляє недійсні об'єкти частинами по chunk_size в порядку pk, повертає кількість видалених в кожній частині
+        :param action: назва події (slug) or None for all
+        :param grace: скільки зберігати недійсні об'єкти, timedelta or None
+        :param chunk_size: кількість об'єктів в частині, int
+        :param sleep: пауза між частинами в секундах, float
+        :param dry_run: тільки порахувати об'єкти, bool
+        :param dt: поточний час, datetime or None
+        """
+        if chunk_size < 1:
+            raise AttributeError('Attr chunk_size must be positive.')
+        for db in routers.get_databases(self.model, action):
+            qs = self.purgeable(grace=grace, dt=dt).using(db)
+            if action is not None:
+                qs = qs.filter(action=action)
+            last_pk = None
+            while True:
+                chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+                pks = list(chunk_qs.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+                if not pks:
+                    break
+                if last_pk is not None and sleep:
+                    time.sleep(sleep)
+                last_pk = pks[-1]
+                if dry_run:
+                    yield len(pks)
+                else:
+                    yield qs.filter(pk__in=pks).delete()[1].get(self.model._meta.label, 0)
+
+    def purge(self, **kwargs):
+        """
+        Видаляє недійсні об'єкти (параметри як в purge_chunks), повертає кількість видалених
+        """
+        return sum(self.purge_chunks(**kwargs))
 
 
 class PrivateUrl(models.Model):
     TOKEN_MIN_SIZE = 8
     TOKEN_MAX_SIZE = 65
+    BULK_LOOKUP_SIZE = 500
+    SIGNED_TOKEN_MAX_SIZE = 512
+    SIGNED_TOKEN_SEPARATOR = ':'
+    ALLOCATION_CANDIDATES = 8  # tokens checked by one query after collision in create
+    # token space is checked (COUNT of action) after this number of failed rounds of create, not on every collision
+    TOKEN_SPACE_CHECK_ROUNDS = 2
+    # fields loaded by get_or_none(fast=True): everything is_available, redeem and used_counter_inc need
+    FAST_LOOKUP_FIELDS = ('user', 'action', 'token', 'expire', 'used_limit', 'used_counter', 'first_used',
+                          'last_used', 'auto_delete')
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('user'), null=True, blank=True)
-    action = models.SlugField(verbose_name=_('action'), max_length=32, db_index=True)
-    token = models.SlugField(verbose_name=_('token'), max_length=TOKEN_MAX_SIZE)
-    expire = models.DateTimeField(verbose_name=_('expire'), null=True, blank=True, db_index=True)
-    data = JSONField(verbose_name=_('data'), use_decimal=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('user'), null=True, blank=True,
+                             db_index=False)
+    action = models.SlugField(verbose_name=_('action'), max_length=32, db_index=False)
+    token = models.SlugField(verbose_name=_('token'), max_length=TOKEN_MAX_SIZE, db_index=False)
+    expire = models.DateTimeField(verbose_name=_('expire'), null=True, blank=True)
+    data = PayloadField(verbose_name=_('data'), use_decimal=True)
     created = models.DateTimeField(verbose_name=_('created'), auto_now_add=True, db_index=True)
     used_limit = models.PositiveIntegerField(verbose_name=_('used limit'), default=1, help_text=_('Set 0 to unlimit.'))
     used_counter = models.PositiveIntegerField(verbose_name=_('used counter'), default=0)
     first_used = models.DateTimeField(verbose_name=_('first used'), null=True, blank=True)
     last_used = models.DateTimeField(verbose_name=_('last used'), null=True, blank=True)
-    auto_delete = models.BooleanField(verbose_name=_('auto delete'), default=False, db_index=True,
+    auto_delete = models.BooleanField(verbose_name=_('auto delete'), default=False,
                                       help_text=_("Delete object if it can no longer be used."))
 
     objects = PrivateUrlManager()
 
+    signed = False  # True for objects of signed tokens, they are not stored in database
+
     class Meta:
         db_table = 'dju_privateurl'
         ordering = ('-created',)
         unique_together = ('action', 'token')
+        # (user, action) for create(replace=True), (action, created) for admin filter with ordering by -created;
+        # partial index on expire (not null) is created in migration 0003
+        index_together = (('user', 'action'), ('action', 'created'))
         verbose_name = _('private url')
         verbose_name_plural = _('private urls')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super(PrivateUrl, cls).from_db(db, field_names, values)
+        obj._saved_token = obj.__dict__.get('token')  # зміна токена при save() додається до bloom фільтра
+        return obj
+
     @classmethod
     def create(cls, action, user=None, expire=None, data=None, used_limit=1, auto_delete=False, token_size=None,
                replace=False, dash_split_each=None):
@@ -61,27 +241,196 @@ class PrivateUrl(models.Model):
         :param dash_split_each: розділяти токен знаком мінуса кожні N символів, int or None (= 12)
         :return: new saved object
         """
-        if replace and user:
-            with transaction.atomic():
-                cls.objects.filter(action=action, user=user).delete()
+        backend = get_backend()
+        replace = bool(replace and user)
         if data:
-            data = copy.deepcopy(data)
+            data = cls._meta.get_field('data').encode(data)  # obj.data is decoded from saved value on access
+        if isinstance(expire, datetime.timedelta):
+            expire = timezone.now() + expire
+        tokens = [cls.generate_token(size=token_size, dash_split_each=dash_split_each)]
+        for i in xrange(20):
+            for token in tokens:
+                obj = cls(user=user, action=action, token=token, expire=expire, data=data, used_limit=used_limit,
+                          auto_delete=auto_delete)
+                if backend.insert(obj, replace=replace):
+                    return obj
+            if i + 1 == cls.TOKEN_SPACE_CHECK_ROUNDS:
+                cls.check_token_space(action, token_size, dash_split_each)
+            # наступні кандидати перевіряються одним запитом, вставляються тільки вільні
+            candidates = cls.generate_tokens(cls.ALLOCATION_CANDIDATES, size=token_size,
+                                             dash_split_each=dash_split_each)
+            collisions = len(tokens) + len(candidates)
+            tokens = backend.free_tokens(cls, action, sorted(set(candidates), key=candidates.index))
+            collisions -= len(tokens)
+            metrics = get_metrics()
+            if metrics is not None:
+                metrics.incr('create_retry', action, collisions)
+        raise RuntimeError("It can't make PrivateUrl object (action={}, token_size={})".format(action, token_size))
+
+    @classmethod
+    def token_collision_probability(cls, action, token_size=None, dash_split_each=None, n=1):
+        """
+        Повертає ймовірність того, що хоча б один з n нових токенів вже зайнятий для action
+        (None, якщо бекенд не може порахувати об'єкти)
+        """
+        existing = get_backend().count(cls, action)
+        if existing is None:
+            return None
+        generator = get_token_generator(token_size, dash_split_each, cls.TOKEN_MIN_SIZE, cls.TOKEN_MAX_SIZE)
+        return generator.collision_probability(existing, n=n)
+
+    @classmethod
+    def check_token_space(cls, action, token_size=None, dash_split_each=None):
+        """
+        Викидає TokenSpaceExhausted, якщо новий токен буде зайнятий з ймовірністю
+        більшою за DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY
+        """
+        p = cls.token_collision_probability(action, token_size, dash_split_each)
+        if p is not None and p > pu_settings.DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY:
+            raise TokenSpaceExhausted(
+                'Tokens of action {} are near exhaustion (token_size={}, collision probability {:.1%}), '
+                'use larger token_size.'.format(action, token_size, p)
+            )
+
+    @classmethod
+    def create_signed(cls, action, user=None, expire=None, data=None):
+        """
+        Створює не збережений в базі об'єкт PrivateUrl з підписаним токеном.
+        user, expire та data містяться в самому токені, ліміт використання відсутній.
+        :param action: назва події (slug)
+        :param user: user or None
+        :param expire: термін дії (з точністю до секунди), datetime or timedelta or None
+        :param data: невеликі додаткові дані, dict or None
+        :return: new not saved object
+        """
         if isinstance(expire, datetime.timedelta):
             expire = timezone.now() + expire
+        if expire is not None:
+            if timezone.is_naive(expire):
+                expire = timezone.make_aware(expire)
+            expire = calendar.timegm(expire.utctimetuple())
+        user_id = user.pk if user else None
+        data = data or None
+        value = signing.b64_encode(simplejson.dumps([user_id, expire, data],
+                                                    **cls._meta.get_field('data').dump_kwargs))
+        token = cls.get_signer(action).sign(value)
+        if len(token) > cls.SIGNED_TOKEN_MAX_SIZE:
+            raise AttributeError('Signed token is too long ({} > {}), reduce data.'.format(
+                len(token), cls.SIGNED_TOKEN_MAX_SIZE
+            ))
+        return cls.from_signed_payload(action, token, user_id, expire, copy.deepcopy(data))
+
+    @classmethod
+    def get_signer(cls, action):
+        return signing.Signer(key=pu_settings.DJU_PRIVATEURL_SIGNING_KEY, sep=cls.SIGNED_TOKEN_SEPARATOR,
+                              salt='dju_privateurl:{}'.format(action))
+
+    @classmethod
+    def from_signed_payload(cls, action, token, user_id, expire, data):
+        if expire is not None:
+            expire = datetime.datetime.fromtimestamp(expire, timezone.utc)
+            if not settings.USE_TZ:
+                expire = timezone.make_naive(expire)
+        obj = cls(action=action, token=token, user_id=user_id, expire=expire, data=data, used_limit=0)
+        obj.signed = True
+        return obj
+
+    @classmethod
+    def bulk_create_tokens(cls, action, items, used_limit=1, auto_delete=False, token_size=None,
+                           dash_split_each=None, batch_size=500):
+        """
+        Створює багато об'єктів PrivateUrl пакетами через bulk_create
+        :param action: назва події (slug)
+        :param items: кількість об'єктів, int, або ітератор dict з ключами user, data, expire (значення як в create)
+        :param used_limit: обмеження по кількості використання, int
+        :param auto_delete: автовидалення, якщо посилання буде недійсне, bool
+        :param token_size: довжина токена, tuple (min, max) or number or None (=(40, 64))
+        :param dash_split_each: розділяти токен знаком мінуса кожні N символів, int or None (= 12)
+        :param batch_size: кількість об'єктів в одному пакеті, int
+        :return: list of new saved objects (pk is set only on backends which can return ids from bulk insert)
+        """
+        if batch_size < 1:
+            raise AttributeError('Attr batch_size must be positive.')
+        if isinstance(items, (int, long)):
+            items = ({} for _ in xrange(items))
+        now = timezone.now()
+        data_field = cls._meta.get_field('data')
+        result, batch = [], []
+        for item in items:
+            expire = item.get('expire')
+            if isinstance(expire, datetime.timedelta):
+                expire = now + expire
+            data = item.get('data')
+            if data:
+                data = data_field.encode(data)
+            batch.append(cls(user=item.get('user'), action=action, expire=expire, data=data,
+                             used_limit=used_limit, auto_delete=auto_delete))
+            if len(batch) >= batch_size:
+                result.extend(cls._bulk_insert(action, batch, token_size, dash_split_each))
+                batch = []
+        if batch:
+            result.extend(cls._bulk_insert(action, batch, token_size, dash_split_each))
+        return result
+
+    @classmethod
+    def _bulk_insert(cls, action, objs, token_size, dash_split_each):
+        """
+        Присвоює токени пакету об'єктів і зберігає його одним bulk_create.
+        Перегенеровуються тільки токени, які вже є в базі для action або повторюються в пакеті.
+        """
         max_tries, n = 20, 0
+        db = routers.db_for_write(cls, action)
+        tokens = set()
+        cls._assign_tokens(objs, tokens, token_size, dash_split_each)
         while True:
-            try:
-                with transaction.atomic():
-                    token = cls.generate_token(size=token_size, dash_split_each=dash_split_each)
-                    return cls.objects.create(user=user, action=action, token=token,
-                                              expire=expire, data=data, used_limit=used_limit,
-                                              auto_delete=auto_delete)
-            except IntegrityError:
-                n += 1
-                if n > max_tries:
-                    raise RuntimeError("It can't make PrivateUrl object (action={}, token_size={})".format(
-                        action, token_size
-                    ))
+            busy = set()
+            for i in xrange(0, len(objs), cls.BULK_LOOKUP_SIZE):
+                chunk = [obj.token for obj in objs[i:i + cls.BULK_LOOKUP_SIZE]]
+                busy.update(cls.objects.using(db).filter(action=action, token__in=chunk).order_by()
+                            .values_list('token', flat=True))
+            if not busy:
+                try:
+                    with transaction.atomic(using=db):
+                        cls.objects.using(db).bulk_create(objs)
+                    if privateurl_cache.is_enabled(action):
+                        privateurl_cache.invalidate(action, [obj.token for obj in objs], using=db)
+                    bloom.add(action, [obj.token for obj in objs])  # bulk_create не надсилає post_save
+                    return objs
+                except IntegrityError:
+                    pass  # токен зайняли паралельно між перевіркою та вставкою
+            n += 1
+            metrics = get_metrics()
+            if metrics is not None:
+                metrics.incr('bulk_create_retry', action)
+            if n == 1 and busy:
+                cls.check_token_space(action, token_size, dash_split_each)
+            if n > max_tries:
+                raise RuntimeError("It can't make PrivateUrl objects (action={}, token_size={})".format(
+                    action, token_size
+                ))
+            rest = [obj for obj in objs if not busy or obj.token in busy]
+            for obj in rest:
+                tokens.discard(obj.token)
+            cls._assign_tokens(rest, tokens, token_size, dash_split_each)
+
+    @classmethod
+    def _assign_tokens(cls, objs, tokens, token_size, dash_split_each, max_tries=20):
+        """
+        Присвоює об'єктам токени, яких немає в tokens, і додає їх в tokens
+        """
+        for i in xrange(max_tries):
+            rest = []
+            for obj, token in zip(objs, cls.generate_tokens(len(objs), size=token_size,
+                                                            dash_split_each=dash_split_each)):
+                if token in tokens:
+                    rest.append(obj)
+                else:
+                    tokens.add(token)
+                    obj.token = token
+            if not rest:
+                return
+            objs = rest
+        raise RuntimeError("It can't make unique token in batch (token_size={})".format(token_size))
 
     def is_available(self, dt=None):
         """
@@ -93,21 +442,38 @@ class PrivateUrl(models.Model):
             return False
         return True
 
-    def used_counter_inc(self):
-        obj_is_exists = self.pk
-        now = timezone.now()
+    def redeem(self, dt=None):
+        """
+        Атомарно перевіряє доступність і збільшує лічильник використань (див. redeem бекенда).
+        Повертає True, якщо об'єкт використано
+        """
+        now = dt or timezone.now()
+        if self.signed:
+            if not self.is_available(dt=now):
+                return False
+            self.used_counter_inc(dt=now)
+            return True
+        return get_backend().redeem(self, now)
+
+    def used_counter_inc(self, dt=None):
+        now = dt or timezone.now()
         self.used_counter += 1
         if self.auto_delete and not self.is_available(dt=now):
-            if obj_is_exists:
-                self.delete()
+            if not self.signed:
+                get_backend().delete(self)
             return
-        uf = {'used_counter', 'last_used'}
         if not self.first_used:
             self.first_used = now
-            uf.add('first_used')
         self.last_used = now
-        if obj_is_exists:
-            self.save(update_fields=uf)
+        if not self.signed:
+            get_backend().save_usage(self, now)
+
+    def discard(self):
+        """
+        Видаляє об'єкт з бекенда
+        """
+        if not self.signed:
+            get_backend().delete(self)
 
     @classmethod
     def generate_token(cls, size=None, dash_split_each=None):
@@ -115,49 +481,42 @@ class PrivateUrl(models.Model):
         Генерує новий унікальний токен для action.
         size = (мінімальни розмір, максимальний розмір) або просто розмір
         """
-        if not isinstance(size, (int, list, tuple, NoneType)):
-            raise AttributeError('Attr size must be int, list, tuple or None.')
-        if isinstance(size, (list, tuple)) and len(size) != 2:
-            raise AttributeError('Attr size must contains two values.')
-        if size is None:
-            size = (36, 60)
-
-        if not isinstance(dash_split_each, (int, NoneType)):
-            raise AttributeError('Attr dash_split_each must be int or None')
-        if dash_split_each is None:
-            dash_split_each = 12
-        elif dash_split_each < 4 and dash_split_each != 0:
-            raise AttributeError('Attr dash_split_each must be 0 or minimum 4.')
-
-        if dash_split_each:
-            tm = int(ceil((cls.TOKEN_MAX_SIZE * dash_split_each) / (dash_split_each + 1.)))
-        else:
-            tm = cls.TOKEN_MAX_SIZE
-
-        if isinstance(size, (list, tuple)):
-            if not (cls.TOKEN_MIN_SIZE <= size[0] < tm and cls.TOKEN_MIN_SIZE < size[1] <= tm):
-                raise AttributeError('Attr size and dash_split_each have incompatible values ({}..{}, {}).'.format(
-                    size[0], size[1], dash_split_each
-                ))
-            if not (size[0] < size[1]):
-                raise AttributeError('Attr size has incorrect values ({}..{}).'.format(size[0], size[1]))
-            random.seed(get_random_string(length=100))
-            _size = random.randint(*size)
-        else:
-            if not (cls.TOKEN_MIN_SIZE <= size <= tm):
-                raise AttributeError('Attr size and dash_split_each have incompatible values ({}, {}).'.format(
-                    size, dash_split_each
-                ))
-            _size = size
+        return get_token_generator(size, dash_split_each, cls.TOKEN_MIN_SIZE, cls.TOKEN_MAX_SIZE)()
 
-        token = get_random_string(length=_size)
-        if dash_split_each > 0:
-            n = dash_split_each
-            while n < len(token):
-                token = token[:n] + '-' + token[n:]
-                n += dash_split_each + 1
+    @classmethod
+    def generate_tokens(cls, n, size=None, dash_split_each=None):
+        """
+        Генерує список з n токенів (параметри як в generate_token), ентропія читається великими блоками
+        """
+        return get_token_generator(size, dash_split_each, cls.TOKEN_MIN_SIZE, cls.TOKEN_MAX_SIZE).generate_tokens(n)
 
-        return token
+    @classmethod
+    def is_valid_token(cls, action, token):
+        """
+        Перевіряє формат токена для action з DJU_PRIVATEURL_TOKEN_FORMATS без запиту до бази даних.
+        Токени інших action та підписані токени вважаються валідними.
+        """
+        token_format = pu_settings.DJU_PRIVATEURL_TOKEN_FORMATS.get(action)
+        if token_format is None or cls.SIGNED_TOKEN_SEPARATOR in token:
+            return True
+        size, dash_split_each = token_format
+        return get_token_generator(size, dash_split_each, cls.TOKEN_MIN_SIZE, cls.TOKEN_MAX_SIZE).is_valid(token)
 
     def get_absolute_url(self):
         return reverse('dju_privateurl', kwargs={'action': self.action, 'token': self.token})
+
+
+@receiver((post_save, post_delete), sender=PrivateUrl, dispatch_uid='dju_privateurl_cache_invalidate')
+def cache_invalidate(sender, instance, using, **kwargs):
+    if privateurl_cache.is_enabled(instance.action):
+        privateurl_cache.invalidate(instance.action, instance.token, using=using)
+
+
+@receiver(post_save, sender=PrivateUrl, dispatch_uid='dju_privateurl_bloom_add')
+def bloom_add(sender, instance, created, **kwargs):
+    token = instance.__dict__.get('token')  # deferred token is not changed
+    if token is None or not bloom.is_enabled(instance.action):
+        return
+    if created or getattr(instance, '_saved_token', None) != token:
+        bloom.add(instance.action, [token])
+    instance._saved_token = token
@@ -0,0 +1,74 @@
+# coding=utf-8
+"""
+Routing of PrivateUrl objects to databases by action (DJU_PRIVATEURL_ACTION_DATABASES).
+Lookups by action (get_or_none, create, bulk_create_tokens, purge) use db_for_action directly,
+PrivateUrlRouter (DATABASE_ROUTERS) routes operations on loaded objects and reads users from their own database.
+get_or_none reads from replica of database (DJU_PRIVATEURL_READ_DATABASES) if it is configured.
+"""
+from django.db import router
+from . import settings as pu_settings
+
+
+def db_for_action(action):
+    """
+    Returns database alias for action or None if action is not routed.
+    """
+    return pu_settings.DJU_PRIVATEURL_ACTION_DATABASES.get(action)
+
+
+def db_for_read(model, action):
+    return db_for_action(action) or router.db_for_read(model)
+
+
+def db_for_write(model, action):
+    return db_for_action(action) or router.db_for_write(model)
+
+
+def replica_for(db):
+    """
+    Returns alias of replica of database or None.
+    """
+    return pu_settings.DJU_PRIVATEURL_READ_DATABASES.get(db)
+
+
+def get_databases(model, action=None):
+    """
+    Returns databases with objects of action (all databases of PrivateUrl for None).
+    """
+    if action is not None:
+        return [db_for_write(model, action)]
+    dbs = [router.db_for_write(model)]
+    for db in pu_settings.DJU_PRIVATEURL_ACTION_DATABASES.values():
+        if db not in dbs:
+            dbs.append(db)
+    return dbs
+
+
+def _is_privateurl(obj):
+    return obj._meta.app_label == 'dju_privateurl' and obj._meta.model_name == 'privateurl'
+
+
+class PrivateUrlRouter(object):
+    """
+    Add 'dju_privateurl.routers.PrivateUrlRouter' to DATABASE_ROUTERS when DJU_PRIVATEURL_ACTION_DATABASES is used.
+    """
+    def _db(self, model, hints, default):
+        instance = hints.get('instance')
+        if instance is None or not _is_privateurl(instance):
+            return None
+        if _is_privateurl(model):
+            return db_for_action(instance.action)
+        if db_for_action(instance.action):
+            return default(model)  # e.g. user of object from routed database is read from database of users
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints, router.db_for_read)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints, router.db_for_write)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if _is_privateurl(obj1) or _is_privateurl(obj2):
+            return True
+        return None
@@ -0,0 +1,117 @@
+from django.conf import settings
+
+
+# ------------
+# LOOKUP CACHE
+# ------------
+DJU_PRIVATEURL_CACHE_ACTIONS = getattr(settings, 'DJU_PRIVATEURL_CACHE_ACTIONS', ())  # actions or '*' for all
+DJU_PRIVATEURL_CACHE_ALIAS = getattr(settings, 'DJU_PRIVATEURL_CACHE_ALIAS', 'default')
+DJU_PRIVATEURL_CACHE_TIMEOUT = getattr(settings, 'DJU_PRIVATEURL_CACHE_TIMEOUT', 300)
+DJU_PRIVATEURL_CACHE_NEGATIVE_TIMEOUT = getattr(settings, 'DJU_PRIVATEURL_CACHE_NEGATIVE_TIMEOUT', 30)
+
+
+# ------------
+# USAGE BUFFER (write-behind counters of unlimited links)
+# ------------
+DJU_PRIVATEURL_USAGE_BUFFER_ACTIONS = getattr(settings, 'DJU_PRIVATEURL_USAGE_BUFFER_ACTIONS', ())  # or '*'
+DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL = getattr(settings, 'DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL', 10)  # seconds
+DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD = getattr(settings, 'DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD', 1000)
+
+
+# ------------
+# SIGNED (STATELESS) TOKENS
+# ------------
+DJU_PRIVATEURL_SIGNING_KEY = getattr(settings, 'DJU_PRIVATEURL_SIGNING_KEY', None)  # None = SECRET_KEY
+
+
+# ------------
+# TOKENS
+# ------------
+# create (after PrivateUrl.TOKEN_SPACE_CHECK_ROUNDS failed rounds) and bulk_create_tokens (after collision)
+# raise TokenSpaceExhausted if new token would be used with higher probability
+# (see PrivateUrl.token_collision_probability)
+DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY = getattr(settings, 'DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY', 0.5)
+
+
+# ------------
+# STORAGE BACKEND
+# ------------
+DJU_PRIVATEURL_BACKEND = getattr(settings, 'DJU_PRIVATEURL_BACKEND', 'dju_privateurl.backends.orm.ORMBackend')
+DJU_PRIVATEURL_BACKEND_OPTIONS = getattr(settings, 'DJU_PRIVATEURL_BACKEND_OPTIONS', {})
+
+
+# ------------
+# DATABASE ROUTING
+# ------------
+# {action: database alias}, other actions are stored in database of DATABASE_ROUTERS (default);
+# add 'dju_privateurl.routers.PrivateUrlRouter' to DATABASE_ROUTERS, table must be migrated in each database
+DJU_PRIVATEURL_ACTION_DATABASES = getattr(settings, 'DJU_PRIVATEURL_ACTION_DATABASES', {})
+# {primary database alias: replica alias}, get_or_none reads from replica and falls back to primary
+# when object is not found or not available there (not replicated yet), objects are always written to primary
+DJU_PRIVATEURL_READ_DATABASES = getattr(settings, 'DJU_PRIVATEURL_READ_DATABASES', {})
+
+
+# ------------
+# VIEW
+# ------------
+# lookup only fields needed for redemption, without join of user table (see PrivateUrlManager.get_or_none)
+DJU_PRIVATEURL_FAST_LOOKUP = getattr(settings, 'DJU_PRIVATEURL_FAST_LOOKUP', False)
+
+
+# ------------
+# THROTTLING (view)
+# ------------
+# token buckets in cache: (capacity, seconds of full refill) or None (disabled),
+# e.g. (20, 60) allows bursts of 20 requests and 1 request per 3 seconds after them
+DJU_PRIVATEURL_THROTTLE_IP = getattr(settings, 'DJU_PRIVATEURL_THROTTLE_IP', None)  # per client ip and action
+DJU_PRIVATEURL_THROTTLE_ACTION = getattr(settings, 'DJU_PRIVATEURL_THROTTLE_ACTION', None)  # per action
+DJU_PRIVATEURL_THROTTLE_CACHE_ALIAS = getattr(settings, 'DJU_PRIVATEURL_THROTTLE_CACHE_ALIAS', 'default')
+# key of request.META with ip of client, e.g. 'HTTP_X_FORWARDED_FOR' behind proxy
+DJU_PRIVATEURL_THROTTLE_IP_HEADER = getattr(settings, 'DJU_PRIVATEURL_THROTTLE_IP_HEADER', 'REMOTE_ADDR')
+# number of trusted proxies which append addresses to header: client ip is taken that many places from the right
+# (the rightmost address for 1), addresses on the left are sent by client and can be spoofed
+DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES = getattr(settings, 'DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES', 1)
+# path to function(request, action, retry_after) which returns response or None (= 429 with Retry-After)
+DJU_PRIVATEURL_THROTTLE_RESPONSE = getattr(settings, 'DJU_PRIVATEURL_THROTTLE_RESPONSE', None)
+# {action: (token_size, dash_split_each)} as in PrivateUrl.create, tokens of other format are not looked up
+DJU_PRIVATEURL_TOKEN_FORMATS = getattr(settings, 'DJU_PRIVATEURL_TOKEN_FORMATS', {})
+
+
+# ------------
+# BLOOM FILTER (view doesn't look up definitely unknown tokens, see dju_privateurl.bloom)
+# ------------
+DJU_PRIVATEURL_BLOOM_ACTIONS = getattr(settings, 'DJU_PRIVATEURL_BLOOM_ACTIONS', ())  # actions or '*' for all
+DJU_PRIVATEURL_BLOOM_FP_RATE = getattr(settings, 'DJU_PRIVATEURL_BLOOM_FP_RATE', 0.01)  # false positive rate
+DJU_PRIVATEURL_BLOOM_CACHE_ALIAS = getattr(settings, 'DJU_PRIVATEURL_BLOOM_CACHE_ALIAS', 'default')
+# directory for memory-mapped filters (shared by processes of one host) or None (filters are stored in cache,
+# filter takes about 1.2 bytes per token with 1% false positive rate, memcached limits item size to 1 MB by default)
+DJU_PRIVATEURL_BLOOM_DIR = getattr(settings, 'DJU_PRIVATEURL_BLOOM_DIR', None)
+# "build_privateurl_bloom --if-stale" rebuilds filters older than interval or with more additions since build
+DJU_PRIVATEURL_BLOOM_REBUILD_INTERVAL = getattr(settings, 'DJU_PRIVATEURL_BLOOM_REBUILD_INTERVAL', 3600)  # seconds
+DJU_PRIVATEURL_BLOOM_REBUILD_ADDITIONS = getattr(settings, 'DJU_PRIVATEURL_BLOOM_REBUILD_ADDITIONS', 10000)
+# journal of tokens created after build must live longer than interval between builds
+DJU_PRIVATEURL_BLOOM_JOURNAL_TIMEOUT = getattr(settings, 'DJU_PRIVATEURL_BLOOM_JOURNAL_TIMEOUT', 86400)  # seconds
+
+
+# ------------
+# ADMIN
+# ------------
+DJU_PRIVATEURL_ADMIN_COUNT_TIMEOUT = getattr(settings, 'DJU_PRIVATEURL_ADMIN_COUNT_TIMEOUT', 60)  # seconds
+# count of whole table is estimated by postgresql statistics if it is larger
+DJU_PRIVATEURL_ADMIN_ESTIMATE_MIN = getattr(settings, 'DJU_PRIVATEURL_ADMIN_ESTIMATE_MIN', 100000)
+DJU_PRIVATEURL_ADMIN_ACTIONS_TIMEOUT = getattr(settings, 'DJU_PRIVATEURL_ADMIN_ACTIONS_TIMEOUT', 300)  # seconds
+
+
+# ------------
+# METRICS
+# ------------
+# path to dju_privateurl.metrics.BaseMetrics subclass (e.g. 'dju_privateurl.metrics.InMemoryMetrics') or None
+DJU_PRIVATEURL_METRICS = getattr(settings, 'DJU_PRIVATEURL_METRICS', None)
+DJU_PRIVATEURL_METRICS_OPTIONS = getattr(settings, 'DJU_PRIVATEURL_METRICS_OPTIONS', {})
+
+
+# ------------
+# PAYLOAD (PrivateUrl.data)
+# ------------
+# 'json' or 'compact' (JSON with types of Decimal and datetime values, compressed if large, see dju_privateurl.fields)
+DJU_PRIVATEURL_DATA_FORMAT = getattr(settings, 'DJU_PRIVATEURL_DATA_FORMAT', 'json')
@@ -1,5 +1,68 @@
 from django.dispatch import Signal
 
 
-privateurl_ok = Signal(providing_args=['request', 'obj', 'action'])
-privateurl_fail = Signal(providing_args=['request', 'obj', 'action'])
+class ActionSignal(Signal):
+    """
+    Signal with handlers registered per action.
+    Handlers of action are called before receivers of signal, the first response returned by handler
+    is response of view and receivers are not called then.
+    """
+    def __init__(self, providing_args=None, use_caching=False):
+        super(ActionSignal, self).__init__(providing_args=providing_args, use_caching=use_caching)
+        self.handlers = {}
+
+    def connect_action(self, action, handler):
+        """
+        Registers handler(request, obj, action) which returns response or None.
+        """
+        handlers = self.handlers.setdefault(action, [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    def disconnect_action(self, action, handler=None):
+        """
+        Unregisters handler of action (all handlers of action if handler is None).
+        """
+        if handler is None:
+            self.handlers.pop(action, None)
+            return
+        handlers = self.handlers.get(action, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self.handlers.pop(action, None)
+
+    def dispatch(self, sender, request, obj, action):
+        """
+        Calls handlers of action and then receivers of signal (if handlers returned nothing).
+        Returns the first response or None.
+        """
+        for handler in self.handlers.get(action, ()):
+            response = handler(request=request, obj=obj, action=action)
+            if response is not None:
+                return response
+        if not self.receivers:
+            return None
+        for receiver, result in self.send(sender, request=request, obj=obj, action=action):
+            if isinstance(result, dict) and 'response' in result:
+                return result['response']
+        return None
+
+
+def action_handler(signal, action):
+    """
+    Decorator which registers function as handler of action for signal (or list of signals), e.g.:
+
+    @action_handler(privateurl_ok, 'registration')
+    def registration_ok(request, obj, action):
+        return HttpResponseRedirect(...)
+    """
+    def _decorator(func):
+        for s in (signal if isinstance(signal, (list, tuple)) else (signal,)):
+            s.connect_action(action, func)
+        return func
+    return _decorator
+
+
+privateurl_ok = ActionSignal(providing_args=['request', 'obj', 'action'])
+privateurl_fail = ActionSignal(providing_args=['request', 'obj', 'action'])
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+Throttling of privateurl_view by token buckets in cache (DJU_PRIVATEURL_THROTTLE_IP, DJU_PRIVATEURL_THROTTLE_ACTION).
+Bucket is stored as (tokens, timestamp) and refilled on read. Get and set of bucket are not atomic,
+so concurrent requests can pass a few more requests than capacity, which is enough against enumeration of tokens.
+"""
+import math
+import time
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from . import settings as pu_settings
+
+
+KEY_PREFIX = 'dju_privateurl:throttle'
+
+
+def get_cache():
+    return caches[pu_settings.DJU_PRIVATEURL_THROTTLE_CACHE_ALIAS]
+
+
+def is_enabled():
+    return bool(pu_settings.DJU_PRIVATEURL_THROTTLE_IP or pu_settings.DJU_PRIVATEURL_THROTTLE_ACTION)
+
+
+def get_client_ip(request):
+    """
+    Returns address which is DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES places from the right in header,
+    addresses on the left are sent by client and can be spoofed.
+    """
+    ip = request.META.get(pu_settings.DJU_PRIVATEURL_THROTTLE_IP_HEADER) or request.META.get('REMOTE_ADDR', '')
+    addresses = ip.split(',')
+    return addresses[max(0, len(addresses) - max(1, pu_settings.DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES))].strip()
+
+
+def consume(key, capacity, period, now=None):
+    """
+    Takes one token from bucket. Returns 0 or number of seconds until token will be available.
+    :param capacity: max number of tokens in bucket
+    :param period: seconds of refill of empty bucket
+    """
+    cache = get_cache()
+    now = now or time.time()
+    value = cache.get(key)
+    if value is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, value[0] + (now - value[1]) * capacity / float(period))
+    if tokens < 1:
+        return (1 - tokens) * period / float(capacity)
+    cache.set(key, (tokens - 1, now), int(math.ceil(period)))  # bucket is full again when key expires
+    return 0
+
+
+def get_retry_after(request, action, now=None):
+    """
+    Returns 0 if request is allowed or number of seconds to wait.
+    """
+    buckets = []
+    if pu_settings.DJU_PRIVATEURL_THROTTLE_IP:
+        buckets.append(('{}:ip:{}:{}'.format(KEY_PREFIX, action, get_client_ip(request)),
+                        pu_settings.DJU_PRIVATEURL_THROTTLE_IP))
+    if pu_settings.DJU_PRIVATEURL_THROTTLE_ACTION:
+        buckets.append(('{}:action:{}'.format(KEY_PREFIX, action), pu_settings.DJU_PRIVATEURL_THROTTLE_ACTION))
+    for key, (capacity, period) in buckets:
+        retry_after = consume(key, capacity, period, now=now)
+        if retry_after:
+            return retry_after
+    return 0
+
+
+def throttled_response(request, action, retry_after):
+    if pu_settings.DJU_PRIVATEURL_THROTTLE_RESPONSE:
+        response = import_string(pu_settings.DJU_PRIVATEURL_THROTTLE_RESPONSE)(request, action, retry_after)
+        if response is not None:
+            return response
+    response = HttpResponse('Too many requests.', status=429, content_type='text/plain')
+    response['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
+
+def check(request, action):
+    """
+    Returns response for throttled request or None.
+    """
+    if not is_enabled():
+        return None
+    retry_after = get_retry_after(request, action)
+    if retry_after:
+        return throttled_response(request, action, retry_after)
+    return None
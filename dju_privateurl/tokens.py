@@ -0,0 +1,182 @@
+# coding=utf-8
+import os
+import re
+import string
+from math import ceil, expm1, log1p
+from types import NoneType
+
+
+ALPHABET = string.ascii_letters + string.digits
+# bytes from os.urandom are mapped to ALPHABET by str.translate, bytes >= _CHAR_LIMIT are dropped (rejection sampling)
+_CHAR_LIMIT = 256 - 256 % len(ALPHABET)
+_CHAR_TABLE = ''.join(ALPHABET[i % len(ALPHABET)] for i in xrange(256))
+_CHAR_DELETE = ''.join(chr(i) for i in xrange(_CHAR_LIMIT, 256))
+_INVALID_CHAR = re.compile('[^{}]'.format(ALPHABET))
+
+
+class TokenSpaceExhausted(RuntimeError):
+    """
+    Raised when new token would collide with existing one with too high probability.
+    """
+
+
+def random_chars(count):
+    """
+    Returns string of count uniformly distributed chars of ALPHABET.
+    """
+    result = ''
+    while len(result) < count:
+        need = count - len(result)
+        result += os.urandom(need * 256 // _CHAR_LIMIT + 16).translate(_CHAR_TABLE, _CHAR_DELETE)
+    return result[:count]
+
+
+class TokenGenerator(object):
+    """
+    Generates tokens of one configuration (size, dash_split_each).
+    Configuration is validated once in constructor.
+    """
+    DEFAULT_SIZE = (36, 60)
+    DEFAULT_DASH_SPLIT_EACH = 12
+    BLOCK_SIZE = 1 << 20  # max bytes read from os.urandom at once
+
+    def __init__(self, size=None, dash_split_each=None, min_size=8, max_size=65):
+        """
+        :param size: (мінімальний розмір, максимальний розмір) або просто розмір, or None (= DEFAULT_SIZE)
+        :param dash_split_each: розділяти токен знаком мінуса кожні N символів, int or None (= 12)
+        :param min_size: мінімальна довжина токена
+        :param max_size: максимальна довжина токена разом зі знаками мінуса
+        """
+        if not isinstance(size, (int, list, tuple, NoneType)):
+            raise AttributeError('Attr size must be int, list, tuple or None.')
+        if isinstance(size, (list, tuple)) and len(size) != 2:
+            raise AttributeError('Attr size must contains two values.')
+        if size is None:
+            size = self.DEFAULT_SIZE
+
+        if not isinstance(dash_split_each, (int, NoneType)):
+            raise AttributeError('Attr dash_split_each must be int or None')
+        if dash_split_each is None:
+            dash_split_each = self.DEFAULT_DASH_SPLIT_EACH
+        elif dash_split_each < 4 and dash_split_each != 0:
+            raise AttributeError('Attr dash_split_each must be 0 or minimum 4.')
+
+        if dash_split_each:
+            tm = int(ceil((max_size * dash_split_each) / (dash_split_each + 1.)))
+        else:
+            tm = max_size
+
+        if isinstance(size, (list, tuple)):
+            if not (min_size <= size[0] < tm and min_size < size[1] <= tm):
+                raise AttributeError('Attr size and dash_split_each have incompatible values ({}..{}, {}).'.format(
+                    size[0], size[1], dash_split_each
+                ))
+            if not (size[0] < size[1]):
+                raise AttributeError('Attr size has incorrect values ({}..{}).'.format(size[0], size[1]))
+            self.min_size, self.max_size = size
+        else:
+            if not (min_size <= size <= tm):
+                raise AttributeError('Attr size and dash_split_each have incompatible values ({}, {}).'.format(
+                    size, dash_split_each
+                ))
+            self.min_size = self.max_size = size
+        self.dash_split_each = dash_split_each
+
+    def iter_sizes(self, n):
+        """
+        Yields n sizes of tokens uniformly distributed in min_size..max_size.
+        """
+        if self.min_size == self.max_size:
+            for _ in xrange(n):
+                yield self.min_size
+            return
+        span = self.max_size - self.min_size + 1
+        limit = 256 - 256 % span
+        while n > 0:
+            for b in bytearray(os.urandom(min(n * 256 // limit + 16, self.BLOCK_SIZE))):
+                if b < limit:
+                    yield self.min_size + b % span
+                    n -= 1
+                    if not n:
+                        return
+
+    @property
+    def keyspace(self):
+        """
+        Number of possible tokens (dashes do not change it).
+        """
+        return sum(len(ALPHABET) ** size for size in xrange(self.min_size, self.max_size + 1))
+
+    def collision_probability(self, existing, n=1):
+        """
+        Returns upper bound of probability that at least one of n new tokens is equal to one of existing tokens.
+        Sizes are uniformly distributed, so collisions are determined by the shortest sizes.
+        """
+        span = self.max_size - self.min_size + 1
+        p = sum(min(1., float(existing) / len(ALPHABET) ** size)
+                for size in xrange(self.min_size, self.max_size + 1)) / span
+        if p >= 1:
+            return 1.
+        return -expm1(n * log1p(-p))  # 1 - (1 - p) ** n without loss of precision for small p
+
+    def split(self, token):
+        n = self.dash_split_each
+        if not n or len(token) <= n:
+            return token
+        return '-'.join([token[i:i + n] for i in xrange(0, len(token), n)])
+
+    def is_valid(self, token):
+        """
+        Checks that token has format of tokens of this generator (length, dashes and chars) without database query.
+        """
+        n = self.dash_split_each
+        if n:
+            parts = token.split('-')
+            if not 0 < len(parts[-1]) <= n or any(len(part) != n for part in parts[:-1]):
+                return False
+            token = ''.join(parts)
+        return self.min_size <= len(token) <= self.max_size and not _INVALID_CHAR.search(token)
+
+    def iter_tokens(self, n):
+        """
+        Yields n tokens. Entropy for many tokens is read from os.urandom by large blocks.
+        """
+        buf, pos, left = '', 0, n
+        for size in self.iter_sizes(n):
+            if len(buf) - pos < size:
+                buf = buf[pos:] + random_chars(max(size, min(left * self.max_size, self.BLOCK_SIZE)))
+                pos = 0
+            yield self.split(buf[pos:pos + size])
+            pos += size
+            left -= 1
+
+    def generate_tokens(self, n):
+        return list(self.iter_tokens(n))
+
+    def __call__(self):
+        return next(self.iter_tokens(1))
+
+
+_generators = {}
+
+
+def get_token_generator(size=None, dash_split_each=None, min_size=8, max_size=65):
+    """
+    Returns cached TokenGenerator for configuration.
+    """
+    key = (tuple(size) if isinstance(size, list) else size, dash_split_each, min_size, max_size)
+    try:
+        return _generators[key]
+    except KeyError:
+        pass
+    except TypeError:  # unhashable size, constructor raises AttributeError
+        return TokenGenerator(size, dash_split_each, min_size, max_size)
+    generator = _generators[key] = TokenGenerator(size, dash_split_each, min_size, max_size)
+    return generator
+
+
+def generate_tokens(n, size=None, dash_split_each=None, min_size=8, max_size=65):
+    """
+    Returns list of n tokens (see TokenGenerator.iter_tokens for generator).
+    """
+    return get_token_generator(size, dash_split_each, min_size, max_size).generate_tokens(n)
@@ -0,0 +1,219 @@
+# coding=utf-8
+"""
+Streaming export and import of PrivateUrl rows (commands export_privateurls and import_privateurls).
+Rows are read by chunks in order of pk (without loading of model instances) and written by batches of INSERT,
+so memory doesn't depend on size of table. Values of data are copied in stored (encoded) form without encoding
+(imported values are only checked to be JSON).
+Progress is saved to checkpoint file after each chunk, command started with the same checkpoint continues
+(export file is truncated to size saved in checkpoint, so rows written after it are not duplicated).
+"""
+import csv
+import gzip
+import os
+import simplejson
+import sys
+from django.db import connections, transaction
+from django.db.models import sql
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import bloom, cache as privateurl_cache, routers
+from .models import PrivateUrl
+
+
+FIELDS = ('action', 'token', 'user_id', 'expire', 'data', 'created', 'used_limit', 'used_counter',
+          'first_used', 'last_used', 'auto_delete')
+DATETIME_FIELDS = ('expire', 'created', 'first_used', 'last_used')
+FORMATS = ('jsonl', 'csv')
+
+
+def get_format(path, file_format=None):
+    if file_format:
+        if file_format not in FORMATS:
+            raise AttributeError('Attr file_format must be one of {}.'.format(', '.join(FORMATS)))
+        return file_format
+    return 'csv' if path.endswith(('.csv', '.csv.gz')) else 'jsonl'
+
+
+def is_compressed(path, compress=None):
+    return bool(compress or (compress is None and path.endswith('.gz')))
+
+
+def open_file(path, mode, compress=None):
+    """
+    Opens file ('-' is stdin or stdout), gzip is used for *.gz or if compress is True.
+    """
+    if path == '-':
+        f = sys.stdin if mode.startswith('r') else sys.stdout
+        return gzip.GzipFile(fileobj=f, mode=mode) if compress else f
+    if is_compressed(path, compress):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def close_file(f):
+    if f not in (sys.stdin, sys.stdout):
+        f.close()  # GzipFile of stdin or stdout doesn't close it
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return simplejson.load(f)
+    return None
+
+
+def save_checkpoint(path, state):
+    with open(path + '.tmp', 'w') as f:
+        simplejson.dump(state, f)
+    os.rename(path + '.tmp', path)  # checkpoint is never half written
+
+
+def to_record(row):
+    record = dict(zip(FIELDS, row))
+    for name in DATETIME_FIELDS:
+        if record[name] is not None:
+            record[name] = record[name].isoformat()
+    return record
+
+
+def from_record(record, without_users=False):
+    """
+    Returns PrivateUrl of record, raises ValueError if data is not valid JSON.
+    """
+    values = {}
+    for name in FIELDS:
+        value = record.get(name)
+        if value == '':  # empty values of csv
+            value = None
+        if value is not None:
+            if name in DATETIME_FIELDS:
+                value = parse_datetime(value)
+            elif name in ('user_id', 'used_limit', 'used_counter'):
+                value = int(value)
+            elif name == 'auto_delete':
+                value = value in (True, 'True', 'true', '1')
+            elif name == 'data':
+                value = PrivateUrl._meta.get_field('data').validate_encoded(value)  # saved as is, without encoding
+        values[name] = value
+    if without_users:
+        values['user_id'] = None
+    if values['created'] is None:
+        values['created'] = timezone.now()
+    for name in ('used_limit', 'used_counter', 'auto_delete'):
+        if values[name] is None:
+            del values[name]
+    return PrivateUrl(**values)
+
+
+def export_chunks(actions=None, created_from=None, created_to=None, chunk_size=1000, checkpoint=None):
+    """
+    Yields (state, records) for chunks of rows in order of pk in each database.
+    state is checkpoint for continuation after the chunk.
+    :param actions: list of actions or None for all
+    :param created_from: datetime or None
+    :param created_to: datetime or None (exclusive)
+    :param checkpoint: state of the last exported chunk or None
+    """
+    if chunk_size < 1:
+        raise AttributeError('Attr chunk_size must be positive.')
+    dbs = []
+    for action in actions or (None,):
+        for db in routers.get_databases(PrivateUrl, action):
+            if db not in dbs:
+                dbs.append(db)
+    state = dict(checkpoint or {'db_index': 0, 'last_pk': None, 'rows': 0})
+    for db_index in xrange(state['db_index'], len(dbs)):
+        if db_index != state['db_index']:
+            state.update(db_index=db_index, last_pk=None)
+        qs = PrivateUrl.objects.using(dbs[db_index]).order_by('pk')
+        if actions:
+            qs = qs.filter(action__in=actions)
+        if created_from is not None:
+            qs = qs.filter(created__gte=created_from)
+        if created_to is not None:
+            qs = qs.filter(created__lt=created_to)
+        while True:
+            chunk_qs = qs if state['last_pk'] is None else qs.filter(pk__gt=state['last_pk'])
+            rows = list(chunk_qs.values_list('pk', *FIELDS)[:chunk_size])
+            if not rows:
+                break
+            state.update(last_pk=rows[-1][0], rows=state['rows'] + len(rows))
+            yield dict(state), [to_record(row[1:]) for row in rows]
+
+
+class _Row(object):
+    """
+    Values of object without descriptors of model (data stays encoded).
+    """
+    def __init__(self, obj):
+        self.__dict__ = obj.__dict__
+
+
+def insert_rows(db, objs):
+    """
+    Inserts objects by batches of raw INSERT (without pre_save of fields, so imported created is kept
+    instead of auto_now_add and model metadata isn't changed).
+    """
+    meta = PrivateUrl._meta
+    fields = [f for f in meta.local_concrete_fields if f is not meta.auto_field]
+    rows = [_Row(obj) for obj in objs]
+    batch_size = max(connections[db].ops.bulk_batch_size(fields, rows), 1)
+    for i in xrange(0, len(rows), batch_size):
+        query = sql.InsertQuery(PrivateUrl)
+        query.insert_values(fields, rows[i:i + batch_size], raw=True)
+        query.get_compiler(using=db).execute_sql()
+
+
+def import_batch(objs, skip_existing=False):
+    """
+    Saves objects by insert_rows in database of each action, returns number of saved objects.
+    :param skip_existing: don't save objects with tokens which already exist (e.g. rows imported before crash)
+    """
+    by_action = {}
+    for obj in objs:
+        by_action.setdefault(obj.action, []).append(obj)
+    count = 0
+    for action, action_objs in by_action.iteritems():
+        db = routers.db_for_write(PrivateUrl, action)
+        if skip_existing:
+            existing = set(PrivateUrl.objects.using(db).filter(
+                action=action, token__in=[obj.token for obj in action_objs]
+            ).order_by().values_list('token', flat=True))
+            action_objs = [obj for obj in action_objs if obj.token not in existing]
+            if not action_objs:
+                continue
+        with transaction.atomic(using=db):
+            insert_rows(db, action_objs)
+        tokens = [obj.token for obj in action_objs]
+        if privateurl_cache.is_enabled(action):
+            privateurl_cache.invalidate(action, tokens, using=db)
+        bloom.add(action, tokens)  # insert doesn't send post_save
+        count += len(action_objs)
+    return count
+
+
+def write_records(f, file_format, records, header=False):
+    if file_format == 'jsonl':
+        for record in records:
+            f.write(simplejson.dumps(record))
+            f.write('\n')
+        return
+    writer = csv.writer(f)
+    if header:
+        writer.writerow(FIELDS)
+    for record in records:
+        writer.writerow([
+            '' if record[name] is None else unicode(record[name]).encode('utf-8') for name in FIELDS
+        ])
+
+
+def read_records(f, file_format):
+    if file_format == 'jsonl':
+        for line in f:
+            if line.strip():
+                yield simplejson.loads(line)
+        return
+    reader = csv.reader(f)
+    fields = next(reader, None)
+    for row in reader:
+        yield dict(zip(fields, [value.decode('utf-8') for value in row]))
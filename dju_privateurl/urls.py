@@ -1,10 +1,15 @@
 from django.conf.urls import url
 from . import views
+from .models import PrivateUrl
 
 
 urlpatterns = [
     url(
-        r'^(?P<action>[-a-zA-Z0-9_]{1,32})/(?P<token>[-a-zA-Z0-9_]{1,64})$',
+        # second variant of token is signed token (see PrivateUrl.create_signed), its length is limited by lookahead
+        r'^(?P<action>[-a-zA-Z0-9_]{{1,32}})/'
+        r'(?P<token>[-a-zA-Z0-9_]{{1,64}}|(?=[-a-zA-Z0-9_:]{{1,{max_size}}}$)[-a-zA-Z0-9_]+:[-a-zA-Z0-9_]+)$'.format(
+            max_size=PrivateUrl.SIGNED_TOKEN_MAX_SIZE
+        ),
         views.privateurl_view,
         name='dju_privateurl'
     ),
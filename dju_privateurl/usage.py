@@ -0,0 +1,113 @@
+# coding=utf-8
+"""
+Write-behind usage counters for unlimited links (used_limit=0).
+Increments are collected in a process-local buffer and written in batches with F('used_counter') + n.
+Buffer is flushed when DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD increments are collected,
+by timer after DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL seconds and at process exit.
+Call flush() to force writing (e.g. before reading counters in tests or scripts).
+"""
+import atexit
+import threading
+import time
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce, Greatest
+from . import settings as pu_settings
+
+
+def is_enabled(action):
+    actions = pu_settings.DJU_PRIVATEURL_USAGE_BUFFER_ACTIONS
+    return actions == '*' or action in actions
+
+
+class UsageBuffer(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # (db, model, pk): [n, first_used, last_used]
+        self._count = 0
+        self._last_flush = time.time()
+        self._timer = None
+
+    def add(self, obj, dt):
+        key = (obj._state.db or 'default', type(obj), obj.pk)
+        with self._lock:
+            item = self._pending.get(key)
+            if item is None:
+                self._pending[key] = [1, dt, dt]
+            else:
+                item[0] += 1
+                item[2] = dt
+            self._count += 1
+            need_flush = (self._count >= pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD or
+                          time.time() - self._last_flush >= pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL)
+            if not need_flush and self._timer is None:
+                self._timer = threading.Timer(pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL, self._flush_by_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if need_flush:
+            self.flush()
+
+    def _flush_by_timer(self):
+        try:
+            self.flush()
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    def _restore(self, items):
+        with self._lock:
+            for key, (n, first_used, last_used) in items.iteritems():
+                item = self._pending.get(key)
+                if item is None:
+                    self._pending[key] = [n, first_used, last_used]
+                else:
+                    item[0] += n
+                    item[1] = min(item[1], first_used)
+                    item[2] = max(item[2], last_used)
+                self._count += n
+
+    def flush(self):
+        """
+        Writes collected increments and returns their count.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            count, self._count = self._count, 0
+            self._last_flush = time.time()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        by_db = {}
+        for (db, model, pk), item in pending.iteritems():
+            by_db.setdefault(db, {})[(db, model, pk)] = item
+        while by_db:
+            db, items = by_db.popitem()
+            try:
+                with transaction.atomic(using=db):
+                    for (_, model, pk), (n, first_used, last_used) in items.iteritems():
+                        last_used = models.Value(last_used, output_field=models.DateTimeField())
+                        model._default_manager.using(db).filter(pk=pk).update(
+                            used_counter=models.F('used_counter') + n,
+                            # flushes of processes come in any order, last_used is not moved back;
+                            # Coalesce: GREATEST of sqlite and mysql is NULL if any argument is NULL
+                            last_used=Greatest(Coalesce('last_used', last_used), last_used),
+                            first_used=Coalesce('first_used',
+                                                models.Value(first_used, output_field=models.DateTimeField())),
+                        )
+            except Exception:
+                for rest in by_db.itervalues():
+                    items.update(rest)
+                self._restore(items)
+                raise
+        return count
+
+
+usage_buffer = UsageBuffer()
+
+
+def flush():
+    return usage_buffer.flush()
+
+
+atexit.register(flush)
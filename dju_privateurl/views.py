@@ -1,21 +1,48 @@
+import time
 from django.http.response import Http404, HttpResponseRedirect
+from . import bloom, settings as pu_settings, throttling
+from .metrics import get_metrics, get_fail_reason
 from .models import PrivateUrl
 from .signals import privateurl_ok, privateurl_fail
 
 
 def privateurl_view(request, action, token):
-    obj = PrivateUrl.objects.get_or_none(action, token)
-    ok = False
-    if not obj or not obj.is_available():
-        results = privateurl_fail.send(PrivateUrl, request=request, obj=obj, action=action)
+    metrics = get_metrics()
+    response = throttling.check(request, action)
+    if response is not None:
+        if metrics is not None:
+            metrics.incr('throttled', action)
+        return response
+    if metrics is not None:
+        start = t = time.time()
+    if PrivateUrl.is_valid_token(action, token) and (
+        PrivateUrl.SIGNED_TOKEN_SEPARATOR in token or bloom.may_contain(action, token)
+    ):
+        obj = PrivateUrl.objects.get_or_none(action, token, fast=pu_settings.DJU_PRIVATEURL_FAST_LOOKUP)
     else:
-        results = privateurl_ok.send(PrivateUrl, request=request, obj=obj, action=action)
-        obj.used_counter_inc()
-        ok = True
-    for receiver, result in results:
-        if isinstance(result, dict):
-            if 'response' in result:
-                return result['response']
+        obj = None
+    if metrics is not None:
+        t = metrics.timing('lookup', action, t)
+    ok = obj is not None and obj.redeem()
+    if metrics is not None:
+        t = metrics.timing('redeem', action, t)
+        if ok:
+            metrics.incr('ok', action)
+        else:
+            metrics.incr('fail', action)
+            metrics.incr(get_fail_reason(obj), action)
+    signal = privateurl_ok if ok else privateurl_fail
+    response = signal.dispatch(PrivateUrl, request=request, obj=obj, action=action)
+    if metrics is not None:
+        t = metrics.timing('receivers', action, t)
+    if ok and obj.auto_delete and not obj.is_available():
+        obj.discard()
+        if metrics is not None:
+            metrics.timing('delete', action, t)
+    if metrics is not None:
+        metrics.timing('total', action, start)
+    if response is not None:
+        return response
     if not ok:
         raise Http404
     return HttpResponseRedirect('/')
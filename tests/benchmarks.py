@@ -0,0 +1,501 @@
+# coding=utf-8
+"""
+Benchmarks for dju_privateurl. Run: python tools.py bench [name ...] [--rows N] [--json FILE] [--compare FILE]
+--rows fills table with N background rows before benchmarks (e.g. 10000 or 1000000).
+--json saves results to FILE ('-' for stdout), --compare prints difference with results saved earlier
+and exits with status 1 if some timing is slower than baseline by more than --tolerance.
+Set DJU_TEST_DB_ENGINE=postgresql (see tests/settings.py) to run on postgresql.
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import simplejson
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from cStringIO import StringIO
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.http import HttpResponse
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.encoding import force_bytes
+from dju_privateurl import bloom, settings as pu_settings
+from dju_privateurl.metrics import get_metrics
+from dju_privateurl.models import PrivateUrl
+from dju_privateurl.signals import privateurl_ok
+from dju_privateurl.tokens import get_token_generator
+from .utils import explain, get_query_shapes
+
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__[len('bench_'):]] = func
+    return func
+
+
+def timed(func, *args, **kwargs):
+    t = time.time()
+    func(*args, **kwargs)
+    return time.time() - t
+
+
+FILL_ACTION = 'bench-fill'
+
+
+def clear():
+    PrivateUrl.objects.exclude(action=FILL_ACTION).delete()
+
+
+def fill(rows, batch_size=1000):
+    """
+    Fills table with background rows (a third of them expired) which are kept between benchmarks.
+    """
+    PrivateUrl.bulk_create_tokens(FILL_ACTION, (
+        {'expire': datetime.timedelta(days=-1) if i % 3 == 0 else None, 'data': {'i': i}} for i in xrange(rows)
+    ), batch_size=batch_size)
+
+
+@benchmark
+def bench_bulk_create_tokens(n=5000):
+    results = OrderedDict()
+    results['create() x {}'.format(n)] = timed(lambda: [PrivateUrl.create('bench') for _ in xrange(n)])
+    clear()
+    for batch_size in (100, 500, 1000):
+        results['bulk_create_tokens({}, batch_size={})'.format(n, batch_size)] = timed(
+            PrivateUrl.bulk_create_tokens, 'bench', n, batch_size=batch_size
+        )
+        clear()
+    return results
+
+
+@benchmark
+def bench_explain(n=10000, actions=10, users=100):
+    user_model = get_user_model()
+    user_model.objects.bulk_create(user_model(username='bench{}'.format(i)) for i in xrange(users))
+    users = list(user_model.objects.all())
+    for i in xrange(actions):
+        PrivateUrl.bulk_create_tokens('bench' if i == 0 else 'bench{}'.format(i), (
+            {'user': users[j % len(users)], 'expire': datetime.timedelta(days=j % 10 - 5) if j % 3 else None}
+            for j in xrange(n // actions)
+        ))
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(PrivateUrl._meta.db_table)))
+        elif connection.vendor == 'sqlite':
+            cursor.execute('ANALYZE')
+    results = OrderedDict((label, explain(qs)) for label, qs in get_query_shapes(user_id=users[0].pk).items())
+    clear()
+    user_model.objects.all().delete()
+    return results
+
+
+@benchmark
+def bench_signed_lookup(n=5000):
+    results = OrderedDict()
+    t = PrivateUrl.create('bench', used_limit=0, data={'report': 1})
+    results['get_or_none() x {} (database)'.format(n)] = timed(
+        lambda: [PrivateUrl.objects.get_or_none('bench', t.token) for _ in xrange(n)]
+    )
+    t = PrivateUrl.create_signed('bench', expire=datetime.timedelta(days=1), data={'report': 1})
+    results['get_or_none() x {} (signed)'.format(n)] = timed(
+        lambda: [PrivateUrl.objects.get_or_none('bench', t.token) for _ in xrange(n)]
+    )
+    clear()
+    return results
+
+
+def row_size(qs):
+    """
+    Returns size in bytes of values of first row of queryset (as returned by database driver).
+    """
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return sum(len(force_bytes(value)) for value in row if value is not None)
+
+
+@benchmark
+def bench_fast_lookup(n=5000, users=1000):
+    user_model = get_user_model()
+    user_model.objects.bulk_create(user_model(
+        username='bench-user-{}'.format(i), first_name=get_random_string(12), last_name=get_random_string(16),
+        email='bench-user-{}@{}.example.com'.format(i, get_random_string(10)),
+        password=make_password(None), date_joined=timezone.now(), last_login=timezone.now(),
+    ) for i in xrange(users))
+    users = list(user_model.objects.all())
+    items = [{'user': users[i % len(users)], 'data': {'report': i, 'format': 'pdf'}} for i in xrange(n)]
+    tokens = [obj.token for obj in PrivateUrl.bulk_create_tokens('bench', items, used_limit=0)]
+    results = OrderedDict()
+    for fast in (False, True):
+        label = 'fast' if fast else 'select_related(user)'
+        results['get_or_none() x {} ({})'.format(n, label)] = timed(
+            lambda: [PrivateUrl.objects.get_or_none('bench', token, fast=fast) for token in tokens]
+        )
+        if fast:
+            qs = PrivateUrl.objects.only(*PrivateUrl.FAST_LOOKUP_FIELDS)
+        else:
+            qs = PrivateUrl.objects.select_related('user')
+        results['row size ({})'.format(label)] = '{} bytes'.format(row_size(qs.filter(action='bench',
+                                                                                      token=tokens[0])))
+    clear()
+    user_model.objects.all().delete()
+    return results
+
+
+@benchmark
+def bench_create(n=2000):
+    results = OrderedDict()
+    results['create() x {}'.format(n)] = timed(lambda: [PrivateUrl.create('bench') for _ in xrange(n)])
+    results['create(data, expire) x {}'.format(n)] = timed(lambda: [
+        PrivateUrl.create('bench', expire=datetime.timedelta(days=1), data={'report': i, 'format': 'pdf'})
+        for i in xrange(n)
+    ])
+    clear()
+    return results
+
+
+@benchmark
+def bench_lookup(n=5000):
+    tokens = [obj.token for obj in PrivateUrl.bulk_create_tokens('bench', n, used_limit=0)]
+    random.shuffle(tokens)
+    results = OrderedDict()
+    results['get_or_none() x {} (hit)'.format(n)] = timed(
+        lambda: [PrivateUrl.objects.get_or_none('bench', token) for token in tokens]
+    )
+    results['get_or_none(fast=True) x {} (hit)'.format(n)] = timed(
+        lambda: [PrivateUrl.objects.get_or_none('bench', token, fast=True) for token in tokens]
+    )
+    results['get_or_none() x {} (miss)'.format(n)] = timed(
+        lambda: [PrivateUrl.objects.get_or_none('bench', token[::-1]) for token in tokens]
+    )
+    clear()
+    return results
+
+
+@benchmark
+def bench_view(n=1000):
+    client = Client()
+    results = OrderedDict()
+    urls = [obj.get_absolute_url() for obj in PrivateUrl.bulk_create_tokens('bench', n)]
+    results['view x {} (ok)'.format(n)] = timed(lambda: [client.get(url) for url in urls])
+    results['view x {} (exhausted)'.format(n)] = timed(lambda: [client.get(url) for url in urls])
+    results['view x {} (not found)'.format(n)] = timed(lambda: [client.get(url + 'x') for url in urls])
+    urls = [obj.get_absolute_url() for obj in PrivateUrl.bulk_create_tokens('bench', n, auto_delete=True)]
+    results['view x {} (ok, auto_delete)'.format(n)] = timed(lambda: [client.get(url) for url in urls])
+    url = PrivateUrl.create('bench', used_limit=0).get_absolute_url()
+    results['view x {} (unlimited)'.format(n)] = timed(lambda: [client.get(url) for _ in xrange(n)])
+    metrics_bak = pu_settings.DJU_PRIVATEURL_METRICS
+    pu_settings.DJU_PRIVATEURL_METRICS = 'dju_privateurl.metrics.InMemoryMetrics'
+    try:
+        results['view x {} (unlimited, metrics)'.format(n)] = timed(lambda: [client.get(url) for _ in xrange(n)])
+        get_metrics().reset()
+    finally:
+        pu_settings.DJU_PRIVATEURL_METRICS = metrics_bak
+    clear()
+    return results
+
+
+def make_receiver(action):
+    def _receiver(request, obj, action, **kwargs):
+        if action == receiver_action:
+            return {'response': HttpResponse(action)}
+    receiver_action = action
+    return _receiver
+
+
+def make_handler(action):
+    return lambda request, obj, action: HttpResponse(action)
+
+
+@benchmark
+def bench_dispatch(n=5000, actions=40):
+    """
+    Dispatch of privateurl_ok to receivers which check action themselves and to handlers registered per action.
+    """
+    results = OrderedDict()
+    names = ['bench-{}'.format(i) for i in xrange(actions)]
+    obj = PrivateUrl(action=names[-1], token='x')
+    funcs = [make_receiver(name) for name in names]
+    for func in funcs:
+        privateurl_ok.connect(func, weak=False)
+    try:
+        results['send() x {} to {} receivers'.format(n, actions)] = timed(
+            lambda: [privateurl_ok.send(PrivateUrl, request=None, obj=obj, action=obj.action) for _ in xrange(n)]
+        )
+        results['dispatch() x {} to {} receivers'.format(n, actions)] = timed(
+            lambda: [privateurl_ok.dispatch(PrivateUrl, request=None, obj=obj, action=obj.action) for _ in xrange(n)]
+        )
+    finally:
+        for func in funcs:
+            privateurl_ok.disconnect(func)
+    for name in names:
+        privateurl_ok.connect_action(name, make_handler(name))
+    try:
+        results['dispatch() x {} to {} action handlers'.format(n, actions)] = timed(
+            lambda: [privateurl_ok.dispatch(PrivateUrl, request=None, obj=obj, action=obj.action) for _ in xrange(n)]
+        )
+        client = Client()
+        url = PrivateUrl.create(names[-1], used_limit=0).get_absolute_url()
+        results['view x {} (unlimited, {} action handlers)'.format(n // 5, actions)] = timed(
+            lambda: [client.get(url) for _ in xrange(n // 5)]
+        )
+    finally:
+        for name in names:
+            privateurl_ok.disconnect_action(name)
+    clear()
+    return results
+
+
+@benchmark
+def bench_bloom(n=1000):
+    """
+    View of unknown tokens with and without bloom filter.
+    """
+    results = OrderedDict()
+    PrivateUrl.bulk_create_tokens('bench', n)
+    client = Client()
+    urls = [obj.get_absolute_url() + 'x' for obj in PrivateUrl.bulk_create_tokens('bench', n)]
+    results['view x {} (not found)'.format(n)] = timed(lambda: [client.get(url) for url in urls])
+    actions_bak = pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS
+    pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS = ('bench',)
+    try:
+        results['build filter of {} tokens'.format(n * 2)] = timed(bloom.build, PrivateUrl, 'bench')
+        results['view x {} (not found, bloom)'.format(n)] = timed(lambda: [client.get(url) for url in urls])
+        results['may_contain() x {}'.format(n * 10)] = timed(
+            lambda: [bloom.may_contain('bench', 'unknown') for _ in xrange(n * 10)]
+        )
+    finally:
+        pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS = actions_bak
+        bloom.get_cache().clear()
+        bloom.reset()
+    clear()
+    return results
+
+
+@benchmark
+def bench_concurrent_redeem(n=200, threads_count=8, used_limit=3):
+    """
+    Each thread tries to redeem every link used_limit times, redemptions over the limit are reported.
+    """
+    objs = PrivateUrl.bulk_create_tokens('bench', n, used_limit=used_limit)
+    pks = list(PrivateUrl.objects.filter(action='bench').values_list('pk', flat=True))
+    used, retries = [], []
+
+    def worker():
+        try:
+            for pk in pks:
+                obj = PrivateUrl.objects.get(pk=pk)
+                for i in xrange(used_limit):
+                    while True:
+                        try:
+                            if obj.redeem():
+                                used.append(1)
+                            break
+                        except OperationalError:  # sqlite: database is locked
+                            retries.append(1)
+                            time.sleep(0.001)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in xrange(threads_count)]
+    t = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results = OrderedDict()
+    results['redeem() x {} in {} threads'.format(n * used_limit * threads_count, threads_count)] = time.time() - t
+    results['redemptions over limit'] = len(used) - len(objs) * used_limit
+    results['retries (database is locked)'] = len(retries)
+    clear()
+    return results
+
+
+@benchmark
+def bench_purge(n=5000):
+    PrivateUrl.bulk_create_tokens('bench', (
+        {'expire': datetime.timedelta(days=-1) if i % 2 else None} for i in xrange(n)
+    ))
+    results = OrderedDict()
+    results['purge(dry_run=True) of {}'.format(n // 2)] = timed(PrivateUrl.objects.purge, action='bench',
+                                                                 dry_run=True)
+    results['purge() of {}'.format(n // 2)] = timed(PrivateUrl.objects.purge, action='bench')
+    clear()
+    return results
+
+
+@benchmark
+def bench_transfer(n=10000):
+    results = OrderedDict()
+    PrivateUrl.bulk_create_tokens('bench', ({'data': {'i': i, 'price': Decimal('1.5')}} for i in xrange(n)))
+    path = tempfile.mkdtemp()
+    try:
+        for name in ('urls.jsonl', 'urls.csv', 'urls.jsonl.gz'):
+            file_path = os.path.join(path, name)
+            results['export of {} ({})'.format(n, name)] = timed(
+                call_command, 'export_privateurls', file_path, '--action=bench', stdout=StringIO()
+            )
+            results['{} size'.format(name)] = '{} bytes'.format(os.path.getsize(file_path))
+            clear()
+            results['import of {} ({})'.format(n, name)] = timed(
+                call_command, 'import_privateurls', file_path, stdout=StringIO()
+            )
+    finally:
+        shutil.rmtree(path)
+    clear()
+    return results
+
+
+def get_payloads():
+    now = timezone.now()
+    return OrderedDict((
+        ('small', {'report': 1, 'format': 'pdf'}),
+        ('typical', {'email': 'user@example.com', 'amount': Decimal('10.50'), 'currency': 'USD',
+                     'ids': range(10), 'sent': now}),
+        ('large', {'items': [{'id': i, 'name': 'item {}'.format(i), 'price': Decimal('{}.99'.format(i)),
+                              'added': now} for i in xrange(200)]}),
+    ))
+
+
+@benchmark
+def bench_payload(n=2000):
+    field = PrivateUrl._meta.get_field('data')
+    data_format_bak = pu_settings.DJU_PRIVATEURL_DATA_FORMAT
+    results = OrderedDict()
+    try:
+        for label, payload in get_payloads().items():
+            for data_format in ('json', 'compact'):
+                pu_settings.DJU_PRIVATEURL_DATA_FORMAT = data_format
+                encoded = field.encode(payload)
+                key = '{} ({})'.format(label, data_format)
+                results['{} size'.format(key)] = '{} bytes'.format(len(encoded))
+                results['{} encode x {}'.format(key, n)] = timed(lambda: [field.encode(payload) for _ in xrange(n)])
+                results['{} decode x {}'.format(key, n)] = timed(lambda: [field.decode(encoded) for _ in xrange(n)])
+                t = PrivateUrl.create('bench', data=payload, used_limit=0)
+                results['{} get_or_none() x {}'.format(key, n)] = timed(
+                    lambda: [PrivateUrl.objects.get_or_none('bench', t.token) for _ in xrange(n)]
+                )
+                results['{} get_or_none().data x {}'.format(key, n)] = timed(
+                    lambda: [PrivateUrl.objects.get_or_none('bench', t.token).data for _ in xrange(n)]
+                )
+    finally:
+        pu_settings.DJU_PRIVATEURL_DATA_FORMAT = data_format_bak
+    clear()
+    return results
+
+
+def legacy_generate_token(size, dash_split_each):
+    """
+    generate_token of version 0.0.9 (reseeds random on each call, splices dashes in loop)
+    """
+    if isinstance(size, tuple):
+        random.seed(get_random_string(length=100))
+        size = random.randint(*size)
+    token = get_random_string(length=size)
+    if dash_split_each > 0:
+        n = dash_split_each
+        while n < len(token):
+            token = token[:n] + '-' + token[n:]
+            n += dash_split_each + 1
+    return token
+
+
+@benchmark
+def bench_generate_token(n=2000):
+    results = OrderedDict()
+    for dash_split_each in (0, 4, 8, 12):
+        for size in (8, 16, 32, 48, 65, (8, 48), (36, 60)):
+            try:
+                generator = get_token_generator(size, dash_split_each)
+            except AttributeError:
+                continue  # incompatible size and dash_split_each
+            label = 'size={}, dash_split_each={}'.format(size, dash_split_each)
+            results[label + ' legacy'] = timed(lambda: [legacy_generate_token(size, dash_split_each)
+                                                        for _ in xrange(n)])
+            results[label] = timed(lambda: [generator() for _ in xrange(n)])
+            results[label + ' generate_tokens'] = timed(generator.generate_tokens, n)
+    return results
+
+
+def compare(results, baseline, tolerance, out=sys.stdout):
+    """
+    Prints timings of results and baseline, returns number of timings slower than baseline by more than tolerance.
+    """
+    regressions = 0
+    out.write('compare with baseline (database: {}, rows: {}):\n'.format(baseline['database'],
+                                                                              baseline['rows']))
+    for name, items in results['results'].items():
+        for label, value in items.items():
+            old = baseline['results'].get(name, {}).get(label)
+            if not isinstance(value, float) or not isinstance(old, float) or not old:
+                continue
+            ratio = value / old
+            mark = ''
+            if ratio > 1 + tolerance:
+                regressions += 1
+                mark = ' SLOWER'
+            elif ratio < 1 - tolerance:
+                mark = ' faster'
+            out.write('  {:<60} {:>10.4f}s {:>10.4f}s {:>+7.1%}{}\n'.format(
+                '{}: {}'.format(name, label), old, value, ratio - 1, mark
+            ))
+    return regressions
+
+
+def run(*argv):
+    parser = argparse.ArgumentParser(prog='tools.py bench')
+    parser.add_argument('names', nargs='*', help='Benchmarks to run (all by default).')
+    parser.add_argument('--rows', type=int, default=0, help='Number of background rows in table.')
+    parser.add_argument('--json', dest='json_file', default=None, help="Save results to file ('-' for stdout).")
+    parser.add_argument('--compare', dest='baseline', default=None, help='Compare with results saved by --json.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against baseline.')
+    options = parser.parse_args(argv)
+    names = options.names or BENCHMARKS.keys()
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit('Unknown benchmarks: {}. Available: {}'.format(', '.join(unknown), ', '.join(BENCHMARKS)))
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = simplejson.load(f)
+    out = sys.stderr if options.json_file == '-' else sys.stdout
+    runner = DiscoverRunner(verbosity=0)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        results = OrderedDict((('database', connection.vendor), ('rows', options.rows), ('results', OrderedDict())))
+        out.write('database: {}, rows: {}\n'.format(connection.vendor, options.rows))
+        if options.rows:
+            out.write('fill: {:.2f}s\n'.format(timed(fill, options.rows)))
+        for name in names:
+            out.write('{}:\n'.format(name))
+            items = results['results'][name] = BENCHMARKS[name]()
+            for label, value in items.items():
+                if isinstance(value, float):
+                    out.write('  {:<50} {:>10.4f}s\n'.format(label, value))
+                else:
+                    out.write('  {:<50} {}\n'.format(label, value))
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+    if options.json_file == '-':
+        simplejson.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif options.json_file:
+        with open(options.json_file, 'w') as f:
+            simplejson.dump(results, f, indent=2)
+    if baseline is not None and compare(results, baseline, options.tolerance, out):
+        sys.exit(1)
@@ -39,11 +39,50 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db.sqlite3'),
+        'TEST': {
+            # file database is shared between threads (concurrency tests)
+            'NAME': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_db.sqlite3'),
+        },
         # 'ENGINE': 'django.db.backends.mysql',
         # 'NAME': 'dju',
         # 'USER': 'root',
         # 'PASSWORD': '',
+    },
+    # database for actions of DJU_PRIVATEURL_ACTION_DATABASES (routing tests)
+    'shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_shard.sqlite3'),
+        'TEST': {
+            'NAME': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_db_shard.sqlite3'),
+        },
+    },
+    # replica of default database for DJU_PRIVATEURL_READ_DATABASES (replication is simulated by tests)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_replica.sqlite3'),
+        'TEST': {
+            'NAME': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_db_replica.sqlite3'),
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['dju_privateurl.routers.PrivateUrlRouter']
+
+if os.environ.get('DJU_TEST_DB_ENGINE') == 'postgresql':
+    # e.g. DJU_TEST_DB_ENGINE=postgresql DJU_TEST_DB_NAME=dju python tools.py bench --rows 1000000
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'NAME': os.environ.get('DJU_TEST_DB_NAME', 'dju'),
+        'USER': os.environ.get('DJU_TEST_DB_USER', ''),
+        'PASSWORD': os.environ.get('DJU_TEST_DB_PASSWORD', ''),
+        'HOST': os.environ.get('DJU_TEST_DB_HOST', ''),
+        'PORT': os.environ.get('DJU_TEST_DB_PORT', ''),
     }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
 }
 
 LANGUAGE_CODE = 'en-us'
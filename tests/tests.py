@@ -1,12 +1,40 @@
 import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import simplejson
+from collections import Counter
+from cStringIO import StringIO
+from decimal import Decimal
+from importlib import import_module
+from unittest import skipUnless
 from django.contrib.auth import get_user_model
-from django.core.urlresolvers import reverse, NoReverseMatch
+from django.core import serializers
+from django.core.management import CommandError, call_command
+from django.core.urlresolvers import NoReverseMatch, Resolver404, resolve, reverse
+from django.db import connection, OperationalError, transaction
 from django.dispatch import receiver
 from django.http import HttpResponse
 from django.shortcuts import resolve_url
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+from dju_privateurl import (bloom, cache as privateurl_cache, settings as pu_settings, throttling, transfer,
+                            usage as privateurl_usage)
+from dju_privateurl.admin import CachedCountPaginator
+from dju_privateurl.backends import get_backend
+from dju_privateurl.backends.kv import KeyValueBackend
+from dju_privateurl.backends.orm import ORMBackend
+from dju_privateurl.fields import EncodedPayload
+from dju_privateurl.metrics import InMemoryMetrics, get_metrics
 from dju_privateurl.models import PrivateUrl
-from dju_privateurl.signals import privateurl_ok, privateurl_fail
+from dju_privateurl.signals import action_handler, privateurl_ok, privateurl_fail
+from dju_privateurl.tokens import ALPHABET, TokenSpaceExhausted, generate_tokens, get_token_generator
+from .utils import explain, get_index_name, get_query_shapes
 
 
 class TestPrivateUrl(TestCase):
@@ -40,6 +68,63 @@ class TestPrivateUrl(TestCase):
         PrivateUrl.create('test', user=user, replace=True)
         self.assertEqual(PrivateUrl.objects.filter(action='test', user=user).count(), 1)
 
+    def test_replace_stale_instance(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        a = PrivateUrl.create('test', user=user, used_limit=2)
+        PrivateUrl.create('test', user=user)  # second link without replace
+        a.redeem()
+        old = PrivateUrl.objects.get_or_none('test', a.token)
+        b = PrivateUrl.create('test', user=user, replace=True, data={'k': 'v'}, expire=datetime.timedelta(days=1),
+                              auto_delete=True)
+        self.assertEqual(list(PrivateUrl.objects.filter(action='test', user=user)), [b])
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', a.token))
+        self.assertFalse(old.redeem())
+        old.used_limit = 0
+        old.used_counter_inc()
+        old.auto_delete, old.used_limit = True, 1
+        old.used_counter_inc()  # deletes only row of old token
+        j = PrivateUrl.objects.get_or_none('test', b.token)
+        self.assertEqual((j.used_counter, j.used_limit, j.first_used, j.last_used, j.data),
+                         (0, 1, None, None, {'k': 'v'}))
+        self.assertEqual(j.expire, b.expire)
+
+    def test_bulk_create_tokens(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        objs = PrivateUrl.bulk_create_tokens('test', 25, used_limit=3, batch_size=10)
+        self.assertEqual(len(objs), 25)
+        self.assertEqual(PrivateUrl.objects.filter(action='test', used_limit=3).count(), 25)
+        self.assertEqual(len(set(o.token for o in objs)), 25)
+        d = {'k': ['v']}
+        objs = PrivateUrl.bulk_create_tokens('test2', [
+            {'user': user, 'data': d, 'expire': datetime.timedelta(days=1)},
+            {},
+        ])
+        a = PrivateUrl.objects.get(action='test2', token=objs[0].token)
+        self.assertEqual(a.user, user)
+        self.assertEqual(a.data, d)
+        self.assertIsNot(objs[0].data, d)
+        self.assertIsNotNone(a.expire)
+        b = PrivateUrl.objects.get(action='test2', token=objs[1].token)
+        self.assertIsNone(b.user)
+        self.assertIsNone(b.expire)
+        self.assertEqual(objs[0].get_absolute_url(), a.get_absolute_url())
+        with self.assertRaises(AttributeError):
+            PrivateUrl.bulk_create_tokens('test', 1, batch_size=0)
+
+    def test_bulk_create_tokens_collisions(self):
+        t = PrivateUrl.create('test')
+        tokens = [t.token, t.token, 'b' * 40, 'c' * 40]
+        generate_tokens_bak = PrivateUrl.generate_tokens
+        try:
+            PrivateUrl.generate_tokens = classmethod(
+                lambda cls, n, size=None, dash_split_each=None: [tokens.pop(0) for _ in xrange(n)]
+            )
+            objs = PrivateUrl.bulk_create_tokens('test', 2)
+        finally:
+            PrivateUrl.generate_tokens = generate_tokens_bak
+        self.assertEqual(sorted(o.token for o in objs), ['b' * 40, 'c' * 40])
+        self.assertEqual(PrivateUrl.objects.filter(action='test').count(), 3)
+
     def test_token_size(self):
         t = PrivateUrl.create('test', token_size=50, dash_split_each=0)
         self.assertEqual(len(t.token), 50)
@@ -55,6 +140,81 @@ class TestPrivateUrl(TestCase):
         self.assertRaises(AttributeError, PrivateUrl.create, 'test', token_size=(-2, -1))
         self.assertRaises(AttributeError, PrivateUrl.create, 'test', token_size=(36, 36))
 
+    def test_generate_token_dashes(self):
+        for dash_split_each in (0, 4, 5, 12):
+            for size in (8, 12, 13, 24, 25, 40):
+                token = PrivateUrl.generate_token(size=size, dash_split_each=dash_split_each)
+                parts = token.split('-')
+                self.assertEqual(len(''.join(parts)), size)
+                self.assertLessEqual(len(token), PrivateUrl.TOKEN_MAX_SIZE)
+                if dash_split_each:
+                    self.assertTrue(all(len(part) == dash_split_each for part in parts[:-1]))
+                    self.assertTrue(0 < len(parts[-1]) <= dash_split_each)
+                else:
+                    self.assertEqual(len(parts), 1)
+        self.assertIs(get_token_generator((36, 60), 12), get_token_generator([36, 60], 12))
+        self.assertIsNot(get_token_generator(36, 12), get_token_generator(36, 12, min_size=1))
+        self.assertRaises(AttributeError, get_token_generator, {})
+
+    def test_generate_tokens(self):
+        tokens = PrivateUrl.generate_tokens(100, size=(8, 20), dash_split_each=4)
+        self.assertEqual(len(tokens), 100)
+        for token in tokens:
+            self.assertTrue(8 <= len(token.replace('-', '')) <= 20)
+            self.assertTrue(all(len(part) == 4 for part in token.split('-')[:-1]))
+        self.assertEqual(PrivateUrl.generate_tokens(0), [])
+        self.assertEqual(len(list(get_token_generator(10, 0).iter_tokens(5))), 5)
+        self.assertRaises(AttributeError, PrivateUrl.generate_tokens, 10, size=(10, 5))
+
+    def test_token_space(self):
+        generator = get_token_generator(8, 0)
+        self.assertEqual(generator.keyspace, 62 ** 8)
+        self.assertEqual(get_token_generator((8, 9), 0).keyspace, 62 ** 8 + 62 ** 9)
+        self.assertEqual(generator.collision_probability(0), 0)
+        self.assertAlmostEqual(generator.collision_probability(62 ** 8 // 2), 0.5)
+        self.assertAlmostEqual(generator.collision_probability(62 ** 8 // 2, n=2), 0.75)
+        self.assertEqual(generator.collision_probability(62 ** 9), 1)
+        self.assertAlmostEqual(get_token_generator((8, 9), 0).collision_probability(62 ** 8), 0.5 + 0.5 / 62)
+        PrivateUrl.create('test', token_size=8)
+        self.assertAlmostEqual(PrivateUrl.token_collision_probability('test', token_size=8), 62 ** -8)
+
+    def test_create_collisions(self):
+        t = PrivateUrl.create('test')
+        generate_token_bak, generate_tokens_bak = PrivateUrl.generate_token, PrivateUrl.generate_tokens
+        max_collision_probability_bak = pu_settings.DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY
+        try:
+            PrivateUrl.generate_token = classmethod(lambda cls, size=None, dash_split_each=None: t.token)
+            PrivateUrl.generate_tokens = classmethod(
+                lambda cls, n, size=None, dash_split_each=None: [t.token] * (n - 1) + ['b' * 40]
+            )
+            with CaptureQueriesContext(connection) as queries:
+                j = PrivateUrl.create('test')
+            self.assertEqual(j.token, 'b' * 40)
+            # insert, check of candidates, insert (token space is not counted after one failed round)
+            self.assertEqual([q['sql'].split()[0] for q in queries if q['sql'].startswith(('INSERT', 'SELECT'))],
+                             ['INSERT', 'SELECT', 'INSERT'])
+            PrivateUrl.generate_tokens = classmethod(lambda cls, n, size=None, dash_split_each=None: [t.token] * n)
+            self.assertRaises(RuntimeError, PrivateUrl.create, 'test')
+            pu_settings.DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY = 0
+            with CaptureQueriesContext(connection) as queries:
+                self.assertRaises(TokenSpaceExhausted, PrivateUrl.create, 'test')
+            self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT')]), 1)  # fails fast
+        finally:
+            PrivateUrl.generate_token, PrivateUrl.generate_tokens = generate_token_bak, generate_tokens_bak
+            pu_settings.DJU_PRIVATEURL_MAX_COLLISION_PROBABILITY = max_collision_probability_bak
+
+    def test_generate_tokens_uniformity(self):
+        def chi2(counter, values, total):
+            expected = float(total) / len(values)
+            return sum((counter.get(v, 0) - expected) ** 2 / expected for v in values)
+
+        tokens = generate_tokens(1000, size=60, dash_split_each=0)
+        chars = Counter(''.join(tokens))
+        self.assertEqual(set(chars), set(ALPHABET))
+        self.assertLess(chi2(chars, ALPHABET, 60000), 125)  # 61 degrees of freedom, p < 1e-6
+        sizes = Counter(len(token) for token in generate_tokens(20000, size=(8, 16), dash_split_each=0))
+        self.assertLess(chi2(sizes, range(8, 17), 20000), 46)  # 8 degrees of freedom, p < 1e-6
+
     def test_data(self):
         d = {'k': ['v']}
         t = PrivateUrl.create('test', data=d)
@@ -69,6 +229,27 @@ class TestPrivateUrl(TestCase):
         n = PrivateUrl.objects.get_or_none('none', 'none')
         self.assertIsNone(n)
 
+    def test_manager_get_or_none_fast(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        t = PrivateUrl.create('test', user=user, data={'k': 'v'}, used_limit=2, auto_delete=True)
+        with self.assertNumQueries(1):
+            j = PrivateUrl.objects.get_or_none(t.action, t.token)
+            self.assertEqual(j.user, user)
+        with self.assertNumQueries(1):
+            j = PrivateUrl.objects.get_or_none(t.action, t.token, fast=True)
+            self.assertEqual(j.user_id, user.pk)
+            self.assertTrue(j.is_available())
+        self.assertEqual(j.get_deferred_fields(), {'data', 'created'})
+        with self.assertNumQueries(1):
+            self.assertEqual(j.user, user)
+        self.assertTrue(j.redeem())
+        self.assertEqual(j.data, {'k': 'v'})
+        j = PrivateUrl.objects.get_or_none(t.action, t.token, fast=True)
+        self.assertEqual(j.used_counter, 1)
+        j.used_counter_inc()
+        self.assertFalse(PrivateUrl.objects.filter(pk=t.pk).exists())
+        self.assertIsNone(PrivateUrl.objects.get_or_none(t.action, t.token, fast=True))
+
     def test_get_absolute_url(self):
         t = PrivateUrl.create('test')
         url = reverse('dju_privateurl', kwargs={'action': t.action, 'token': t.token})
@@ -101,6 +282,71 @@ class TestPrivateUrl(TestCase):
         j.used_counter_inc()
         self.assertIsNone(j.pk)
 
+    def test_redeem(self):
+        t = PrivateUrl.create('test', used_limit=2)
+        self.assertTrue(t.redeem())
+        self.assertEqual(t.used_counter, 1)
+        self.assertIsNotNone(t.first_used)
+        self.assertEqual(t.first_used, t.last_used)
+        first_used = t.first_used
+        self.assertTrue(t.redeem())
+        self.assertEqual(t.used_counter, 2)
+        self.assertEqual(t.first_used, first_used)
+        self.assertFalse(t.redeem())
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 2)
+        t = PrivateUrl.create('test', used_limit=0, expire=datetime.timedelta(days=1))
+        for i in xrange(3):
+            self.assertTrue(t.redeem())
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 3)
+        self.assertFalse(t.redeem(dt=t.expire))
+        self.assertEqual(t.used_counter, 3)
+
+    def test_create_signed(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        d = {'k': ['v'], 'n': Decimal('1.10')}
+        t = PrivateUrl.create_signed('test', user=user, expire=datetime.timedelta(days=1), data=d)
+        self.assertIsNone(t.pk)
+        self.assertTrue(t.signed)
+        self.assertLessEqual(len(t.token), PrivateUrl.SIGNED_TOKEN_MAX_SIZE)
+        self.assertIsNot(t.data, d)
+        with self.assertNumQueries(0):
+            j = PrivateUrl.objects.get_or_none('test', t.token)
+        self.assertTrue(j.signed)
+        self.assertEqual(j.user_id, user.pk)
+        self.assertEqual(j.data, d)
+        self.assertEqual(j.expire, t.expire)
+        self.assertEqual(j.expire.microsecond, 0)
+        self.assertEqual(j.used_limit, 0)
+        self.assertTrue(j.redeem())
+        self.assertTrue(j.redeem())
+        self.assertFalse(j.redeem(dt=j.expire))
+        self.assertEqual(PrivateUrl.objects.count(), 0)
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test2', t.token))
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', 'x' + t.token))
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', t.token[:-1]))
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', 'eA:' + t.token.split(':')[1]))
+        t = PrivateUrl.create_signed('test')
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', t.token).expire)
+        self.assertEqual(t.get_absolute_url(), reverse('dju_privateurl', kwargs={'action': 'test', 'token': t.token}))
+        with self.assertRaises(AttributeError):
+            PrivateUrl.create_signed('test', data={'k': 'v' * PrivateUrl.SIGNED_TOKEN_MAX_SIZE})
+
+    def test_signed_token_url(self):
+        size = PrivateUrl.SIGNED_TOKEN_MAX_SIZE
+        for n in xrange(size, 0, -4):  # the longest signed token which fits
+            try:
+                t = PrivateUrl.create_signed('test', data={'k': 'v' * n})
+                break
+            except AttributeError:
+                pass
+        self.assertGreater(len(t.token.split(':')[0]), 448)
+        self.assertEqual(resolve(t.get_absolute_url()).kwargs['token'], t.token)
+        for token in ('a' * (size - 28) + ':' + 'b' * 27, 'a' * 64):
+            self.assertEqual(resolve('/test/' + token).kwargs['token'], token)
+        for token in ('a' * (size - 27) + ':' + 'b' * 27, 'a' * 65, 'a:b:c', ':b'):
+            with self.assertRaises(Resolver404):
+                resolve('/test/' + token)
+
     def test_long_action_name_fail(self):
         action = 'a' * 32
         a = PrivateUrl.create(action)
@@ -115,6 +361,856 @@ class TestPrivateUrl(TestCase):
         except NoReverseMatch, e:
             raise self.failureException('Private url reverse url error ({}).'.format(e))
 
+    def test_insert_on_conflict(self):
+        for vendor, pg_version, expected in (('postgresql', 90500, True), ('postgresql', 90400, False),
+                                             ('sqlite', None, False)):
+            fake_connection = type('Connection', (object,), {'vendor': vendor, 'pg_version': pg_version})()
+            self.assertEqual(ORMBackend.supports_on_conflict(fake_connection), expected)
+        obj = PrivateUrl(action='test', token='abc')
+        sql_, params = ORMBackend.on_conflict_sql(obj, 'default')
+        qn = connection.ops.quote_name
+        self.assertTrue(sql_.startswith('INSERT INTO {} ('.format(qn('dju_privateurl'))), sql_)
+        self.assertTrue(sql_.endswith(' ON CONFLICT DO NOTHING RETURNING {}.{}'.format(
+            qn('dju_privateurl'), qn('id')
+        )), sql_)
+        self.assertEqual(sql_.count('ON CONFLICT'), 1)
+        self.assertIn('abc', params)
+
+    def test_migrations(self):
+        out = StringIO()
+        try:
+            call_command('makemigrations', 'dju_privateurl', '--check', '--dry-run', stdout=out)
+        except SystemExit:
+            raise self.failureException('Model changes are not in migrations:\n{}'.format(out.getvalue()))
+
+
+class TestPrivateUrlPayload(TestCase):
+    def setUp(self):
+        self.data_format_bak = pu_settings.DJU_PRIVATEURL_DATA_FORMAT
+        self.payload = {
+            'n': Decimal('10.50'), 's': u'\u0442\u0435\u0441\u0442', 'b': True, 'none': None, 'f': 1.5,
+            'dt': timezone.now(), 'naive': datetime.datetime(2016, 5, 1, 1, 53, 7, 12),
+            'local': timezone.localtime(timezone.now(), timezone.get_fixed_timezone(-330)),
+            'd': datetime.date(2016, 5, 1), 't': datetime.time(1, 53, 7), 'l': [1, [2, {'k': Decimal('1.1')}]],
+            '$D': '1', '$$x': {'$t': 'v'},
+        }
+
+    def tearDown(self):
+        pu_settings.DJU_PRIVATEURL_DATA_FORMAT = self.data_format_bak
+
+    def test_compact(self):
+        pu_settings.DJU_PRIVATEURL_DATA_FORMAT = 'compact'
+        field = PrivateUrl._meta.get_field('data')
+        large = {'items': [{'id': i, 'name': 'item', 'added': datetime.date(2016, 5, 1)} for i in xrange(100)]}
+        for value in (self.payload, {'k': 'v'}, [], None, large):
+            encoded = field.encode(value)
+            self.assertTrue(encoded.startswith('~'))
+            self.assertEqual(field.decode(encoded), value)
+        self.assertEqual(field.decode(field.encode((1, 2))), [1, 2])
+        self.assertTrue(field.encode(large).startswith('~1'))  # compressed
+        self.assertLess(len(field.encode(large)), len(simplejson.dumps(large, cls=field.dump_kwargs['cls'])) / 5)
+        with self.assertRaises(ValueError):
+            field.encode({'t': datetime.time(1, tzinfo=timezone.utc)})
+        t = PrivateUrl.create('test', data=self.payload)
+        j = PrivateUrl.objects.get(pk=t.pk)
+        self.assertEqual(j.data, self.payload)
+        self.assertEqual(j.data['local'].utcoffset(), datetime.timedelta(minutes=-330))
+
+    def test_lazy(self):
+        t = PrivateUrl.create('test', data={'n': Decimal('1.10')})
+        pu_settings.DJU_PRIVATEURL_DATA_FORMAT = 'compact'
+        c = PrivateUrl.create('test', data={'n': Decimal('1.10')})
+        self.assertIsInstance(PrivateUrl.objects.filter(pk=t.pk).values_list('data', flat=True)[0], EncodedPayload)
+        for obj in PrivateUrl.objects.filter(pk__in=(t.pk, c.pk)):
+            self.assertIsInstance(obj.__dict__['data'], EncodedPayload)
+            self.assertTrue(obj.redeem())
+            self.assertIsInstance(obj.__dict__['data'], EncodedPayload)
+            self.assertEqual(obj.data, {'n': Decimal('1.10')})
+            self.assertNotIsInstance(obj.__dict__['data'], EncodedPayload)
+            obj.data['k'] = 'v'
+            obj.save()
+            self.assertEqual(PrivateUrl.objects.get(pk=obj.pk).data, {'n': Decimal('1.10'), 'k': 'v'})
+
+    def test_create_isolation(self):
+        d = {'k': ['v']}
+        t = PrivateUrl.create('test', data=d)
+        d['k'].append('x')
+        self.assertEqual(t.data, {'k': ['v']})
+        objs = PrivateUrl.bulk_create_tokens('test', [{'data': d}])
+        d['k'].append('y')
+        self.assertEqual(objs[0].data, {'k': ['v', 'x']})
+
+    def test_validate_encoded(self):
+        field = PrivateUrl._meta.get_field('data')
+        self.assertIsInstance(field.validate_encoded(u'{"k": 1}'), EncodedPayload)
+        self.assertIsInstance(field.validate_encoded(u'~0{"k":{"$D":"1.10"}}'), EncodedPayload)
+        for value in (u'{"k": ', u'~0eyJrIjoxfQ==', u'~1{}', u'~2{}', u'~0{"$D":"x"}', u'~0{"$T":1}', u''):
+            with self.assertRaises(ValueError):
+                field.validate_encoded(value)
+
+
+class TestPrivateUrlPurge(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.active = PrivateUrl.create('test', expire=datetime.timedelta(days=1))
+        self.expired = PrivateUrl.create('test', expire=now - datetime.timedelta(hours=1))
+        self.expired_old = PrivateUrl.create('test2', expire=now - datetime.timedelta(days=2))
+        self.exhausted = PrivateUrl.create('test')
+        self.exhausted.redeem(dt=now - datetime.timedelta(hours=1))
+        self.unlimited = PrivateUrl.create('test', used_limit=0)
+        self.unlimited.redeem()
+
+    def assertExists(self, *objs):
+        self.assertEqual(set(PrivateUrl.objects.values_list('pk', flat=True)), set(obj.pk for obj in objs))
+
+    def test_purge(self):
+        self.assertEqual(PrivateUrl.objects.purge(dry_run=True), 3)
+        self.assertExists(self.active, self.expired, self.expired_old, self.exhausted, self.unlimited)
+        self.assertEqual(PrivateUrl.objects.purge(grace=datetime.timedelta(days=1)), 1)
+        self.assertExists(self.active, self.expired, self.exhausted, self.unlimited)
+        self.assertEqual(list(PrivateUrl.objects.purge_chunks(action='test', chunk_size=1)), [1, 1])
+        self.assertExists(self.active, self.unlimited)
+        with self.assertRaises(AttributeError):
+            PrivateUrl.objects.purge(chunk_size=0)
+
+    def test_boundaries(self):
+        now = timezone.now()
+        PrivateUrl.objects.all().delete()
+        expired = PrivateUrl.create('test', expire=now)
+        exhausted = PrivateUrl.create('test')
+        PrivateUrl.objects.filter(pk=exhausted.pk).update(used_counter=1, created=now - datetime.timedelta(days=2))
+        fresh = PrivateUrl.create('test')
+        PrivateUrl.objects.filter(pk=fresh.pk).update(used_counter=1)  # imported without usage timestamps
+        self.assertFalse(expired.is_available(dt=now))
+        self.assertEqual(set(PrivateUrl.objects.purgeable(dt=now)), set([expired, exhausted]))
+        self.assertEqual(set(PrivateUrl.objects.purgeable(grace=datetime.timedelta(days=1), dt=now)), set([exhausted]))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('purge_privateurls', '--dry-run', stdout=out)
+        self.assertIn('Found 3 rows', out.getvalue())
+        out = StringIO()
+        call_command('purge_privateurls', '--action=test', '--chunk-size=1', stdout=out)
+        self.assertIn('Deleted 2 rows', out.getvalue())
+        self.assertExists(self.active, self.expired_old, self.unlimited)
+
+
+class TestPrivateUrlStats(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        PrivateUrl.create('test', expire=datetime.timedelta(days=1))
+        PrivateUrl.create('test', expire=now - datetime.timedelta(hours=1))
+        PrivateUrl.create('test2', expire=now - datetime.timedelta(days=2))
+        PrivateUrl.create('test').redeem()
+        unlimited = PrivateUrl.create('test', used_limit=0)
+        unlimited.redeem()
+        unlimited.redeem()
+
+    def tearDown(self):
+        privateurl_cache.get_cache().clear()  # cached stats
+
+    def test_stats(self):
+        with self.assertNumQueries(1):
+            stats = PrivateUrl.objects.stats()
+        self.assertEqual(stats, [
+            {'action': 'test', 'total': 4, 'active': 2, 'expired': 1, 'exhausted': 1, 'redeemed': 2, 'used': 3,
+             'redemption_rate': 0.5},
+            {'action': 'test2', 'total': 1, 'active': 0, 'expired': 1, 'exhausted': 0, 'redeemed': 0, 'used': 0,
+             'redemption_rate': 0.0},
+        ])
+        self.assertEqual([s['action'] for s in PrivateUrl.objects.stats(action='test2')], ['test2'])
+        with self.assertRaises(AttributeError):
+            PrivateUrl.objects.stats(bucket='week')
+
+    def test_bucket(self):
+        # fixed times, rows of setUp could be created and used on both sides of midnight
+        created = datetime.datetime(2016, 5, 1, 23, 59, 59, tzinfo=timezone.utc)
+        PrivateUrl.objects.filter(action='test').update(created=created)
+        PrivateUrl.objects.filter(action='test', last_used__isnull=False).update(
+            last_used=created + datetime.timedelta(seconds=1)
+        )
+        stats = PrivateUrl.objects.stats(action='test', bucket='day')
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['total'], 4)
+        self.assertEqual(stats[0]['bucket'], created.replace(hour=0, minute=0, second=0))
+        stats = PrivateUrl.objects.stats(action='test', bucket='hour', bucket_field='last_used')
+        self.assertEqual([(s['total'], s['redeemed'], s['used']) for s in stats], [(2, 2, 3)])
+
+    def test_cache(self):
+        stats = PrivateUrl.objects.stats(cache_timeout=60)
+        PrivateUrl.create('test')
+        with self.assertNumQueries(0):
+            self.assertEqual(PrivateUrl.objects.stats(cache_timeout=60), stats)
+        self.assertEqual(PrivateUrl.objects.stats()[0]['total'], 5)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('privateurl_stats', '--action=test', stdout=out)
+        self.assertIn('50.0%', out.getvalue())
+        out = StringIO()
+        call_command('privateurl_stats', '--bucket=month', '--json', stdout=out)
+        self.assertEqual(len(simplejson.loads(out.getvalue())), 2)
+
+
+class TestPrivateUrlTransfer(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='transfer')
+        self.dir = tempfile.mkdtemp()
+        PrivateUrl.create('test', user=self.user, expire=datetime.timedelta(days=1),
+                          data={'price': Decimal('1.10'), 'name': u'\u0456\u043c\u02bc\u044f'})
+        PrivateUrl.create('test', used_limit=0, auto_delete=True).redeem()
+        PrivateUrl.create('test2', data={'k': [1, 2]})
+        obj = PrivateUrl.create('test2')
+        PrivateUrl.objects.filter(pk=obj.pk).update(created=timezone.now() - datetime.timedelta(days=10))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_rows(self):
+        return sorted(PrivateUrl.objects.values_list(*transfer.FIELDS))
+
+    def test_roundtrip(self):
+        rows = self.get_rows()
+        for name in ('urls.jsonl', 'urls.csv.gz'):
+            path = os.path.join(self.dir, name)
+            out = StringIO()
+            call_command('export_privateurls', path, '--chunk-size=3', stdout=out)
+            self.assertIn('Exported 4 rows', out.getvalue())
+            PrivateUrl.objects.all().delete()
+            out = StringIO()
+            call_command('import_privateurls', path, '--batch-size=3', stdout=out)
+            self.assertIn('Imported 4 rows', out.getvalue())
+            self.assertEqual(self.get_rows(), rows)
+        self.assertEqual(PrivateUrl.objects.get(action='test', user=self.user).data['price'], Decimal('1.10'))
+
+    def test_data_is_not_decoded(self):
+        decode = PrivateUrl._meta.get_field('data').decode
+        PrivateUrl._meta.get_field('data').decode = None
+        try:
+            chunks = list(transfer.export_chunks(actions=['test2'], chunk_size=1))
+            records = [record for state, chunk in chunks for record in chunk]
+            self.assertEqual([state for state, chunk in chunks], [
+                {'db_index': 0, 'last_pk': record_pk, 'rows': i + 1}
+                for i, record_pk in enumerate(PrivateUrl.objects.filter(action='test2').order_by('pk')
+                                              .values_list('pk', flat=True))
+            ])
+            self.assertEqual(sorted(record['data'] for record in records), ['null', '{"k":[1,2]}'])
+            PrivateUrl.objects.filter(action='test2').delete()
+            self.assertEqual(transfer.import_batch([transfer.from_record(r) for r in records]), 2)
+            with self.assertRaises(ValueError):
+                transfer.from_record(dict(records[0], data='not json'))
+        finally:
+            PrivateUrl._meta.get_field('data').decode = decode
+        self.assertEqual(sorted(obj.data for obj in PrivateUrl.objects.filter(action='test2')), [None, {'k': [1, 2]}])
+
+    def test_filters(self):
+        path = os.path.join(self.dir, 'urls.jsonl')
+        call_command('export_privateurls', path, '--action=test2', stdout=StringIO())
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        created_from = (timezone.now() - datetime.timedelta(days=1)).date().isoformat()
+        call_command('export_privateurls', path, '--format=csv', '--gzip', '--action=test2',
+                     '--created-from=' + created_from, stdout=StringIO())
+        f = gzip.open(path)
+        try:
+            self.assertEqual([r['action'] for r in transfer.read_records(f, 'csv')], ['test2'])
+        finally:
+            f.close()
+        with self.assertRaises(CommandError):
+            call_command('export_privateurls', path, '--created-to=yesterday', stdout=StringIO())
+
+    def test_checkpoint(self):
+        path = os.path.join(self.dir, 'urls.jsonl')
+        checkpoint = os.path.join(self.dir, 'checkpoint')
+        state, records = next(transfer.export_chunks(chunk_size=3))
+        with open(path, 'w') as f:
+            transfer.write_records(f, 'jsonl', records)
+            state['offset'] = f.tell()
+            f.write('{"action": "te')  # torn line of chunk which wasn't saved in checkpoint
+        transfer.save_checkpoint(checkpoint, state)
+        call_command('export_privateurls', path, '--checkpoint=' + checkpoint, stdout=StringIO())
+        self.assertFalse(os.path.exists(checkpoint))
+        with open(path) as f:
+            self.assertEqual(len(list(transfer.read_records(f, 'jsonl'))), 4)
+        with self.assertRaises(CommandError):
+            call_command('export_privateurls', path + '.gz', '--checkpoint=' + checkpoint, stdout=StringIO())
+        rows = self.get_rows()
+        PrivateUrl.objects.all().delete()
+        transfer.import_batch([transfer.from_record(r) for r in records[:2]])
+        transfer.save_checkpoint(checkpoint, {'records': 1, 'rows': 1})
+        out = StringIO()
+        call_command('import_privateurls', path, '--checkpoint=' + checkpoint, '--skip-existing', stdout=out)
+        self.assertIn('Imported 3 rows', out.getvalue())  # the first is skipped by checkpoint, the second exists
+        self.assertEqual(self.get_rows(), rows)
+        out = StringIO()
+        call_command('import_privateurls', path, '--skip-existing', '--without-users', stdout=out)
+        self.assertIn('Imported 0 rows', out.getvalue())
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'EXPLAIN format is known for sqlite and postgresql')
+class TestPrivateUrlIndexes(TestCase):
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_indexes(self):
+        shapes = get_query_shapes()
+        indexes = (
+            ('lookup (action, token)', ('action', 'token')),
+            ('replace (user, action)', ('user_id', 'action')),
+            ('admin (action) order by -created', ('action', 'created')),
+            ('cleanup (expire)', ('expire',)),
+        )
+        for label, columns in indexes:
+            name = get_index_name(*columns)
+            self.assertIsNotNone(name)
+            self.assertIn(name, explain(shapes[label]))
+        for columns in (('action',), ('token',), ('user_id',), ('auto_delete',)):
+            self.assertIsNone(get_index_name(*columns))
+
+
+class TestPrivateUrlMigrations(TransactionTestCase):
+    def test_migrate_back(self):
+        expire_index = import_module('dju_privateurl.migrations.0003_composite_indexes').EXPIRE_INDEX_NAME
+        try:
+            call_command('migrate', 'dju_privateurl', '0002', verbosity=0)
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, PrivateUrl._meta.db_table)
+            self.assertNotIn(expire_index, constraints)
+        finally:
+            call_command('migrate', 'dju_privateurl', verbosity=0)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, PrivateUrl._meta.db_table)
+        self.assertIn(expire_index, constraints)
+
+
+class TestPrivateUrlRouting(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.action_databases_bak = pu_settings.DJU_PRIVATEURL_ACTION_DATABASES
+        pu_settings.DJU_PRIVATEURL_ACTION_DATABASES = {'test-shard': 'shard'}
+
+    def tearDown(self):
+        pu_settings.DJU_PRIVATEURL_ACTION_DATABASES = self.action_databases_bak
+
+    def test_routing(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        t = PrivateUrl.create('test-shard', user=user, used_limit=2)
+        self.assertEqual(t._state.db, 'shard')
+        PrivateUrl.bulk_create_tokens('test-shard', 3)
+        PrivateUrl.create('test')
+        self.assertEqual(PrivateUrl.objects.using('shard').filter(action='test-shard').count(), 4)
+        self.assertEqual(PrivateUrl.objects.filter(action='test-shard').count(), 0)
+        self.assertEqual(PrivateUrl.objects.using('shard').filter(action='test').count(), 0)
+        with self.assertNumQueries(1, using='shard'), self.assertNumQueries(0, using='default'):
+            j = PrivateUrl.objects.get_or_none('test-shard', t.token)
+        self.assertEqual(j._state.db, 'shard')
+        with self.assertNumQueries(1, using='default'):
+            self.assertEqual(j.user, user)
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', t.token))
+        self.assertTrue(j.redeem())
+        self.assertEqual(PrivateUrl.objects.using('shard').get(pk=j.pk).used_counter, 1)
+        r = PrivateUrl.create('test-shard', user=user, replace=True)
+        self.assertEqual((r.pk, r._state.db), (t.pk, 'shard'))
+        self.assertEqual(PrivateUrl.token_collision_probability('test-shard', token_size=8), 4 * 62 ** -8)
+
+    def test_purge(self):
+        PrivateUrl.create('test-shard', expire=datetime.timedelta(days=-1))
+        PrivateUrl.create('test', expire=datetime.timedelta(days=-1))
+        self.assertEqual(PrivateUrl.objects.purge(action='test-shard'), 1)
+        self.assertEqual(PrivateUrl.objects.count(), 1)
+        PrivateUrl.create('test-shard', expire=datetime.timedelta(days=-1))
+        self.assertEqual(PrivateUrl.objects.purge(), 2)
+
+    def test_view(self):
+        t = PrivateUrl.create('test-shard', auto_delete=True)
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(PrivateUrl.objects.using('shard').exists())
+
+
+class TestPrivateUrlReplica(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.read_databases_bak = pu_settings.DJU_PRIVATEURL_READ_DATABASES
+        pu_settings.DJU_PRIVATEURL_READ_DATABASES = {'default': 'replica'}
+
+    def tearDown(self):
+        pu_settings.DJU_PRIVATEURL_READ_DATABASES = self.read_databases_bak
+
+    def replicate(self, obj):
+        PrivateUrl.objects.using('replica').filter(pk=obj.pk).delete()
+        row = PrivateUrl.objects.filter(pk=obj.pk).get()
+        row.save(force_insert=True, using='replica')
+
+    def test_lookup(self):
+        t = PrivateUrl.create('test', used_limit=2)
+        with self.assertNumQueries(1, using='replica'), self.assertNumQueries(1, using='default'):
+            j = PrivateUrl.objects.get_or_none('test', t.token)  # not replicated yet
+        self.assertEqual((j.pk, j._state.db), (t.pk, 'default'))
+        self.replicate(t)
+        for fast in (False, True):
+            with self.assertNumQueries(1, using='replica'), self.assertNumQueries(0, using='default'):
+                j = PrivateUrl.objects.get_or_none('test', t.token, fast=fast)
+            self.assertEqual((j.pk, j._state.db), (t.pk, 'default'))
+        with self.assertNumQueries(0, using='replica'):
+            self.assertTrue(j.redeem())
+            self.assertIsNone(j.data)  # deferred field is loaded from primary
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 1)
+        self.assertEqual(PrivateUrl.objects.using('replica').get(pk=t.pk).used_counter, 0)
+        with self.assertNumQueries(2, using='replica'), self.assertNumQueries(2, using='default'):
+            self.assertIsNone(PrivateUrl.objects.get_or_none('test', 'unknown'))
+            self.assertIsNone(PrivateUrl.objects.get_or_none('test2', t.token))
+
+    def test_unavailable_in_replica(self):
+        t = PrivateUrl.create('test', expire=datetime.timedelta(days=-1))
+        self.replicate(t)
+        PrivateUrl.objects.filter(pk=t.pk).update(expire=timezone.now() + datetime.timedelta(days=1))
+        with self.assertNumQueries(1, using='replica'), self.assertNumQueries(1, using='default'):
+            j = PrivateUrl.objects.get_or_none('test', t.token)
+        self.assertTrue(j.is_available())
+        self.assertEqual(self.client.get(t.get_absolute_url()).status_code, 302)
+        self.assertEqual(self.client.get(t.get_absolute_url()).status_code, 404)  # exhausted in primary
+
+    def test_used_counter_inc(self):
+        t = PrivateUrl.create('test', used_limit=0, auto_delete=True)
+        self.replicate(t)
+        j = PrivateUrl.objects.get_or_none('test', t.token)
+        with self.assertNumQueries(0, using='replica'), self.assertNumQueries(1, using='default'):
+            j.used_counter_inc()
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 1)
+        j.used_limit = 1
+        j.used_counter_inc()  # auto_delete
+        self.assertFalse(PrivateUrl.objects.filter(pk=t.pk).exists())
+        self.assertTrue(PrivateUrl.objects.using('replica').filter(pk=t.pk).exists())
+
+
+class TestPrivateUrlCache(TransactionTestCase):
+    """
+    Cache is invalidated on commit, callbacks of transaction.on_commit are not called in TestCase.
+    """
+    def setUp(self):
+        self.cache_actions_bak = pu_settings.DJU_PRIVATEURL_CACHE_ACTIONS
+        pu_settings.DJU_PRIVATEURL_CACHE_ACTIONS = ('test',)
+        privateurl_cache.get_cache().clear()
+        privateurl_cache.reset_stats()
+
+    def tearDown(self):
+        pu_settings.DJU_PRIVATEURL_CACHE_ACTIONS = self.cache_actions_bak
+        privateurl_cache.get_cache().clear()
+
+    def test_read_through(self):
+        t = PrivateUrl.create('test', used_limit=0)
+        with self.assertNumQueries(1):
+            a = PrivateUrl.objects.get_or_none('test', t.token)
+            b = PrivateUrl.objects.get_or_none('test', t.token)
+        self.assertEqual(a.pk, t.pk)
+        self.assertEqual(b.pk, t.pk)
+        self.assertEqual(privateurl_cache.get_stats(), {'hits': 1, 'misses': 1})
+        t2 = PrivateUrl.create('test2')
+        with self.assertNumQueries(2):
+            PrivateUrl.objects.get_or_none('test2', t2.token)
+            PrivateUrl.objects.get_or_none('test2', t2.token)
+
+    def test_fast(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        t = PrivateUrl.create('test', user=user, data={'k': 'v'})
+        PrivateUrl.objects.get_or_none('test', t.token, fast=True)
+        with self.assertNumQueries(1):  # full object is not taken from cache of fast lookup
+            j = PrivateUrl.objects.get_or_none('test', t.token)
+            self.assertEqual((j.user, j.data), (user, {'k': 'v'}))
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(PrivateUrl.objects.get_or_none('test', t.token, fast=True))
+        t.save()
+        with self.assertNumQueries(2):
+            PrivateUrl.objects.get_or_none('test', t.token)
+            PrivateUrl.objects.get_or_none('test', t.token, fast=True)
+
+    def test_negative(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(PrivateUrl.objects.get_or_none('test', 'none'))
+            self.assertIsNone(PrivateUrl.objects.get_or_none('test', 'none'))
+        self.assertEqual(privateurl_cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    def test_invalidate(self):
+        t = PrivateUrl.create('test', used_limit=0)
+        PrivateUrl.objects.get_or_none('test', t.token)
+        t.data = {'k': 'v'}
+        t.save()
+        self.assertEqual(PrivateUrl.objects.get_or_none('test', t.token).data, {'k': 'v'})
+        t.delete()
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', t.token))
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', 'b' * 40))
+        generate_tokens_bak = PrivateUrl.generate_tokens
+        try:
+            PrivateUrl.generate_tokens = classmethod(lambda cls, n, size=None, dash_split_each=None: ['b' * 40])
+            PrivateUrl.bulk_create_tokens('test', 1)
+        finally:
+            PrivateUrl.generate_tokens = generate_tokens_bak
+        self.assertIsNotNone(PrivateUrl.objects.get_or_none('test', 'b' * 40))
+        t = PrivateUrl.create('test', used_limit=1)
+        PrivateUrl.objects.get_or_none('test', t.token).redeem()
+        self.assertFalse(PrivateUrl.objects.get_or_none('test', t.token).is_available())
+
+    def test_invalidate_on_commit(self):
+        t = PrivateUrl.create('test', used_limit=0)
+        PrivateUrl.objects.get_or_none('test', t.token)
+        with transaction.atomic():
+            t.data = {'k': 'v'}
+            t.save()
+            # lookup of other connection here would read and cache the row which is not committed yet
+            self.assertNotEqual(PrivateUrl.objects.get_or_none('test', t.token).data, {'k': 'v'})
+        self.assertEqual(PrivateUrl.objects.get_or_none('test', t.token).data, {'k': 'v'})
+
+    def test_timeout(self):
+        now = timezone.now()
+        t = PrivateUrl(action='test', token='test')
+        self.assertEqual(privateurl_cache.get_timeout(t, dt=now), pu_settings.DJU_PRIVATEURL_CACHE_TIMEOUT)
+        t.expire = now + datetime.timedelta(seconds=10)
+        self.assertEqual(privateurl_cache.get_timeout(t, dt=now), 10)
+        t.expire = now - datetime.timedelta(seconds=10)
+        self.assertEqual(privateurl_cache.get_timeout(t, dt=now), 0)
+        self.assertEqual(privateurl_cache.get_timeout(None), pu_settings.DJU_PRIVATEURL_CACHE_NEGATIVE_TIMEOUT)
+
+
+class TestPrivateUrlUsageBuffer(TestCase):
+    def setUp(self):
+        self.settings_bak = (pu_settings.DJU_PRIVATEURL_USAGE_BUFFER_ACTIONS,
+                             pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL,
+                             pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD)
+        pu_settings.DJU_PRIVATEURL_USAGE_BUFFER_ACTIONS = ('test',)
+        pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL = 3600
+        pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD = 1000
+
+    def tearDown(self):
+        privateurl_usage.flush()
+        (pu_settings.DJU_PRIVATEURL_USAGE_BUFFER_ACTIONS,
+         pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_INTERVAL,
+         pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD) = self.settings_bak
+
+    def test_buffered(self):
+        t = PrivateUrl.create('test', used_limit=0)
+        with self.assertNumQueries(0):
+            self.assertTrue(t.redeem())
+            self.assertTrue(t.redeem())
+            t.used_counter_inc()
+        self.assertEqual(t.used_counter, 3)
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 0)
+        self.assertEqual(privateurl_usage.flush(), 3)
+        j = PrivateUrl.objects.get(pk=t.pk)
+        self.assertEqual(j.used_counter, 3)
+        self.assertEqual(j.first_used, t.first_used)
+        self.assertEqual(j.last_used, t.last_used)
+        self.assertEqual(privateurl_usage.flush(), 0)
+        t = PrivateUrl.create('test', used_limit=0, expire=datetime.timedelta(days=1))
+        self.assertFalse(t.redeem(dt=t.expire))
+        self.assertEqual(privateurl_usage.flush(), 0)
+
+    def test_flush_order(self):
+        now = timezone.now()
+        t = PrivateUrl.create('test', used_limit=0)
+        t.redeem(dt=now)
+        privateurl_usage.flush()
+        t.redeem(dt=now - datetime.timedelta(minutes=1))  # increment of other process flushed later
+        privateurl_usage.flush()
+        j = PrivateUrl.objects.get(pk=t.pk)
+        self.assertEqual(j.used_counter, 2)
+        self.assertEqual(j.last_used, now)
+
+    def test_threshold(self):
+        pu_settings.DJU_PRIVATEURL_USAGE_FLUSH_THRESHOLD = 2
+        t = PrivateUrl.create('test', used_limit=0)
+        t.redeem()
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 0)
+        t.redeem()
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 2)
+
+    def test_limited_not_buffered(self):
+        t = PrivateUrl.create('test', used_limit=2)
+        t.redeem()
+        t.used_counter_inc()
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 2)
+        self.assertEqual(privateurl_usage.flush(), 0)
+        t = PrivateUrl.create('test2', used_limit=0)
+        t.redeem()
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 1)
+
+
+class TestPrivateUrlKeyValueBackend(TestCase):
+    def setUp(self):
+        self.settings_bak = pu_settings.DJU_PRIVATEURL_BACKEND, pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS
+        pu_settings.DJU_PRIVATEURL_BACKEND = 'dju_privateurl.backends.kv.KeyValueBackend'
+        pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS = {'store': 'dju_privateurl.backends.kv.LocMemStore'}
+        self.backend = get_backend()
+        self.backend.store.clear()
+
+    def tearDown(self):
+        pu_settings.DJU_PRIVATEURL_BACKEND, pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS = self.settings_bak
+
+    def test_options(self):
+        self.assertIs(get_backend(), self.backend)
+        pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS = dict(pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS,
+                                                          key_prefix='other')
+        backend = get_backend()
+        self.assertIsNot(backend, self.backend)
+        self.assertEqual(backend.key_prefix, 'other')
+        self.assertIs(get_backend(), backend)
+
+    def test_create_get(self):
+        self.assertIsInstance(self.backend, KeyValueBackend)
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        d = {'k': ['v'], 'n': Decimal('1.10')}
+        with self.assertNumQueries(0):
+            t = PrivateUrl.create('test', user=user, data=d, expire=datetime.timedelta(days=1), used_limit=2)
+            j = PrivateUrl.objects.get_or_none('test', t.token)
+        self.assertEqual(PrivateUrl.objects.count(), 0)
+        self.assertEqual(j.user_id, user.pk)
+        self.assertEqual(j.data, d)
+        self.assertEqual(j.expire, t.expire)
+        self.assertEqual(j.created, t.created)
+        self.assertEqual(j.used_limit, 2)
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test2', t.token))
+        t = PrivateUrl.create('test', expire=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', t.token))
+
+    def test_redeem(self):
+        t = PrivateUrl.create('test', used_limit=2)
+        self.assertTrue(PrivateUrl.objects.get_or_none('test', t.token).redeem())
+        j = PrivateUrl.objects.get_or_none('test', t.token)
+        self.assertEqual(j.used_counter, 1)
+        self.assertTrue(t.redeem())
+        self.assertEqual(t.used_counter, 2)
+        self.assertEqual(t.first_used, j.first_used)
+        self.assertFalse(t.redeem())
+        self.assertFalse(j.redeem())
+        t = PrivateUrl.create('test', used_limit=0)
+        for i in xrange(3):
+            t.used_counter_inc()
+        self.assertEqual(PrivateUrl.objects.get_or_none('test', t.token).used_counter, 3)
+        t = PrivateUrl.create('test', auto_delete=True)
+        t.used_counter_inc()
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', t.token))
+
+    def test_replace(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        a = PrivateUrl.create('test', user=user)
+        b = PrivateUrl.create('test', user=user, replace=True)
+        self.assertIsNone(PrivateUrl.objects.get_or_none('test', a.token))
+        self.assertIsNotNone(PrivateUrl.objects.get_or_none('test', b.token))
+
+    def test_view(self):
+        t = PrivateUrl.create('test2')
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.status_code, 404)
+
+    def test_user_index(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        index_key = self.backend.make_index_key('test', user.pk)
+        a = PrivateUrl.create('test', user=user, auto_delete=True)
+        b = PrivateUrl.create('test', user=user, expire=datetime.timedelta(days=1))
+        self.assertEqual(self.backend.store.index_members(index_key), set([a.token, b.token]))
+        self.assertTrue(a.redeem())
+        a.used_counter_inc()  # auto_delete removes token from index
+        self.assertEqual(self.backend.store.index_members(index_key), set([b.token]))
+        b.discard()
+        self.assertEqual(self.backend.store.index_members(index_key), set())
+        PrivateUrl.create('test', user=user, expire=timezone.now() - datetime.timedelta(seconds=1))
+        time.sleep(0.01)
+        self.assertEqual(self.backend.store.index_members(index_key), set())  # index expires with its links
+
+    def test_concurrent_replace(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        tokens = []
+
+        def replace():
+            for i in xrange(20):
+                tokens.append(PrivateUrl.create('test', user=user, replace=True).token)
+
+        threads = [threading.Thread(target=replace) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(tokens), 160)
+        self.assertEqual(len([t for t in tokens if PrivateUrl.objects.get_or_none('test', t) is not None]), 1)
+        self.assertEqual(len(self.backend.store.index_members(self.backend.make_index_key('test', user.pk))), 1)
+
+
+def get_fake_redis():
+    try:
+        import fakeredis
+        client = fakeredis.FakeStrictRedis()
+        client.eval('return 1', 0)  # Lua scripts require lupa
+    except Exception:
+        return None
+    return client
+
+
+@skipUnless(get_fake_redis(), 'fakeredis with Lua support is not installed')
+class TestPrivateUrlRedisStore(TestPrivateUrlKeyValueBackend):
+    """
+    Tests of KeyValueBackend with Lua scripts of RedisStore.
+    """
+    def setUp(self):
+        super(TestPrivateUrlRedisStore, self).setUp()
+        client = get_fake_redis()
+        client.flushall()
+        pu_settings.DJU_PRIVATEURL_BACKEND_OPTIONS = {'store': 'dju_privateurl.backends.kv.RedisStore',
+                                                      'store_options': {'client': client}}
+        self.backend = get_backend()
+
+    def test_index_ttl(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        index_key = self.backend.make_index_key('test', user.pk)
+        PrivateUrl.create('test', user=user, expire=datetime.timedelta(hours=1))
+        self.assertAlmostEqual(self.backend.store.client.ttl(index_key), 3600, delta=5)
+        PrivateUrl.create('test', user=user, expire=datetime.timedelta(hours=2))
+        self.assertAlmostEqual(self.backend.store.client.ttl(index_key), 7200, delta=5)
+        PrivateUrl.create('test', user=user, expire=datetime.timedelta(minutes=1))
+        self.assertAlmostEqual(self.backend.store.client.ttl(index_key), 7200, delta=5)
+        PrivateUrl.create('test', user=user)
+        self.assertEqual(self.backend.store.client.ttl(index_key), -1)
+        PrivateUrl.create('test', user=user, expire=datetime.timedelta(minutes=1))
+        self.assertEqual(self.backend.store.client.ttl(index_key), -1)
+
+
+class TestPrivateUrlConcurrency(TransactionTestCase):
+    def _run_threads(self, func, threads_count=8):
+        """
+        Runs func in threads, exceptions of threads (including failed assertions) fail the test.
+        """
+        errors = []
+
+        def worker():
+            try:
+                func()
+            except Exception:
+                errors.append(traceback.format_exc())
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=worker) for _ in xrange(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise self.failureException('Exceptions in threads:\n{}'.format('\n'.join(errors)))
+
+    def test_redeem_no_over_redemption(self):
+        t = PrivateUrl.create('test', used_limit=5)
+        used = []
+
+        def redeem():
+            for i in xrange(10):
+                obj = PrivateUrl.objects.get(pk=t.pk)
+                while True:
+                    try:
+                        if obj.redeem():
+                            used.append(1)
+                        break
+                    except OperationalError:  # sqlite: database is locked
+                        time.sleep(0.001)
+
+        self._run_threads(redeem)
+        self.assertEqual(len(used), 5)
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 5)
+
+    def test_used_counter_inc(self):
+        t = PrivateUrl.create('test', used_limit=0)
+
+        def inc():
+            obj = PrivateUrl.objects.get(pk=t.pk)
+            for i in xrange(10):
+                while True:
+                    try:
+                        obj.used_counter_inc()
+                        break
+                    except OperationalError:  # sqlite: database is locked
+                        time.sleep(0.001)
+
+        self._run_threads(inc)
+        self.assertEqual(PrivateUrl.objects.get(pk=t.pk).used_counter, 80)
+
+    def test_replace(self):
+        user = get_user_model().objects.create(username='test', email='test@mail.com', password='test')
+        tokens, counts = [], []
+
+        def replace():
+            for i in xrange(5):
+                while True:
+                    try:
+                        tokens.append(PrivateUrl.create('test', user=user, replace=True).token)
+                        break
+                    except OperationalError:  # sqlite: database is locked
+                        time.sleep(0.001)
+                counts.append(PrivateUrl.objects.filter(action='test', user=user).count())
+
+        self._run_threads(replace)
+        self.assertEqual(len(tokens), 40)
+        self.assertEqual(counts, [1] * 40)
+        self.assertEqual(PrivateUrl.objects.filter(action='test', user=user).count(), 1)
+        self.assertIn(PrivateUrl.objects.get(action='test', user=user).token, tokens)
+
+
+class TestPrivateUrlMetrics(TestCase):
+    def setUp(self):
+        self.metrics_bak = pu_settings.DJU_PRIVATEURL_METRICS
+        pu_settings.DJU_PRIVATEURL_METRICS = 'dju_privateurl.metrics.InMemoryMetrics'
+        self.metrics = get_metrics()
+        self.metrics.reset()
+
+    def tearDown(self):
+        pu_settings.DJU_PRIVATEURL_METRICS = self.metrics_bak
+
+    def test_disabled(self):
+        pu_settings.DJU_PRIVATEURL_METRICS = None
+        self.assertIsNone(get_metrics())
+
+    def test_view(self):
+        t = PrivateUrl.create('test2', auto_delete=True)
+        self.client.get(t.get_absolute_url())
+        self.client.get(t.get_absolute_url())
+        t = PrivateUrl.create('test2', used_limit=1)
+        self.client.get(t.get_absolute_url())
+        self.client.get(t.get_absolute_url())
+        t = PrivateUrl.create('test2', expire=timezone.now() - datetime.timedelta(seconds=1))
+        self.client.get(t.get_absolute_url())
+        stats = self.metrics.get_stats()
+        self.assertEqual(stats['counts'], {
+            ('ok', 'test2'): 2, ('fail', 'test2'): 3,
+            ('not_found', 'test2'): 1, ('exhausted', 'test2'): 1, ('expired', 'test2'): 1,
+        })
+        for phase in ('lookup', 'redeem', 'receivers', 'total'):
+            self.assertEqual(stats['timings'][(phase, 'test2')]['count'], 5)
+        self.assertEqual(stats['timings'][('delete', 'test2')]['count'], 1)
+        item = stats['timings'][('total', 'test2')]
+        self.assertTrue(0 <= item['p50'] <= item['p90'] <= item['p99'] <= item['max'])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(InMemoryMetrics.percentile(values, 50), 50)
+        self.assertEqual(InMemoryMetrics.percentile(values, 99), 99)
+        self.assertEqual(InMemoryMetrics.percentile([7], 90), 7)
+        self.assertIsNone(InMemoryMetrics.percentile([], 50))
+
+    def test_create_retry(self):
+        t = PrivateUrl.create('test')
+        generate_token_bak, generate_tokens_bak = PrivateUrl.generate_token, PrivateUrl.generate_tokens
+        try:
+            PrivateUrl.generate_token = classmethod(lambda cls, size=None, dash_split_each=None: t.token)
+            PrivateUrl.generate_tokens = classmethod(
+                lambda cls, n, size=None, dash_split_each=None: [t.token, 'b' * 40, 'b' * 40]
+            )
+            PrivateUrl.create('test')
+        finally:
+            PrivateUrl.generate_token, PrivateUrl.generate_tokens = generate_token_bak, generate_tokens_bak
+        self.assertEqual(self.metrics.get_stats()['counts'], {('create_retry', 'test'): 3})
+
 
 class TestPrivateUrlView(TestCase):
     @classmethod
@@ -149,6 +1245,21 @@ class TestPrivateUrlView(TestCase):
         response = self.client.get(t.get_absolute_url())
         self.assertEqual(response.status_code, 404)
 
+    def test_receivers_signed(self):
+        t = PrivateUrl.create_signed('test', expire=datetime.timedelta(days=1), data={'k': 'v'})
+        for i in xrange(2):
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, 'ok')
+        t = PrivateUrl.create_signed('test', expire=datetime.timedelta(seconds=-1))
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.content, 'fail')
+        t = PrivateUrl.create_signed('test2')
+        response = self.client.get(t.get_absolute_url() + 'x')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.status_code, 302)
+
     def test_receivers2(self):
         t = PrivateUrl.create('test2')
         response = self.client.get(t.get_absolute_url())
@@ -156,8 +1267,281 @@ class TestPrivateUrlView(TestCase):
         response = self.client.get(t.get_absolute_url())
         self.assertEqual(response.status_code, 404)
 
+    def test_action_handlers(self):
+        calls = []
+
+        @action_handler(privateurl_ok, 'test')
+        def ok(request, obj, action):
+            calls.append(obj.token)
+            return HttpResponse('handler ok')
+
+        @action_handler([privateurl_ok, privateurl_fail], 'test2')
+        def skip(request, obj, action):
+            calls.append(action)
+
+        try:
+            t = PrivateUrl.create('test')
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.content, 'handler ok')
+            self.assertEqual(calls, [t.token])
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.content, 'fail')  # no handler of privateurl_fail, receiver is used
+            t = PrivateUrl.create('test2')
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.status_code, 302)  # handler returned None
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(calls[1:], ['test2', 'test2'])
+        finally:
+            privateurl_ok.disconnect_action('test', ok)
+            privateurl_ok.disconnect_action('test2')
+            privateurl_fail.disconnect_action('test2', skip)
+        self.assertEqual(privateurl_ok.handlers, {})
+        self.assertEqual(privateurl_fail.handlers, {})
+
+    def test_fast_lookup(self):
+        fast_lookup_bak = pu_settings.DJU_PRIVATEURL_FAST_LOOKUP
+        pu_settings.DJU_PRIVATEURL_FAST_LOOKUP = True
+        try:
+            t = PrivateUrl.create('test', auto_delete=True)
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.content, 'ok')
+            self.assertFalse(PrivateUrl.objects.filter(pk=t.pk).exists())
+            response = self.client.get(t.get_absolute_url())
+            self.assertEqual(response.content, 'fail')
+        finally:
+            pu_settings.DJU_PRIVATEURL_FAST_LOOKUP = fast_lookup_bak
+
+
+class TestPrivateUrlBloom(TestCase):
+    def setUp(self):
+        self.settings_bak = (pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS, pu_settings.DJU_PRIVATEURL_BLOOM_DIR,
+                             pu_settings.DJU_PRIVATEURL_BLOOM_FP_RATE)
+        pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS = ('test',)
+        pu_settings.DJU_PRIVATEURL_BLOOM_FP_RATE = 1e-6
+        bloom.get_cache().clear()
+        bloom.reset()
+
+    def tearDown(self):
+        (pu_settings.DJU_PRIVATEURL_BLOOM_ACTIONS, pu_settings.DJU_PRIVATEURL_BLOOM_DIR,
+         pu_settings.DJU_PRIVATEURL_BLOOM_FP_RATE) = self.settings_bak
+        bloom.get_cache().clear()
+        bloom.reset()
+
+    def test_filter(self):
+        f = bloom.BloomFilter.for_capacity(1000, 0.01)
+        tokens = PrivateUrl.generate_tokens(1000)
+        for token in tokens:
+            f.add(token)
+        self.assertTrue(all(token in f for token in tokens))
+        false_positives = sum(token in f for token in PrivateUrl.generate_tokens(10000))
+        self.assertLess(false_positives, 300)
+        f2 = bloom.BloomFilter.from_bytes(f.to_bytes())
+        self.assertEqual((f2.size, f2.hashes, f2.bits), (f.size, f.hashes, f.bits))
+        with self.assertRaises(ValueError):
+            bloom.BloomFilter.from_bytes('x' * 20)
+
+    def test_may_contain(self):
+        t = PrivateUrl.create('test')
+        self.assertTrue(bloom.may_contain('test', 'unknown'))  # not built
+        self.assertEqual(bloom.build(PrivateUrl, 'test'), 1)
+        self.assertTrue(bloom.may_contain('test', t.token))
+        self.assertFalse(bloom.may_contain('test', 'unknown'))
+        self.assertTrue(bloom.may_contain('test2', 'unknown'))
+        t2 = PrivateUrl.create('test')
+        t3 = PrivateUrl.bulk_create_tokens('test', 2)
+        self.assertTrue(bloom.may_contain('test', t2.token))
+        bloom.reset()  # other process
+        for obj in [t, t2] + t3:
+            self.assertTrue(bloom.may_contain('test', obj.token))
+        self.assertFalse(bloom.may_contain('test', 'unknown'))
+        self.assertEqual(bloom.get_info('test')['additions'], 2)
+
+    def test_orm(self):
+        bloom.build(PrivateUrl, 'test')
+        t = PrivateUrl.objects.create(action='test', token=PrivateUrl.generate_token())
+        self.assertTrue(bloom.may_contain('test', t.token))
+        self.assertEqual(self.client.get(t.get_absolute_url()).status_code, 302)
+        obj = PrivateUrl.objects.get(pk=t.pk)
+        obj.save()  # token is not changed
+        self.assertEqual(bloom.get_info('test')['additions'], 1)
+        obj.token = PrivateUrl.generate_token()
+        obj.save()
+        bloom.reset()
+        self.assertTrue(bloom.may_contain('test', obj.token))
+        self.assertEqual(bloom.get_info('test')['additions'], 2)
+        obj = next(serializers.deserialize('json', serializers.serialize('json', [obj])))
+        obj.object.pk, obj.object.token = None, PrivateUrl.generate_token()
+        obj.save()  # loaddata
+        self.assertTrue(bloom.may_contain('test', obj.object.token))
+        self.assertFalse(bloom.may_contain('test', 'unknown'))
+
+    def test_refresh_without_lock(self):
+        bloom.build(PrivateUrl, 'test')
+        t = PrivateUrl.create('test')
+        cache, locked = bloom.get_cache(), []
+        get_many = cache.get_many
+
+        def checked_get_many(*args, **kwargs):
+            locked.append(bloom._lock.locked())
+            return get_many(*args, **kwargs)
+
+        cache.get_many = checked_get_many
+        try:
+            self.assertTrue(bloom.may_contain('test', t.token))
+            self.assertFalse(bloom.may_contain('test', 'unknown'))
+        finally:
+            del cache.get_many
+        self.assertTrue(locked)
+        self.assertFalse(any(locked))
+
+    def test_lost_journal(self):
+        PrivateUrl.create('test')
+        bloom.build(PrivateUrl, 'test')
+        self.assertFalse(bloom.may_contain('test', 'unknown'))
+        t = PrivateUrl.create('test')
+        bloom.get_cache().delete(bloom.make_key('test', 'journal:{}'.format(bloom.get_cache().get(
+            bloom.make_key('test', 'seq')))))
+        self.assertTrue(bloom.may_contain('test', 'unknown'))  # filter is not used until next build
+        bloom.build(PrivateUrl, 'test')
+        self.assertTrue(bloom.may_contain('test', t.token))
+        self.assertFalse(bloom.may_contain('test', 'unknown'))
+        bloom.get_cache().delete(bloom.make_key('test', 'seq'))
+        bloom.reset()
+        self.assertTrue(bloom.may_contain('test', 'unknown'))
+
+    def test_view(self):
+        t = PrivateUrl.create('test')
+        bloom.build(PrivateUrl, 'test')
+        url = reverse('dju_privateurl', kwargs={'action': 'test', 'token': 'unknown'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(t.get_absolute_url()).status_code, 302)
+        self.assertEqual(self.client.get(PrivateUrl.create('test').get_absolute_url()).status_code, 302)
+        self.assertEqual(self.client.get(PrivateUrl.create_signed('test').get_absolute_url()).status_code, 302)
+
+    def test_dir(self):
+        pu_settings.DJU_PRIVATEURL_BLOOM_DIR = tempfile.mkdtemp()
+        try:
+            t = PrivateUrl.create('test')
+            bloom.build(PrivateUrl, 'test')
+            path = bloom.get_info('test')['path']
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue(bloom.may_contain('test', t.token))
+            self.assertFalse(bloom.may_contain('test', 'unknown'))
+            bloom.build(PrivateUrl, 'test')
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(bloom.may_contain('test', t.token))
+            self.assertFalse(bloom.may_contain('test', 'unknown'))
+        finally:
+            shutil.rmtree(pu_settings.DJU_PRIVATEURL_BLOOM_DIR)
+
+    def test_command(self):
+        PrivateUrl.create('test')
+        out = StringIO()
+        call_command('build_privateurl_bloom', '--if-stale', stdout=out)
+        self.assertIn('test: 1 tokens', out.getvalue())
+        self.assertFalse(bloom.is_stale('test'))
+        out = StringIO()
+        call_command('build_privateurl_bloom', '--if-stale', stdout=out)
+        self.assertEqual(out.getvalue(), '')
+        with self.assertRaises(CommandError):
+            call_command('build_privateurl_bloom', '--action=test2', stdout=out)
+
+
+def throttled_response(request, action, retry_after):
+    return HttpResponse('slow down {}'.format(action), status=429)
+
+
+class TestPrivateUrlThrottling(TestCase):
+    def setUp(self):
+        self.settings_bak = (pu_settings.DJU_PRIVATEURL_THROTTLE_IP, pu_settings.DJU_PRIVATEURL_THROTTLE_ACTION,
+                             pu_settings.DJU_PRIVATEURL_THROTTLE_RESPONSE, pu_settings.DJU_PRIVATEURL_TOKEN_FORMATS,
+                             pu_settings.DJU_PRIVATEURL_THROTTLE_IP_HEADER,
+                             pu_settings.DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES)
+        throttling.get_cache().clear()
+
+    def tearDown(self):
+        (pu_settings.DJU_PRIVATEURL_THROTTLE_IP, pu_settings.DJU_PRIVATEURL_THROTTLE_ACTION,
+         pu_settings.DJU_PRIVATEURL_THROTTLE_RESPONSE, pu_settings.DJU_PRIVATEURL_TOKEN_FORMATS,
+         pu_settings.DJU_PRIVATEURL_THROTTLE_IP_HEADER,
+         pu_settings.DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES) = self.settings_bak
+        throttling.get_cache().clear()
+
+    def test_token_format(self):
+        generator = get_token_generator((8, 12), 4)
+        self.assertTrue(all(generator.is_valid(token) for token in generator.generate_tokens(100)))
+        for token in ('abcd-efgh', 'abcd-efgh-ijkl', 'abcd-efgh-i'):
+            self.assertTrue(generator.is_valid(token), token)
+        for token in ('abcd-efg', 'abcdefgh', 'abcd-efgh-ijkl-m', 'abc-defgh', 'abcd-efgh-', 'abcd-ef_h', ''):
+            self.assertFalse(generator.is_valid(token), token)
+        self.assertTrue(get_token_generator(10, 0).is_valid('a' * 10))
+        self.assertFalse(get_token_generator(10, 0).is_valid('a' * 4 + '-' + 'a' * 5))
+
+    def test_view_token_format(self):
+        pu_settings.DJU_PRIVATEURL_TOKEN_FORMATS = {'test': (16, 8)}
+        t = PrivateUrl.create('test', token_size=16, dash_split_each=8)
+        self.assertTrue(PrivateUrl.is_valid_token('test', t.token))
+        self.assertTrue(PrivateUrl.is_valid_token('test2', 'x'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('dju_privateurl', kwargs={'action': 'test', 'token': t.token[:-1]}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.status_code, 302)
+        t = PrivateUrl.create_signed('test')
+        response = self.client.get(t.get_absolute_url())
+        self.assertEqual(response.status_code, 302)
+
+    def test_ip(self):
+        pu_settings.DJU_PRIVATEURL_THROTTLE_IP = (3, 60)
+        url = PrivateUrl.create('test', used_limit=0).get_absolute_url()
+        for i in xrange(3):
+            self.assertEqual(self.client.get(url).status_code, 302)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 302)
+        self.assertEqual(self.client.get(PrivateUrl.create('test2').get_absolute_url()).status_code, 302)
+
+    def test_forwarded_ip(self):
+        pu_settings.DJU_PRIVATEURL_THROTTLE_IP = (2, 60)
+        pu_settings.DJU_PRIVATEURL_THROTTLE_IP_HEADER = 'HTTP_X_FORWARDED_FOR'
+        url = PrivateUrl.create('test', used_limit=0).get_absolute_url()
+        for i in xrange(2):  # spoofed first addresses don't give new buckets
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='1.1.1.{}, 10.0.0.1'.format(i)).status_code, 302)
+        self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='1.1.1.9, 10.0.0.1').status_code, 429)
+        self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 302)
+        pu_settings.DJU_PRIVATEURL_THROTTLE_TRUSTED_PROXIES = 2
+        request = RequestFactory().get(url, HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.3, 192.168.0.1')
+        self.assertEqual(throttling.get_client_ip(request), '10.0.0.3')
+        request = RequestFactory().get(url, HTTP_X_FORWARDED_FOR='10.0.0.3')
+        self.assertEqual(throttling.get_client_ip(request), '10.0.0.3')
+
+    def test_action(self):
+        pu_settings.DJU_PRIVATEURL_THROTTLE_ACTION = (2, 10)
+        pu_settings.DJU_PRIVATEURL_THROTTLE_RESPONSE = 'tests.tests.throttled_response'
+        url = reverse('dju_privateurl', kwargs={'action': 'test', 'token': 'unknown'})
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 404)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.content, 'slow down test')
+        url = reverse('dju_privateurl', kwargs={'action': 'test2', 'token': 'unknown'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_consume(self):
+        now = time.time()
+        self.assertEqual(throttling.consume('k', 2, 10, now=now), 0)
+        self.assertEqual(throttling.consume('k', 2, 10, now=now), 0)
+        self.assertAlmostEqual(throttling.consume('k', 2, 10, now=now + 1), 4)
+        self.assertEqual(throttling.consume('k', 2, 10, now=now + 5), 0)
+        self.assertAlmostEqual(throttling.consume('k', 2, 10, now=now + 5), 5)
+
 
 class TestPrivateUrlAdmin(TestCase):
+    multi_db = True
+
     @classmethod
     def setUpClass(cls):
         super(TestPrivateUrlAdmin, cls).setUpClass()
@@ -173,3 +1557,83 @@ class TestPrivateUrlAdmin(TestCase):
     def test_admin_list(self):
         response = self.client.get(resolve_url('admin:dju_privateurl_privateurl_changelist'))
         self.assertEqual(response.status_code, 200)
+
+    def test_admin_filters(self):
+        privateurl_cache.get_cache().clear()
+        a = PrivateUrl.create('test2')
+        b = PrivateUrl.create('test2', expire=datetime.timedelta(days=-1))
+        c = PrivateUrl.create('test2')
+        c.redeem()
+        url = resolve_url('admin:dju_privateurl_privateurl_changelist')
+        response = self.client.get(url)
+        self.assertEqual([choice['display'] for choice in response.context['cl'].filter_specs[0].choices(
+            response.context['cl'])], ['All', 'test', 'test2'])
+        for status, objs in (('active', {a}), ('expired', {b}), ('exhausted', {c})):
+            response = self.client.get(url, {'action': 'test2', 'status': status})
+            self.assertEqual(set(response.context['cl'].result_list), objs)
+            self.assertEqual([obj.is_active for obj in response.context['cl'].result_list], [status == 'active'])
+        response = self.client.get(url, {'action': 'test2', 'o': '6'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_count(self):
+        privateurl_cache.get_cache().clear()
+        qs = PrivateUrl.objects.filter(action='test2')
+        PrivateUrl.create('test2')
+        self.assertEqual(CachedCountPaginator(qs, 10).count, 1)
+        PrivateUrl.create('test2')
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedCountPaginator(qs, 10).count, 1)
+        self.assertEqual(CachedCountPaginator(PrivateUrl.objects.all(), 10).count, 3)
+
+    def test_admin_changelist_count(self):
+        privateurl_cache.get_cache().clear()
+        url = resolve_url('admin:dju_privateurl_privateurl_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'action': 'test'})
+        counts = [q['sql'] for q in queries.captured_queries if 'COUNT(' in q['sql'].upper()]
+        self.assertEqual(len(counts), 1)
+        self.assertNotIn('CASE', counts[0].upper())  # is_active annotation is not counted
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'action': 'test'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q['sql'] for q in queries.captured_queries if 'COUNT(' in q['sql'].upper()], [])
+
+    def test_admin_actions(self):
+        url = resolve_url('admin:dju_privateurl_privateurl_changelist')
+        objs = [PrivateUrl.create('test2') for _ in xrange(3)]
+        response = self.client.post(url, {'action': 'expire_selected', '_selected_action': [o.pk for o in objs[:2]]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([o.pk for o in objs if PrivateUrl.objects.get(pk=o.pk).is_available()], [objs[2].pk])
+        response = self.client.post(url, {'action': 'purge_selected', '_selected_action': [o.pk for o in objs[1:]]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(PrivateUrl.objects.filter(action='test2')), [objs[0]])
+
+    def test_admin_translations(self):
+        with translation.override('uk'):
+            self.assertNotEqual(unicode(PrivateUrl._meta.verbose_name_plural), u'private urls')
+            for message in ('status', 'Expire selected private urls', 'Delete selected private urls'):
+                self.assertNotEqual(translation.ugettext(message), message)
+            for count in (1, 2, 5):
+                message = translation.ungettext('%d private url is deleted.', '%d private urls are deleted.', count)
+                self.assertNotIn('private', message)
+                self.assertIn('%d', message)
+
+    def test_admin_databases(self):
+        privateurl_cache.get_cache().clear()
+        action_databases_bak = pu_settings.DJU_PRIVATEURL_ACTION_DATABASES
+        pu_settings.DJU_PRIVATEURL_ACTION_DATABASES = {'test-shard': 'shard'}
+        try:
+            objs = [PrivateUrl.create('test-shard') for _ in xrange(2)]
+            url = resolve_url('admin:dju_privateurl_privateurl_changelist')
+            response = self.client.get(url)
+            self.assertEqual([choice['display'] for choice in response.context['cl'].filter_specs[0].choices(
+                response.context['cl'])], ['All', 'test', 'test-shard'])
+            response = self.client.get(url, {'action': 'test-shard'})
+            self.assertEqual(set(response.context['cl'].result_list), set(objs))
+            response = self.client.post(url + '?action=test-shard', {
+                'action': 'purge_selected', '_selected_action': [objs[0].pk],
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(list(PrivateUrl.objects.using('shard').filter(action='test-shard')), [objs[1]])
+        finally:
+            pu_settings.DJU_PRIVATEURL_ACTION_DATABASES = action_databases_bak
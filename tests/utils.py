@@ -0,0 +1,39 @@
+# coding=utf-8
+"""
+Helpers shared by tests and benchmarks.
+"""
+from collections import OrderedDict
+from django.db import connection
+from django.utils import timezone
+from dju_privateurl.models import PrivateUrl
+
+
+def explain(qs):
+    """
+    Returns query plan of queryset (sqlite and postgresql).
+    """
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '; '.join(str(row[-1]) for row in cursor.fetchall())
+        cursor.execute('EXPLAIN ' + sql, params)
+        return '; '.join(row[0] for row in cursor.fetchall())
+
+
+def get_index_name(*columns):
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, PrivateUrl._meta.db_table)
+    for name, info in constraints.items():
+        if info['index'] and tuple(info['columns']) == columns:
+            return name
+
+
+def get_query_shapes(user_id=1):
+    now = timezone.now()
+    return OrderedDict((
+        ('lookup (action, token)', PrivateUrl.objects.filter(action='bench', token='token')),
+        ('replace (user, action)', PrivateUrl.objects.filter(action='bench', user_id=user_id).order_by()),
+        ('admin (action) order by -created', PrivateUrl.objects.filter(action='bench').order_by('-created')[:100]),
+        ('cleanup (expire)', PrivateUrl.objects.filter(expire__lte=now).order_by()),
+    ))
@@ -13,12 +13,13 @@ from django.core.management.utils import handle_extensions
 APPS = ('dju_privateurl',)
 LANGUAGES = ('en', 'uk', 'ru')
 
-COMMANDS_LIST = ('makemessages', 'compilemessages', 'testmanage', 'test', 'release')
+COMMANDS_LIST = ('makemessages', 'compilemessages', 'testmanage', 'test', 'bench', 'release')
 COMMANDS_INFO = {
     'makemessages': 'make po-files',
     'compilemessages': 'compile po-files to mo-files',
     'testmanage': 'run manage for test project',
     'test': 'run tests (eq. "testmanage test")',
+    'bench': 'run benchmarks (all or listed by name; --rows, --json, --compare, see tests/benchmarks.py)',
     'release': 'make distributive and upload to pypi (setup.py bdist_wheel upload)'
 }
 
@@ -113,6 +114,15 @@ def test(*args):
     testmanage('test', *args)
 
 
+def bench(*args):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import django
+    django.setup()
+    from tests.benchmarks import run
+    run(*args)
+
+
 def release(*args):
     root_dir = os.path.dirname(os.path.abspath(__file__))
     shutil.rmtree(os.path.join(root_dir, 'build'), ignore_errors=True)